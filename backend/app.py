@@ -1,27 +1,144 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file, abort, Response, stream_with_context
+import asyncio
+import contextvars
 import json
 import os
 import time
 import uuid
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import base64
+import requests
 
 # Import your API clients and helper functions.
 from openai import OpenAI
 from elevenlabs.client import ElevenLabs
 from elevenlabs import play
-from runway import RunwayUnofficial
-
-import threading
+from runway import RunwayUnofficial, USEAPI_API_KEY, STREAM_CHUNK_SIZE, RUNWAY_CAPACITY
+from stages import StageGraph
+from speculation import SpeculativeScenes
+from cache import DiskCache, SingleFlight, SharedResults, make_key
+from events import StoryEvents, TERMINAL_EVENTS
+from scheduler import JobScheduler, StageLimits, QueueFull, PRIORITY_SPECULATIVE
+from store import create_story_store, split_fields
+from prompts import init_story_prompt, story_part_prompt, storyline_summary_prompt, parse_scene_reply, InvalidSceneReply, streamed_scene_prompt
+from async_pipeline import AsyncPipeline, EventLoopThread
+from json_stream import SceneStreamParser
+from storyline import StorylineContext, estimate_tokens
+from tree_builder import TreeBuilder
+from scenes import make_scene_node, context_from_scene
+from catalog import StoryCatalog
+from streaming_assets import StreamingAssets, follow_file
+from hedging import HedgedCalls
+from scene_race import SceneRace, scene_llm_seconds
+from media_prep import MediaPrep, FORMATS as FRAME_FORMATS
+from metrics import registry, span, tracing, upstream_retries, upstream_first_byte, counted
 
 load_dotenv()
 
 app = Flask(__name__)
 
 # ----------------------------
-# Global in‑memory story state.
-stories = {}
+# Images are uploaded to Runway as frames of the video's own size (see
+# media_prep.py): a 1280x768 JPEG is a fraction of the 1792x1024 DALLE PNG.
+# RUNWAY_FRAME_FORMAT=original uploads the PNGs unchanged. Set up first, while
+# this process has no other threads, so the frame workers can be forked.
+RUNWAY_FRAME_FORMAT    = os.getenv('RUNWAY_FRAME_FORMAT', 'jpeg').lower()
+RUNWAY_FRAME_QUALITY   = int(os.getenv('RUNWAY_FRAME_QUALITY', '85'))
+FRAME_CACHE_DIR        = os.getenv('FRAME_CACHE_DIR', 'cache/frames')
+FRAME_CACHE_MAX_BYTES  = int(os.getenv('FRAME_CACHE_MAX_BYTES', str(256 * 1024**2)))
+MEDIA_PREP_WORKERS     = int(os.getenv('MEDIA_PREP_WORKERS', '0')) or None
+media_prep = None
+if RUNWAY_FRAME_FORMAT != 'original':
+    media_prep = MediaPrep(
+        DiskCache(FRAME_CACHE_DIR, FRAME_CACHE_MAX_BYTES, extension=FRAME_FORMATS.get(RUNWAY_FRAME_FORMAT, '')),
+        fmt=RUNWAY_FRAME_FORMAT, quality=RUNWAY_FRAME_QUALITY, workers=MEDIA_PREP_WORKERS,
+    )
+
+# ----------------------------
+# Story state. "memory" keeps it in this process; "sqlite" keeps it in a file
+# that survives restarts and can be shared by several workers on the machine,
+# as long as they also share the cache directories. Progress events,
+# speculative scenes and /initialize coalescing stay per worker: requests that
+# reach another worker fall back to the stored status (see wait_for_scene).
+STORY_TTL = int(os.getenv('STORY_TTL', str(6 * 3600)))
+stories = create_story_store(
+    os.getenv('STORY_STORE', 'memory'),
+    ttl=STORY_TTL,
+    path=os.getenv('STORY_STORE_PATH', 'stories.db'),
+    max_stories=int(os.getenv('STORY_STORE_MAX', '10000')),
+    max_scenes=int(os.getenv('SCENE_STORE_MAX', '100000')),
+)
+
+# Progress events for the scene each story is generating (see /story_events).
+story_events = StoryEvents()
+# How often long-polls and event streams re-read the stored status, which is
+# all they see of scenes another worker is generating.
+STATUS_RECHECK_SECONDS = float(os.getenv('STATUS_RECHECK_SECONDS', '2'))
+# Event published when each scene stage finishes.
+STAGE_EVENTS = {
+    "llm": "llm_done",
+    "images": "images_done",
+    "video": "video_done",
+    "narration": "audio_done",
+}
+
+# ----------------------------
+# Story jobs run on a fixed worker pool with a bounded queue; each upstream
+# provider gets its own concurrency limit to match its quota. Background jobs
+# (speculative scenes, storyline summaries) have their own queue and at most
+# STORY_BACKGROUND_WORKERS of the workers, so they never crowd out players.
+STORY_WORKERS = int(os.getenv('STORY_WORKERS', '8'))
+scheduler = JobScheduler(
+    workers=STORY_WORKERS,
+    max_queue=int(os.getenv('STORY_QUEUE_SIZE', '32')),
+    background_workers=int(os.getenv('STORY_BACKGROUND_WORKERS', str(STORY_WORKERS // 2))),
+    max_background_queue=int(os.getenv('STORY_BACKGROUND_QUEUE_SIZE', '32')),
+)
+stage_limits = StageLimits({
+    "llm": int(os.getenv('LLM_CONCURRENCY', '8')),
+    "images": int(os.getenv('IMAGE_CONCURRENCY', '6')),
+    # Every Runway account's task slots (see runway_accounts.py).
+    "video": int(os.getenv('VIDEO_CONCURRENCY', str(RUNWAY_CAPACITY))),
+    "tts": int(os.getenv('TTS_CONCURRENCY', '4')),
+})
+# Shared by every story instead of a new pool per generate_images_parallel call.
+image_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="image")
+
+# A DALLE call still running past IMAGE_HEDGE_PERCENTILE of recent call
+# latencies gets a duplicate request (when there is a free image slot) and
+# the first result wins; calls failing on a rate limit, 5xx, timeout or
+# dropped connection are retried IMAGE_RETRIES times.
+IMAGE_HEDGE_PERCENTILE = float(os.getenv('IMAGE_HEDGE_PERCENTILE', '90'))
+IMAGE_RETRIES = int(os.getenv('IMAGE_RETRIES', '2'))
+
+def image_slot_free():
+    images = stage_limits.stats()["images"]
+    return images["in_use"] < images["limit"]
+
+image_calls = HedgedCalls(
+    "dalle",
+    executor=ThreadPoolExecutor(max_workers=16, thread_name_prefix="dalle"),
+    percentile=IMAGE_HEDGE_PERCENTILE,
+    retries=IMAGE_RETRIES,
+    can_hedge=image_slot_free,
+)
+
+# Latency budgets for live scenes, in seconds from when the scene starts
+# generating. A video that misses its budget (or fails) is replaced by a
+# slideshow of the scene's images, and narration audio by captions only;
+# either is attached to the scene once it arrives. 0 turns a fallback off.
+SCENE_BUDGETS = {
+    "video": float(os.getenv('SCENE_VIDEO_BUDGET', '120')),
+    "narration": float(os.getenv('SCENE_NARRATION_BUDGET', '30')),
+}
+
+# ----------------------------
+# Optional catalog of pre-generated story trees (see catalog.py). Stories
+# started from a catalog theme are answered from it while their path is
+# known, and scenes generated live are written back into it.
+CATALOG_PATH = os.getenv('CATALOG_PATH')
+catalog = StoryCatalog(CATALOG_PATH) if CATALOG_PATH else None
 
 # ----------------------------
 # Setup API clients using environment variables.
@@ -30,312 +147,1073 @@ OPENAI_MODEL     = os.getenv('OPENAI_MODEL')
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
 # For video generation – choose your preferred runway client.
-runway_client = RunwayUnofficial()
+runway_client = RunwayUnofficial(media_prep=media_prep)
+
+# Stream scene completions so image prompts and narration can be dispatched early.
+LLM_STREAMING = os.getenv('LLM_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+LLM_JSON_MODE = os.getenv('LLM_JSON_MODE', 'true').lower() in ('1', 'true', 'yes')
+
+# Scene models by tier: story openings set the tone, so they can use a
+# stronger model than the continuations that follow. Both default to OPENAI_MODEL.
+SCENE_MODELS = {
+    "opening": os.getenv('OPENAI_MODEL_OPENING') or OPENAI_MODEL,
+    "continuation": os.getenv('OPENAI_MODEL_CONTINUATION') or OPENAI_MODEL,
+}
+# LLM_RACE > 1 sends that many completions per scene attempt at once and uses
+# the first valid reply, stopping the rest. Each takes an LLM_CONCURRENCY slot;
+# scene_llm_calls_total counts the wasted ones. Racing scenes aren't streamed
+# into the pipeline: images and narration start once the winner is known.
+LLM_RACE = max(1, int(os.getenv('LLM_RACE', '1')))
+llm_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-race")
 
 ELEVENLABS_API_KEY = os.getenv('ELEVENLABS_API_KEY')
-elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+# Like OPENAI_BASE_URL (read by the OpenAI client itself) and USEAPI_BASE_URL,
+# this can point at fake_providers.py for benchmarking.
+ELEVENLABS_BASE_URL = os.getenv('ELEVENLABS_BASE_URL')
+elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY, base_url=ELEVENLABS_BASE_URL)
+
+# ----------------------------
+# Local cache of generated images. DALLE URLs expire after a while, so images
+# are kept on disk and served from /images/<key>.png instead.
+IMAGE_CACHE_DIR       = os.getenv('IMAGE_CACHE_DIR', 'cache/images')
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(2 * 1024**3)))
+image_cache = DiskCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, extension=".png")
+
+# Same for narration audio. Identical narrations share one ElevenLabs call,
+# even when they are requested at the same time.
+AUDIO_CACHE_DIR       = os.getenv('AUDIO_CACHE_DIR', 'cache/audio')
+AUDIO_CACHE_MAX_BYTES = int(os.getenv('AUDIO_CACHE_MAX_BYTES', str(512 * 1024**2)))
+audio_cache = DiskCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, extension=".mp3")
+narration_flight = SingleFlight()
+
+# Streamed narration is written to disk as it arrives and can be played from
+# /audio/<key>.mp3 from the first chunk on; the narration stage (and the
+# story's "narration" status) is ready at that point.
+NARRATION_STREAMING = os.getenv('NARRATION_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+narration_streams = StreamingAssets(audio_cache)
+narration_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="narration")
+
+# Optional coalescing of identical /initialize requests: callers with the same
+# theme share one pipeline run, and each gets its own story at the shared
+# first scene. Results are reused for INIT_RESULT_TTL seconds afterwards.
+INIT_COALESCING = os.getenv('INIT_COALESCING', 'false').lower() in ('1', 'true', 'yes')
+init_flights = SharedResults(ttl=int(os.getenv('INIT_RESULT_TTL', '30')))
 
 # ----------------------------
 # Helper functions
-def init_story(user_theme, max_retries=3):
-    prompt = f"""
-    You are an AI Narration and Storyteller assistant. Create a narrative using the user provided theme, with either a cartoon or realistic style. To help yourself create this narrative, give an overview of it in 2-3 sentences. Now this narrative must end with the story being able to go in several directions, and explicitly state the next possible actions the users can take, like an interactive story.
-
-    Additionally, create three image descriptions to showcase the scene over 10 seconds. When crafting these image descriptions, follow these important guidelines to ensure consistency across all images:
-    1. **Consistent Core Details:** Use the exact same core character description and style attributes for every image prompt. Only modify the scenario portion to depict different dynamic actions or emotions.
-    2. **Active, Full-Body Poses:** Use dynamic, active verbs in each scenario so that the character is depicted in full-body action poses rather than static or close-up shots.
-    3. **Uniform Background and Style:** Keep the background and overall visual style (digital painting, gradient shading, clean linework, vibrant palette, stylized proportions) consistent throughout the three prompts.
-    4. **Exact Template Usage:** Always use a consistent template for the core character and style. For example, you might use the following template:
-       "Digital painting of a distinctly feminine green-eyed, white-furred tabaxi monk (with fluffy cheeks and a tuft on her head) with gradient shading, clean linework, vibrant palette, and stylized proportions. Wearing a simple green monk tunic and carrying a pack, [scenario]"
-       **Important:** This tabaxi monk example is provided solely as an example. You may choose a different character description if it better fits your narrative, but whichever core character you choose must remain exactly the same across all three image prompts.
-       Replace "[scenario]" with a brief description that always includes:
-         - a specific setting,
-         - a dynamic action (using strong, active verbs), and
-         - an emotion that the character is expressing.
-
-    Additionally, include a new key "core_details" in your JSON output. This key should contain the exact string used to define the core character and style (i.e. the part before the [scenario]). This value will be used by later scenes to ensure consistency.
-
-    You will output only valid JSON—no extra keys, no Markdown formatting, and no disclaimers.
-    Your JSON must have the following keys in the top-level object:
-    1. storyline: String. This contains a text description of the storyline so far.
-    2. image_prompts: List of 3 Strings. Each is a prompt to DALLE, which will generate an image for part of the scene.
-    3. video_generation_prompt: String. This prompt is to a video generation model which will be fed the 3 images, and this text to create the video. (no need to mention here that the video should be 10 seconds). Keep it concise.
-    4. narration: A textual narration which will be used as closed captioning and be read aloud along the video. 2 short sentences max (to fit in 10 sec video).
-    5. actions: List of 2 Strings, which are two possible actions for the user to take.
-    6. core_details: String. The core character and style template to be used for all image prompts in subsequent scenes.
-
-    Output must be valid JSON with exactly these keys.
-
-    Note for the image descriptions: you should not depict any extreme violence/weapons/gore etc. as to not get blocked by content moderation filters. Also, remember that the 3 images must be of similar scenes (not drastically different) to smoothly transition the narrative. Consistency is key—keep the character’s appearance and the background uniform.
-
-    User Provided Theme: {user_theme}
+def scene_completion(prompt, model, on_image_prompt, on_narration, stopped, attempt=0):
+    """
+    One completion of a scene prompt. Returns (reply, prompt_tokens), or None
+    if `stopped` was set (another racer won) before it finished.
     """
     user_message = {
         "role": "user",
         "content": prompt
     }
+    # JSON mode makes unparseable replies, and therefore retries, rare.
+    options = {"response_format": {"type": "json_object"}} if LLM_JSON_MODE else {}
+
+    # Reported by the API when it can be; estimated otherwise.
+    prompt_tokens = estimate_tokens(prompt)
+    with stage_limits.acquire("llm"):
+        if stopped.is_set():
+            return None
+        with span("llm", attempt=attempt + 1, model=model):
+            if LLM_STREAMING:
+                parser = SceneStreamParser(on_image_prompt, on_narration)
+                stream = openai_client.chat.completions.create(
+                    model=model,
+                    messages=[user_message],
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **options,
+                )
+                parts = []
+                for chunk in stream:
+                    if stopped.is_set():
+                        # Stop paying for tokens nobody will read.
+                        stream.close()
+                        return None
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        parser.feed(chunk.choices[0].delta.content)
+                    if getattr(chunk, "usage", None):
+                        prompt_tokens = chunk.usage.prompt_tokens
+                assistant_reply = "".join(parts).strip()
+            else:
+                response = openai_client.chat.completions.create(
+                    model=model,
+                    messages=[user_message],
+                    **options,
+                )
+                assistant_reply = response.choices[0].message.content.strip()
+                if getattr(response, "usage", None):
+                    prompt_tokens = response.usage.prompt_tokens
+    return assistant_reply, prompt_tokens
+
+
+def race_scene_completion(race, racer, prompt, image_count, attempt, max_retries):
+    """Runs one racer of `race` and reports how it ended."""
+    on_image_prompt, on_narration = race.callbacks(racer)
+    try:
+        completion = scene_completion(prompt, race.model, on_image_prompt, on_narration, race.stopped, attempt)
+        if completion is None:
+            race.finish(racer, outcome="stopped")
+            return
+        assistant_reply, prompt_tokens = completion
+        result_json = parse_scene_reply(assistant_reply, image_count)
+        result_json["prompt_tokens"] = prompt_tokens
+    except InvalidSceneReply as e:
+        print(f"{e} (attempt {attempt + 1}/{max_retries})")
+        upstream_retries.inc(call="llm", reason="invalid_reply")
+        race.last_reply = assistant_reply
+        race.finish(racer, outcome="invalid")
+    except Exception as e:
+        race.finish(racer, outcome="error", error=e)
+    else:
+        race.finish(racer, result_json)
 
-    for attempt in range(max_retries):
-        response = openai_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[user_message],
-        )
-        assistant_reply = response.choices[0].message.content.strip()
-
-        try:
-            result_json = json.loads(assistant_reply)
-
-            if "image_prompts" not in result_json or len(result_json["image_prompts"]) != 3:
-                print(f"Image prompts invalid (attempt {attempt + 1}/{max_retries})")
-                continue
 
+def request_scene(prompt, image_count, max_retries=3, on_image_prompt=None, on_narration=None, tier="continuation"):
+    """
+    Asks the `tier` model (see SCENE_MODELS) for a scene as JSON, retrying
+    replies that don't validate. Each attempt races LLM_RACE completions and
+    uses the first valid one. When streaming is on and LLM_RACE is 1, each
+    image prompt and the narration are passed to the callbacks as soon as
+    they are complete, before the reply has finished; if the reply then
+    fails validation, the retry is asked to keep what the scene has already
+    started from.
+    """
+    started = time.monotonic()
+    streamed = {}
+    for attempt in range(max_retries):
+        race = SceneRace(LLM_RACE, tier, SCENE_MODELS[tier], on_image_prompt, on_narration, streamed)
+        attempt_prompt = streamed_scene_prompt(prompt, streamed, image_count) if streamed else prompt
+        if LLM_RACE == 1:
+            race_scene_completion(race, 0, attempt_prompt, image_count, attempt, max_retries)
+        else:
+            # All on the pool, so a racer that can't be stopped mid-call (no
+            # streaming) doesn't hold this thread past a faster valid reply.
+            for racer in range(LLM_RACE):
+                llm_executor.submit(
+                    contextvars.copy_context().run,
+                    race_scene_completion, race, racer, attempt_prompt, image_count, attempt, max_retries,
+                )
+        result_json = race.result()
+        if result_json is not None:
+            scene_llm_seconds.observe(time.monotonic() - started, tier=tier)
             return result_json
-        except json.JSONDecodeError:
-            print(f"Error parsing JSON (attempt {attempt + 1}/{max_retries})")
-            continue
-    
-    print(f"All attempts failed. Last response: {assistant_reply}")
-    return None
-
 
-def generate_story_part(user_action, last_image_prompt, storyline, core_details, max_retries=3):
-    prompt = f"""
-    You are an AI Narration and Storyteller assistant. Create the next scene based on the past storyline and the core character details provided. The user has chosen the following action:
-    {user_action}
-
-    Please provide an overview of the new scene in 2-3 sentences. At the end of your scene, clearly list two possible actions that the user can take next.
-
-    IMPORTANT FOR IMAGE GENERATION:
-    - The video for the new scene will be generated from three images.
-    - The **first image** is already provided from the previous scene. Its prompt was:
-         "{last_image_prompt}"
-    - Please **do not** generate a new prompt for this first image.
-    - Instead, generate exactly **two new image prompts** for the current scene that continue the narrative.
-    - Ensure that the two new image prompts have consistent style with the previous scene.
-
-    Also, provide a concise video generation prompt that instructs a video generation model to produce a 10-second video using the three images (in the following order: first image from previous scene, then the two new images).
-
-    You will output only valid JSON—no extra keys, no Markdown formatting, and no disclaimers.
-    Your JSON must have the following keys:
-    1. new_storyline: String. A text description of solely the new content of the storyline.
-    2. image_prompts: List of 2 Strings. Each is a prompt to DALLE for generating a new image.
-    3. video_generation_prompt: String. This prompt is to a video generation model which will be fed the 3 images, and this text to create the video. (no need to mention here that the video should be 10 seconds). Keep it concise.
-    4. narration: A textual narration which will be used as closed captioning and be read aloud along the video (2 short sentences max)
-    5. actions: List of 2 Strings, which are two possible actions for the user to take.
-    6. core_details: String. An updated version of the core character and style template if needed.
-    """
+    print(f"All attempts failed. Last response: {race.last_reply}")
+    return None
 
-    user_message = {
-        "role": "user",
-        "content": prompt
-    }
 
-    for attempt in range(max_retries):
-        response = openai_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[user_message],
-        )
-        assistant_reply = response.choices[0].message.content.strip()
+def init_story(user_theme, max_retries=3, on_image_prompt=None, on_narration=None):
+    return request_scene(init_story_prompt(user_theme), 3, max_retries, on_image_prompt, on_narration, tier="opening")
 
-        try:
-            result_json = json.loads(assistant_reply)
-            # Append the new storyline to the previous storyline.
-            if "image_prompts" not in result_json or len(result_json["image_prompts"]) != 2:
-                print(f"Image prompts invalid (attempt {attempt + 1}/{max_retries})")
-                continue
 
-            result_json["storyline"] = storyline + "\n" + result_json.get("new_storyline", "")
-            return result_json
-        except json.JSONDecodeError:
-            print(f"Error parsing JSON (attempt {attempt + 1}/{max_retries})")
-            continue
-    
-    print(f"All attempts failed. Last response: {assistant_reply}")
-    return None
+def generate_story_part(user_action, last_image_prompt, storyline, core_details, max_retries=3,
+                        on_image_prompt=None, on_narration=None):
+    """`storyline` is the bounded storyline from StorylineContext.render()."""
+    result_json = request_scene(
+        story_part_prompt(user_action, last_image_prompt, storyline, core_details),
+        2, max_retries, on_image_prompt, on_narration,
+    )
+    if result_json:
+        # Only this scene's part; complete_scene() adds it to the story context.
+        result_json["storyline"] = result_json.get("new_storyline", "")
+    return result_json
 
 
-def generate_single_image(prompt, image_size="1792x1024"):
-    try:
+def request_image(prompt, image_size, model, quality):
+    """One DALLE call; returns the URL of the generated image."""
+    # Timed once a slot is held, so queueing for it doesn't look like a slow DALLE.
+    with stage_limits.acquire("images"), image_calls.timed(), span("dalle"):
         response = openai_client.images.generate(
-            model="dall-e-3",
+            model=model,
             prompt=prompt,
             size=image_size,
-            quality="hd",
+            quality=quality,
             n=1
         )
-        return response.data[0].url
+    return response.data[0].url
+
+
+def generate_single_image(prompt, image_size="1792x1024", model="dall-e-3", quality="hd"):
+    key = make_key(model, prompt, image_size, quality)
+    if image_cache.lookup(key):
+        return f"/images/{key}.png"
+
+    try:
+        # Hedged and retried (see image_calls).
+        image_url = image_calls.call(request_image, prompt, image_size, model, quality)
     except Exception as e:
         print(f"Error generating image for prompt '{prompt}': {e}")
         return None
 
+    try:
+        with span("image_download"), requests.get(image_url, stream=True) as image_response:
+            image_response.raise_for_status()
+            image_cache.put_stream(key, counted(image_response.iter_content(STREAM_CHUNK_SIZE), "image_download"))
+        return f"/images/{key}.png"
+    except Exception as e:
+        # Still usable until the DALLE URL expires.
+        print(f"Error caching image for prompt '{prompt}': {e}")
+        return image_url
+
+
+def local_image_path(image_url):
+    """Maps an /images/<key>.png URL to its cached file, or None for other URLs."""
+    if not image_url or not image_url.startswith("/images/"):
+        return None
+    key = image_url[len("/images/"):].split(".")[0]
+    return image_cache.path(key) if image_cache.contains(key) else None
+
 
 def generate_images_parallel(image_prompts, image_size="1792x1024"):
-    image_urls = []
-    with ThreadPoolExecutor(max_workers=len(image_prompts)) as executor:
-        future_to_prompt = {
-            executor.submit(generate_single_image, prompt, image_size): prompt
-            for prompt in image_prompts
-        }
-        for future in as_completed(future_to_prompt):
-            prompt = future_to_prompt[future]
-            try:
-                image_url = future.result()
-                image_urls.append(image_url)
-            except Exception as exc:
-                print(f"Image generation for prompt '{prompt}' generated an exception: {exc}")
-                image_urls.append(None)
+    """
+    Generates every image concurrently and returns their URLs in prompt order,
+    which Runway relies on for the first / middle / last frames. Each prompt
+    is retried on its own; raises if one still has no image after that.
+    """
+    futures = [image_executor.submit(generate_single_image, prompt, image_size) for prompt in image_prompts]
+    image_urls = [future.result() for future in futures]
+    failed = [i for i, image_url in enumerate(image_urls) if not image_url]
+    if failed:
+        raise Exception(f"Images {failed} failed to generate")
     return image_urls
 
 
-def generate_narration(text):
-    voices = {
-        "michael": "uju3wxzG5OhpWcoi3SMy", # narrative
-        "brittney": "pjcYQlDFKMbcOUp6F5GD", # narrative
-        "dallin": "alFofuDn3cOwyoz1i44T", # narrative
-        "soothingguy": "pVnrL6sighQX7hVz89cp", # narrative
-        "guy3": "15CVCzDByBinCIoCblXo",
-        "jerry": "XA2bIQ92TabjGbpO2xRr",
-        "samara": "19STyYD15bswVz51nqLf",
-        "grandpa": "NOpBlnGInO9m6vDvFkFC",
-        "mark": "UgBBYS2sOqTuMpoF3BR0",
+NARRATION_VOICES = {
+    "michael": "uju3wxzG5OhpWcoi3SMy", # narrative
+    "brittney": "pjcYQlDFKMbcOUp6F5GD", # narrative
+    "dallin": "alFofuDn3cOwyoz1i44T", # narrative
+    "soothingguy": "pVnrL6sighQX7hVz89cp", # narrative
+    "guy3": "15CVCzDByBinCIoCblXo",
+    "jerry": "XA2bIQ92TabjGbpO2xRr",
+    "samara": "19STyYD15bswVz51nqLf",
+    "grandpa": "NOpBlnGInO9m6vDvFkFC",
+    "mark": "UgBBYS2sOqTuMpoF3BR0",
+}
+
+def stream_narration(key, asset, text, voice_id, model_id, output_format):
+    """Writes the streamed ElevenLabs audio to `asset` chunk by chunk, then caches it."""
+    try:
+        with stage_limits.acquire("tts"), span("tts") as attrs:
+            audio = elevenlabs_client.text_to_speech.stream(
+                text=text,
+                voice_id=voice_id,
+                model_id=model_id,
+                output_format=output_format,
+            )
+            for chunk in audio:
+                if asset.first_byte is None:
+                    upstream_first_byte.observe(time.monotonic() - asset.started, call="tts")
+                asset.append(chunk)
+            attrs["first_byte"] = asset.first_byte
+        narration_streams.finish(key, asset)
+    except Exception as e:
+        print(f"Error streaming narration {key}: {e}")
+        narration_streams.fail(key, asset, e)
+
+def generate_narration(text, voice="michael", model_id="eleven_multilingual_v2", output_format="mp3_44100_128"):
+    voice_id = NARRATION_VOICES[voice]
+    key = make_key(text, voice_id, model_id, output_format)
+
+    if NARRATION_STREAMING and not audio_cache.lookup(key):
+        asset, created = narration_streams.start(key)
+        if created:
+            # Keeps streaming after this returns; the scene's trace follows it.
+            narration_executor.submit(
+                contextvars.copy_context().run, stream_narration, key, asset, text, voice_id, model_id, output_format
+            )
+        if not asset.wait_ready():
+            raise Exception(f"Narration failed: {asset.error}")
+        return f"/audio/{key}.mp3"
+
+    def synthesize():
+        # Another caller may have filled the cache while we were waiting.
+        if audio_cache.contains(key):
+            return
+
+        with stage_limits.acquire("tts"), span("tts"):
+            audio = elevenlabs_client.text_to_speech.convert(
+                text=text,
+                voice_id=voice_id,
+                model_id=model_id,  # choose model as required
+                output_format=output_format,
+            )
+
+            #play(audio)
+            audio_cache.put(key, b''.join(list(audio)))
+
+    if not audio_cache.lookup(key):
+        narration_flight.do(key, synthesize)
+    # Served as a binary asset by /audio/<key>.mp3 rather than inlined in the status.
+    return f"/audio/{key}.mp3"
+
+def generate_scene(story_id, generate_llm, previous_image_url=None, cancel=None, on_stage_done=None,
+                   budgets=None, late=None):
+    """
+    Runs one scene through the LLM → DALLE → Runway / ElevenLabs stages.
+    `generate_llm(on_image_prompt, on_narration)` streams the scene; each
+    image and the narration start as soon as their own prompt / text has
+    arrived, overlapping with the rest of the LLM reply.
+
+    With `budgets` (see SCENE_BUDGETS), the video and narration may fail or
+    run late without failing the scene; the futures of late ones are added
+    to `late`.
+
+    Returns the fields to store on the story once the scene is done.
+    """
+    graph = StageGraph(story_id, cancel=cancel, on_done=on_stage_done)
+    budgets = {name: seconds for name, seconds in (budgets or {}).items() if seconds}
+
+    # Init scenes have three new images; continuations reuse the previous
+    # scene's last image as their first frame and add two.
+    image_count = 3 if previous_image_url is None else 2
+    dispatched = {}
+
+    def dispatch(name, value):
+        if graph.provide(name, value):
+            dispatched[name] = value
+
+    def on_image_prompt(index, prompt):
+        if index < image_count:
+            dispatch(f"image_prompt_{index}", prompt)
+
+    def llm():
+        print(f"[{story_id}] Generating LLM response...")
+        generated_story = generate_llm(on_image_prompt, lambda text: dispatch("narration_text", text))
+        if not generated_story:
+            raise Exception("Error generating LLM response")
+
+        # Anything handed off mid-stream is what the scene is built from,
+        # even if it came from an earlier attempt than this reply.
+        for i in range(image_count):
+            if f"image_prompt_{i}" in dispatched:
+                generated_story["image_prompts"][i] = dispatched[f"image_prompt_{i}"]
+            else:
+                dispatch(f"image_prompt_{i}", generated_story["image_prompts"][i])
+        if "narration_text" in dispatched:
+            generated_story["narration"] = dispatched["narration_text"]
+        else:
+            dispatch("narration_text", generated_story["narration"])
+
+        print(f"[{story_id}]" + str(generated_story))
+        return generated_story
+
+    def image(index):
+        def generate(prompt):
+            if index == 0:
+                print(f"[{story_id}] Generating images with DALLE...")
+            image_url = generate_single_image(prompt)
+            if not image_url:
+                raise Exception(f"Image {index + 1} failed to generate")
+            return image_url
+        return generate
+
+    def images(*image_urls):
+        return list(image_urls)
+
+    def upload(image_url):
+        # Cached images are uploaded straight from disk.
+        return runway_client.upload_image(local_image_path(image_url) or image_url)
+
+    def video(generated_story, *asset_ids):
+        print(f"[{story_id}] Generating video with Runway...")
+        with stage_limits.acquire("video"):
+            task_id = runway_client.create_video_task(list(asset_ids), generated_story.get("video_generation_prompt"))
+            return runway_client.wait_for_task(task_id, cancel_event=cancel)
+
+    def narration(text):
+        print(f"[{story_id}] Generating narration audio with ElevenLabs...")
+        narration_audio = generate_narration(text)
+        print(f"[{story_id}] Narration audio generation done!")
+        return narration_audio
+
+    graph.add("llm", llm)
+    for i in range(image_count):
+        graph.add_signal(f"image_prompt_{i}")
+    graph.add_signal("narration_text")
+    # Uploads only feed the video, so with a video budget they share its
+    # deadline (counted from the start of the scene) and can't fail the scene.
+    upload_options = {"optional": True, "deadline": budgets["video"]} if "video" in budgets else {}
+    uploads = []
+    if previous_image_url is not None:
+        # Usually already uploaded by the previous scene, so this is a cache hit.
+        graph.add("upload_previous", lambda: upload(previous_image_url), **upload_options)
+        uploads.append("upload_previous")
+    for i in range(image_count):
+        graph.add(f"image_{i}", image(i), deps=[f"image_prompt_{i}"])
+        # Each upload starts as soon as its own image is ready.
+        graph.add(f"upload_{i}", upload, deps=[f"image_{i}"], **upload_options)
+        uploads.append(f"upload_{i}")
+    graph.add("images", images, deps=[f"image_{i}" for i in range(image_count)])
+    graph.add("video", video, deps=["llm"] + uploads, optional="video" in budgets, deadline=budgets.get("video"))
+    graph.add("narration", narration, deps=["narration_text"],
+              optional="narration" in budgets, deadline=budgets.get("narration"))
+
+    ok = False
+    with tracing() as trace:
+        try:
+            results = graph.run()
+            ok = True
+        finally:
+            print(f"[{story_id}] Stage timings: {graph.summary()}")
+            # Degraded uploads show up as a degraded video.
+            degraded = {name: reason for name, reason in graph.degraded.items() if name in budgets}
+            observe_scene(graph.timings, ok, degraded)
+
+    if degraded:
+        print(f"[{story_id}] Degraded: {degraded}")
+    if late is not None:
+        late.update({name: future for name, future in graph.late.items() if name in budgets})
+    return scene_update(results, graph.timings, trace, degraded)
+
+def scene_update(results, timings, trace=None, degraded=None):
+    """
+    Builds the story fields for a finished scene from its stage results.
+    `trace` holds the scene's individual upstream calls, and `degraded` the
+    stages that failed or ran late (their results are None).
+    """
+    generated_story = results["llm"]
+    result = {
+        "video": results.get("video"),
+        "narration_audio": results.get("narration"),
+        "narration_text": generated_story["narration"],
+        "actions": generated_story.get("actions", []),
+    }
+    if degraded:
+        # Without a video the client plays the images as a slideshow; without
+        # narration audio it shows narration_text as captions.
+        result["degraded"] = dict(degraded)
+        if result["video"] is None:
+            result["slideshow"] = results["images"]
+    return {
+        "status": "completed",
+        "result": result,
+        "storyline": generated_story.get("storyline", ""),
+        "core_details": generated_story.get("core_details", ""),
+        "last_image_prompt": generated_story["image_prompts"][-1],
+        "last_image_url": results["images"][-1],
+        "timings": timings,
+        "trace": trace.spans if trace else [],
+        "prompt_tokens": generated_story.get("prompt_tokens", 0),
     }
-    
-    audio = elevenlabs_client.text_to_speech.convert(
-        text=text,
-        voice_id=voices["michael"],
-        model_id="eleven_multilingual_v2",  # choose model as required
-        output_format="mp3_44100_128",
+
+def generate_next_scene(story_id, context, user_action, cancel=None, on_stage_done=None, budgets=None, late=None):
+    """Generates the scene that follows `user_action` from the given story context."""
+    return generate_scene(
+        story_id,
+        lambda on_image_prompt, on_narration: generate_story_part(
+            user_action,
+            storyline=storylines.render(context),
+            core_details=context.get("core_details", ""),
+            last_image_prompt=context.get("last_image_prompt", ""),
+            on_image_prompt=on_image_prompt,
+            on_narration=on_narration,
+        ),
+        previous_image_url=context.get("last_image_url", ""),
+        cancel=cancel,
+        on_stage_done=on_stage_done,
+        budgets=budgets,
+        late=late,
+    )
+
+# ----------------------------
+# The storyline in each prompt is the last few scenes plus a running summary
+# of the rest, so prompts stop growing with the length of the story.
+STORYLINE_SUMMARY_MODEL = os.getenv('STORYLINE_SUMMARY_MODEL') or OPENAI_MODEL
+
+def summarize_storyline(summary, scenes):
+    prompt = storyline_summary_prompt(summary, scenes, max_words=storylines.token_budget // 2)
+    with stage_limits.acquire("llm"):
+        response = openai_client.chat.completions.create(
+            model=STORYLINE_SUMMARY_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+        )
+    return response.choices[0].message.content.strip()
+
+# Held while a summary is checked against the story's context and written,
+# and while a story is rewound, so a summary never lands on another branch.
+# (Only within this process; other workers can still race a rewind.)
+storyline_lock = threading.Lock()
+
+def write_story_summary(story_id, applies, **fields):
+    with storyline_lock:
+        if not applies(stories.get_context(story_id)):
+            return False
+        try:
+            stories.update(story_id, **fields)
+        except KeyError:
+            # The story was evicted while its summary was being written.
+            return False
+    return True
+
+storylines = StorylineContext(
+    summarize_storyline,
+    keep_scenes=int(os.getenv('STORYLINE_KEEP_SCENES', '3')),
+    token_budget=int(os.getenv('STORYLINE_TOKEN_BUDGET', '800')),
+    # Summaries are never urgent, so they only get otherwise idle workers.
+    submit=lambda fn, *args: scheduler.submit(fn, *args, priority=PRIORITY_SPECULATIVE),
+)
+
+# ----------------------------
+# Optional asyncio pipeline (PIPELINE_MODE=async): every story runs as a
+# coroutine on one event loop instead of holding a worker thread.
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'threads')
+async_pipeline = None
+if PIPELINE_MODE == 'async':
+    pipeline_loop = EventLoopThread()
+    async_pipeline = AsyncPipeline(
+        openai_api_key=OPENAI_API_KEY,
+        openai_model=OPENAI_MODEL,
+        scene_models=SCENE_MODELS,
+        llm_race=LLM_RACE,
+        elevenlabs_api_key=ELEVENLABS_API_KEY,
+        elevenlabs_base_url=ELEVENLABS_BASE_URL,
+        useapi_base_url=runway_client.base_url,
+        useapi_api_key=USEAPI_API_KEY,
+        runway_accounts=runway_client.accounts,
+        image_cache=image_cache,
+        audio_cache=audio_cache,
+        resolve_image=local_image_path,
+        limits=stage_limits.limits,
+        max_in_flight=int(os.getenv('ASYNC_MAX_STORIES', '500')),
+        streaming=LLM_STREAMING,
+        json_mode=LLM_JSON_MODE,
+        narration_streams=narration_streams if NARRATION_STREAMING else None,
+        media_prep=media_prep,
+        image_hedge_percentile=IMAGE_HEDGE_PERCENTILE,
+        image_retries=IMAGE_RETRIES,
+    )
+
+async def generate_scene_async(story_id, generate_llm, previous_image_url=None, cancel=None, on_stage_done=None,
+                               budgets=None, late=None):
+    timings = {}
+    degraded = {}
+    ok = False
+    with tracing() as trace:
+        try:
+            results, timings = await async_pipeline.generate_scene(
+                story_id,
+                generate_llm,
+                NARRATION_VOICES["michael"],
+                previous_image_url=previous_image_url,
+                cancel=cancel,
+                on_stage_done=on_stage_done,
+                timings=timings,
+                budgets=budgets,
+                late=late,
+                degraded=degraded,
+            )
+            ok = True
+        finally:
+            observe_scene(timings, ok, degraded)
+    print(f"[{story_id}] Scene done in {timings['total']['duration']:.1f}s")
+    if degraded:
+        print(f"[{story_id}] Degraded: {degraded}")
+    return scene_update(results, timings, trace, degraded)
+
+async def generate_next_scene_async(story_id, context, user_action, cancel=None, on_stage_done=None,
+                                    budgets=None, late=None):
+    return await generate_scene_async(
+        story_id,
+        lambda on_image_prompt, on_narration: async_pipeline.generate_story_part(
+            user_action,
+            storyline=storylines.render(context),
+            core_details=context.get("core_details", ""),
+            last_image_prompt=context.get("last_image_prompt", ""),
+            on_image_prompt=on_image_prompt,
+            on_narration=on_narration,
+        ),
+        previous_image_url=context.get("last_image_url", ""),
+        cancel=cancel,
+        on_stage_done=on_stage_done,
+        budgets=budgets,
+        late=late,
     )
 
-    #play(audio)
-    audio_bytes = b''.join(list(audio))
-    # Convert bytes to base64 string for JSON serialization
-    return base64.b64encode(audio_bytes).decode('utf-8')
+def speculate_next_scene(story_id, context, user_action, cancel_event):
+    story_id = f"{story_id}/speculative"
+    if async_pipeline:
+        return pipeline_loop.run(generate_next_scene_async(story_id, context, user_action, cancel=cancel_event))
+    return generate_next_scene(story_id, context, user_action, cancel=cancel_event)
+
+# Optional background generation of both candidate next scenes.
+SPECULATIVE_SCENES = os.getenv('SPECULATIVE_SCENES', 'false').lower() in ('1', 'true', 'yes')
+speculation = SpeculativeScenes(
+    speculate_next_scene,
+    max_per_story=int(os.getenv('SPECULATIVE_MAX_PER_STORY', '2')),
+    max_global=int(os.getenv('SPECULATIVE_MAX_GLOBAL', '8')),
+    # Speculation only gets workers that interactive jobs aren't waiting for.
+    submit=lambda fn, *args: scheduler.submit(fn, *args, priority=PRIORITY_SPECULATIVE),
+)
+
+def scene_context(scene_id):
+    """The story context as of an earlier scene, or None if it is unknown."""
+    return context_from_scene(stories.get_scene, scene_id, max_scenes=storylines.keep_scenes * 4)
+
+def apply_scene(context, update, action=None):
+    """
+    Returns (fields to store, new story context) for a finished scene generated
+    from `context` by `action`, and records the scene as an immutable node
+    that other stories can branch from. Neither argument is modified.
+    """
+    update = dict(update)
+    context = dict(context)
+    context.update(storylines.add_scene(context, update.pop("storyline", "")))
+    update["scenes"] = context["scenes"]
+    context.update(split_fields(update)[1])
+
+    node = make_scene_node(context.get("scene_id"), action, context, update["result"])
+    stories.put_scene(node)
+    update["scene_id"] = context["scene_id"] = node["scene_id"]
+    update["result"] = node["result"]
+    return update, context
+
+def complete_scene(story_id, update, action=None, context=None):
+    """
+    Stores a finished scene and, if enabled, starts speculating on its actions.
+    `context` is the context the scene was generated from, when that isn't the
+    story's current one (see /next_scene?from_scene=). Returns the scene_id.
+    """
+    rewound = context is not None
+    if context is None:
+        context = stories.get_context(story_id)
+    parent_id = context.get("scene_id")
+    update, context = apply_scene(context, update, action)
+    # Degraded scenes are served to this story but kept out of the catalog.
+    if catalog and context.get("catalog_theme_id") and not update["result"].get("degraded"):
+        catalog.add(context["catalog_theme_id"], parent_id, action, split_fields(update)[0], context)
+    if rewound:
+        # Replace the whole context, summary included, with the branch's.
+        update = dict(context, **split_fields(update)[0])
+    # The finished scene's result has the narration from here on.
+    if rewound:
+        with storyline_lock:
+            stories.update(story_id, narration=None, **update)
+        storylines.forget(story_id)
+    else:
+        stories.update(story_id, narration=None, **update)
+    story_events.publish(story_id, "completed")
+    print(f"[{story_id}] Prompt tokens: {update['prompt_tokens']}")
+    storylines.record_prompt_tokens(update["prompt_tokens"])
+    storylines.maybe_fold(story_id, context, write_story_summary)
+
+    if SPECULATIVE_SCENES:
+        speculation.start(story_id, context, update["result"]["actions"])
+    return context["scene_id"]
+
+# Result field each degradable stage fills in.
+LATE_FIELDS = {"video": "video", "narration": "narration_audio"}
+late_media_lock = threading.Lock()
+
+def update_scene_media(story_ids, scene_id, stage, change):
+    """
+    Applies `change(result)` to a stored scene's result, and to each of
+    `story_ids` whose latest scene that still is, and publishes the stage's
+    event to those stories. Returns the new result, or None if the scene is gone.
+    """
+    with late_media_lock:
+        result = stories.update_scene_result(scene_id, change)
+        if result is None:
+            return None
+        for story_id in story_ids:
+            if stories.get_context(story_id).get("scene_id") != scene_id:
+                continue
+            try:
+                stories.update(story_id, result=result)
+            except KeyError:
+                continue
+            story_events.publish(story_id, STAGE_EVENTS[stage])
+    return result
+
+def attach_late_media(story_ids, scene_id, stage, value):
+    """Adds a video or narration that missed its scene's budget to the scene."""
+    def change(result):
+        result = dict(result, **{LATE_FIELDS[stage]: value})
+        degraded = {name: reason for name, reason in result.pop("degraded", {}).items() if name != stage}
+        if degraded:
+            result["degraded"] = degraded
+        if stage == "video":
+            result.pop("slideshow", None)
+        return result
+
+    if update_scene_media(story_ids, scene_id, stage, change) is not None:
+        print(f"[{scene_id}] Attached late {stage}")
+
+def drop_scene_media(story_ids, scene_id, stage):
+    """
+    Marks a scene's video or narration as not coming after all: late media
+    that failed, or narration whose stream broke off after the scene was stored.
+    """
+    def change(result):
+        return dict(result, degraded=dict(result.get("degraded", {}), **{stage: "error"}), **{LATE_FIELDS[stage]: None})
+
+    update_scene_media(story_ids, scene_id, stage, change)
+
+def watch_narration_stream(story_ids, scene_id, audio_url):
+    """
+    Narration is handed out from its first chunk on, so its stream can still
+    fail after the scene is stored; drops it from the scene if so, rather
+    than leave an /audio URL that 404s.
+    """
+    if not audio_url:
+        return
+    key = audio_url.rsplit("/", 1)[-1].split(".")[0]
+
+    def done(asset=None):
+        if (asset is None or asset.error is not None) and not audio_cache.contains(key):
+            print(f"[{scene_id}] Narration stream failed after the scene was stored")
+            scenes_degraded.inc(stage="narration", reason="error")
+            drop_scene_media(story_ids, scene_id, "narration")
+
+    asset = narration_streams.get(key)
+    if asset is None:
+        # Finished (then it is cached) or failed already.
+        done()
+    else:
+        asset.when_done(lambda: done(asset))
+
+def awaiting_media(result):
+    """Whether a scene still has a video or narration that may arrive late."""
+    return "timeout" in (result or {}).get("degraded", {}).values()
+
+def watch_late_media(story_ids, scene_id, late):
+    """
+    Attaches each late stage of a stored scene once its future finishes, or
+    drops it if it fails. Also watches the scene's narration stream.
+    """
+    def done(stage, future):
+        if future.cancelled() or future.exception() is not None:
+            print(f"[{scene_id}] Late {stage} failed: {'cancelled' if future.cancelled() else future.exception()}")
+            drop_scene_media(story_ids, scene_id, stage)
+            return
+        attach_late_media(story_ids, scene_id, stage, future.result())
+        if stage == "narration":
+            watch_narration_stream(story_ids, scene_id, future.result())
+
+    node = stories.get_scene(scene_id)
+    if node is not None:
+        watch_narration_stream(story_ids, scene_id, node["result"].get("narration_audio"))
+    for stage, future in late.items():
+        future.add_done_callback(lambda f, stage=stage: done(stage, f))
+
+def evict_idle_stories(interval=600):
+    """Drops stories idle past STORY_TTL, along with their events and speculation."""
+    while True:
+        time.sleep(interval)
+        evicted = stories.evict_idle()
+        for story_id in evicted:
+            speculation.discard(story_id)
+            story_events.discard(story_id)
+        if evicted:
+            print(f"Evicted {len(evicted)} idle stories")
+
+threading.Thread(target=evict_idle_stories, daemon=True).start()
+
+# ----------------------------
+# Server-side story tree pre-generation (see /trees). Each branch gets its own
+# copy of the story context, and every finished node goes to a checkpoint log.
+def generate_tree_scene(node_id, context, user_theme=None, user_action=None):
+    if user_theme and async_pipeline:
+        update = pipeline_loop.run(generate_scene_async(
+            node_id,
+            lambda on_image_prompt, on_narration: async_pipeline.init_story(
+                user_theme, on_image_prompt=on_image_prompt, on_narration=on_narration
+            ),
+        ))
+    elif user_theme:
+        update = generate_scene(
+            node_id,
+            lambda on_image_prompt, on_narration: init_story(
+                user_theme, on_image_prompt=on_image_prompt, on_narration=on_narration
+            ),
+        )
+    elif async_pipeline:
+        update = pipeline_loop.run(generate_next_scene_async(node_id, context, user_action))
+    else:
+        update = generate_next_scene(node_id, context, user_action)
+    update, context = apply_scene(context, update, user_action)
+    return split_fields(update)[0], context
+
+tree_builder = TreeBuilder(
+    generate_tree_scene,
+    directory=os.getenv('TREE_DIR', 'trees'),
+    workers=int(os.getenv('TREE_CONCURRENCY', '4')),
+)
+# Trees grow exponentially with depth, so /trees caps what it accepts.
+TREE_MAX_DEPTH = int(os.getenv('TREE_MAX_DEPTH', '6'))
+
+def init_key(user_theme):
+    """Initializations with the same key produce interchangeable first scenes."""
+    theme = " ".join(user_theme.lower().split())
+    return make_key("init", theme, SCENE_MODELS["opening"], PIPELINE_MODE)
+
+def adopt_scene(story_id, scene_id):
+    """Points an existing story at a finished scene node, as its latest scene."""
+    node = stories.get_scene(scene_id)
+    with storyline_lock:
+        stories.update(story_id, status="completed", result=node["result"], narration=None, **scene_context(scene_id))
+    storylines.forget(story_id)
+    story_events.publish(story_id, "completed")
+
+def share_first_scene(story_id, flight):
+    """
+    Hands the first scene the leader just finished to everyone who coalesced
+    onto it. Returns their story ids.
+    """
+    scene_id = stories.get_context(story_id)["scene_id"]
+    waiting_ids = init_flights.finish(flight, scene_id)
+    for waiting_id in waiting_ids:
+        adopt_scene(waiting_id, scene_id)
+    return waiting_ids
+
+def narration_ready(story_id, audio_url):
+    """Lets /story_status offer the narration before the rest of the scene is done."""
+    try:
+        stories.update(story_id, narration={"status": "ready", "audio": audio_url})
+    except KeyError:
+        pass
 
-def process_story(story_id, user_theme=None, user_action=None):
+def process_story(story_id, user_theme=None, user_action=None, speculative_job=None, context=None):
     """
+    `context` rewinds the story to another scene before continuing it.
+
     Returns JSON with keys:
        - story_id: a unique identifier for subsequent calls.
        - video: the generated video (e.g. URL or base64 encoded data)
-       - narration_audio: the narration audio (e.g. URL or binary data)
+       - narration_audio: URL of the narration audio
        - narration_text: the narration text (for captions)
        - actions: a list of two possible next actions.
     """
+    flight = init_key(user_theme) if user_theme and INIT_COALESCING else None
+
+    def publish_stage(stage, result):
+        for waiting_id in (flight and init_flights.subscribers(flight)) or [story_id]:
+            if stage == "narration":
+                narration_ready(waiting_id, result)
+            if stage in STAGE_EVENTS:
+                story_events.publish(waiting_id, STAGE_EVENTS[stage])
+
+    # Video / narration still running when the scene is stored.
+    late = {}
+
     try:
         if user_theme:
             # This is an initialization process.
-            print(f"[{story_id}] Generating LLM response...")
-            generated_story = init_story(user_theme)
-            if not generated_story:
-                stories[story_id]['status'] = 'error'
-
-                print(f"[{story_id}] Error generating LLM response")
-                return
-            print(f"[{story_id}]" + str(generated_story))
-
-            print(f"[{story_id}] Generating images with DALLE...")
-            images = generate_images_parallel(generated_story["image_prompts"])
-
-            print(f"[{story_id}] Generating video with Runway...")
-            video = runway_client.generate_video(images, generated_story.get("video_generation_prompt"))
-
-            print(f"[{story_id}] Generating narration audio with ElevenLabs...")
-            narration_audio = generate_narration(generated_story["narration"])
-            narration_text = generated_story["narration"]
-            print(f"[{story_id}] Narration audio generation done!")
-            
-            actions = generated_story.get("actions", [])
-
-            last_image_prompt = generated_story["image_prompts"][-1]
-            last_image_url = images[-1]
-
-            # Update story details.
-            stories[story_id].update({
-                "status": "completed",
-                "result": {
-                    "video": video,
-                    "narration_audio": narration_audio,
-                    "narration_text": narration_text,
-                    "actions": actions,
-                },
-                "storyline": generated_story.get("storyline", ""),
-                "core_details": generated_story.get("core_details", ""),
-                "last_image_prompt": last_image_prompt,
-                "last_image_url": last_image_url,
-            })
+            update = generate_scene(
+                story_id,
+                lambda on_image_prompt, on_narration: init_story(
+                    user_theme, on_image_prompt=on_image_prompt, on_narration=on_narration
+                ),
+                on_stage_done=publish_stage,
+                budgets=SCENE_BUDGETS,
+                late=late,
+            )
+            scene_id = complete_scene(story_id, update)
+            story_ids = [story_id] + (share_first_scene(story_id, flight) if flight else [])
+            watch_late_media(story_ids, scene_id, late)
             print(f"[{story_id}] Story initialization done!")
         else:
             # This is for generating the next scene.
-            current_context = stories[story_id]
-            current_storyline = current_context.get("storyline", "")
-            current_core_details = current_context.get("core_details", "")
-            previous_last_image_prompt = current_context.get("last_image_prompt", "")
-
-            previous_last_image_url = current_context.get("last_image_url", "")
-
-            print(f"[{story_id}] Generating next story part with LLM...")
-            new_story = generate_story_part(
-                user_action,
-                storyline=current_storyline,
-                core_details=current_core_details,
-                last_image_prompt=previous_last_image_prompt
-            )
-
-            print(f"[{story_id}]" + str(new_story))
-
-            print(f"[{story_id}] Generating images with DALLE...")
-            new_image_urls = generate_images_parallel(new_story["image_prompts"])
-
-            print(f"[{story_id}] Generating video with Runway...")
-            combined_images = [previous_last_image_url] + new_image_urls
-            video = runway_client.generate_video(combined_images, new_story.get("video_generation_prompt"))
-
-            print(f"[{story_id}] Generating narration audio with ElevenLabs...")
-
-            narration_audio = generate_narration(new_story["narration"])
-            narration_text = new_story["narration"]
-            print(f"[{story_id}] Narration audio generation done!")
+            update = None
+            if speculative_job:
+                # Attach to the speculative run for this action instead of starting over.
+                print(f"[{story_id}] Waiting on speculative scene for: {user_action}")
+                try:
+                    update = speculative_job.result()
+                except Exception as e:
+                    print(f"[{story_id}] Speculative scene failed, generating live: {e}")
+
+            if update is None:
+                update = generate_next_scene(
+                    story_id, context or stories.get_context(story_id), user_action, on_stage_done=publish_stage,
+                    budgets=SCENE_BUDGETS, late=late,
+                )
+            scene_id = complete_scene(story_id, update, user_action, context)
+            watch_late_media([story_id], scene_id, late)
+            print("All done!")
+    except Exception as e:
+        print(f"Error processing story {story_id}: {e}")
+        for failed_id in [story_id] + (init_flights.fail(flight) if flight else []):
+            stories.update(failed_id, status='error')
+            story_events.publish(failed_id, "error", {"error": str(e)})
 
+async def process_story_async(story_id, user_theme=None, user_action=None, speculative_job=None, context=None):
+    """Same as process_story, on the asyncio pipeline."""
+    flight = init_key(user_theme) if user_theme and INIT_COALESCING else None
 
-            actions = new_story.get("actions", [])
+    def publish_stage(stage, result):
+        for waiting_id in (flight and init_flights.subscribers(flight)) or [story_id]:
+            if stage == "narration":
+                narration_ready(waiting_id, result)
+            if stage in STAGE_EVENTS:
+                story_events.publish(waiting_id, STAGE_EVENTS[stage])
 
-            new_last_image_prompt = new_story["image_prompts"][-1]
-            new_last_image_url = new_image_urls[-1]
+    late = {}
 
-            stories[story_id].update({
-                "status": "completed",
-                "result": {
-                    "video": video,
-                    "narration_audio": narration_audio,
-                    "narration_text": narration_text,
-                    "actions": actions,
-                },
-                "storyline": new_story.get("storyline", ""),
-                "core_details": new_story.get("core_details", ""),
-                "last_image_prompt": new_last_image_prompt,
-                "last_image_url": new_last_image_url,
-            })
+    try:
+        if user_theme:
+            update = await generate_scene_async(
+                story_id,
+                lambda on_image_prompt, on_narration: async_pipeline.init_story(
+                    user_theme, on_image_prompt=on_image_prompt, on_narration=on_narration
+                ),
+                on_stage_done=publish_stage,
+                budgets=SCENE_BUDGETS,
+                late=late,
+            )
+            scene_id = complete_scene(story_id, update)
+            story_ids = [story_id] + (share_first_scene(story_id, flight) if flight else [])
+            watch_late_media(story_ids, scene_id, late)
+            print(f"[{story_id}] Story initialization done!")
+        else:
+            update = None
+            if speculative_job:
+                print(f"[{story_id}] Waiting on speculative scene for: {user_action}")
+                try:
+                    update = await asyncio.wrap_future(speculative_job.future)
+                except Exception as e:
+                    print(f"[{story_id}] Speculative scene failed, generating live: {e}")
+
+            if update is None:
+                update = await generate_next_scene_async(
+                    story_id, context or stories.get_context(story_id), user_action, on_stage_done=publish_stage,
+                    budgets=SCENE_BUDGETS, late=late,
+                )
+            scene_id = complete_scene(story_id, update, user_action, context)
+            watch_late_media([story_id], scene_id, late)
             print("All done!")
     except Exception as e:
         print(f"Error processing story {story_id}: {e}")
-        stories[story_id]['status'] = 'error'
+        for failed_id in [story_id] + (init_flights.fail(flight) if flight else []):
+            stories.update(failed_id, status='error')
+            story_events.publish(failed_id, "error", {"error": str(e)})
+
+def start_story_job(story_id, user_theme=None, user_action=None, speculative_job=None, context=None):
+    """Queues a story job on the configured pipeline; raises QueueFull when it is saturated."""
+    if async_pipeline:
+        pipeline_loop.submit(async_pipeline.admit(
+            process_story_async(story_id, user_theme, user_action, speculative_job, context)
+        ))
+    else:
+        scheduler.submit(process_story, story_id, user_theme, user_action, speculative_job, context)
+
+# ----------------------------
+# Metrics (see /metrics). Upstream call latencies and retries are recorded
+# where the calls are made; the gauges are read from live state on scrape.
+stage_seconds = registry.histogram("story_stage_seconds", "Duration of each scene stage.", ("stage",))
+scene_seconds = registry.histogram("story_scene_seconds", "End-to-end scene generation time.", ("outcome",))
+requests_rejected = registry.counter("requests_rejected_total", "Requests turned away with 429.", ("endpoint",))
+scenes_degraded = registry.counter("story_scenes_degraded_total", "Scenes stored without a stage's output.",
+                                   ("stage", "reason"))
+registry.gauge("story_jobs_running", "Story jobs running on the worker pool.",
+               fn=lambda: scheduler.stats()["running"])
+registry.gauge("story_jobs_queued", "Story jobs waiting for a worker.",
+               fn=lambda: scheduler.stats()["queue_depth"])
+registry.gauge("async_stories_in_flight", "Stories running on the asyncio pipeline.",
+               fn=lambda: async_pipeline.in_flight if async_pipeline else 0)
+registry.gauge("speculative_jobs_running", "Speculative next scenes being generated.",
+               fn=lambda: speculation.stats()["running"])
+registry.gauge("stage_calls_in_flight", "Upstream calls holding a stage concurrency slot.", ("stage",),
+               fn=lambda: {(name, ): s["in_use"] for name, s in stage_limits.stats().items()})
+registry.gauge("stage_calls_waiting", "Upstream calls waiting for a stage concurrency slot.", ("stage",),
+               fn=lambda: {(name, ): s["waiting"] for name, s in stage_limits.stats().items()})
+registry.gauge("runway_account_jobs", "Video tasks running per Runway account.", ("account",),
+               fn=lambda: {(a["email"], ): a["active"] for a in runway_client.accounts.stats()["accounts"]})
+registry.gauge("runway_account_slots", "Video task slots per Runway account.", ("account",),
+               fn=lambda: {(a["email"], ): a["max_jobs"] for a in runway_client.accounts.stats()["accounts"]})
+
+def observe_scene(timings, ok, degraded=None):
+    for stage, reason in (degraded or {}).items():
+        scenes_degraded.inc(stage=stage, reason=reason)
+    for name, timing in timings.items():
+        if name == "total":
+            scene_seconds.observe(timing["duration"], outcome="ok" if ok else "error")
+        elif not name.startswith(("image_prompt_", "narration_text")):
+            # image_0, image_1, ... share one series. Signals aren't stages.
+            stage_seconds.observe(timing["duration"], stage=name.rstrip("0123456789").rstrip("_"))
 
 # ----------------------------
 # Flask Endpoints
 
+def busy_response(error):
+    requests_rejected.inc(endpoint=request.path.split("/")[1])
+    response = jsonify({'error': 'Server is busy, please retry later'})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+def store_catalog_node(node, parent_id=None, action=None):
+    """
+    Stores a catalog scene as a scene node, so stories can be forked or
+    continued (?from_scene=) from it like from a generated scene.
+    """
+    context = node["context"]
+    stories.put_scene(make_scene_node(
+        parent_id, action, context, node["record"]["result"], scene_id=context["scene_id"]
+    ))
+
+def serve_catalog_node(story_id, node, parent_id, action):
+    """Makes a pre-generated catalog scene (reached by `action`) the story's current scene."""
+    store_catalog_node(node, parent_id, action)
+    stories.update(story_id, **node["record"], **node["context"])
+    story_events.publish(story_id, "completed")
+
 @app.route('/initialize', methods=['POST'])
 def initialize():
     data = request.get_json()
-    if not data or 'user_theme' not in data:
+    if not data or ('user_theme' not in data and 'theme_id' not in data):
         return jsonify({'error': 'Missing user_theme in request body'}), 400
 
-    user_theme = data['user_theme']
+    user_theme = data.get('user_theme')
+    theme_id = data.get('theme_id') if catalog else None
     story_id = str(uuid.uuid4())
-    # Initialize story status as 'processing'
-    stories[story_id] = {"status": "processing"}
 
-    # Launch background processing (using a thread for this example)
-    threading.Thread(target=process_story, args=(story_id, user_theme, None)).start()
+    if theme_id:
+        root = catalog.root(theme_id)
+        if root:
+            store_catalog_node(root)
+            stories.create(story_id, **{**root["record"], **root["context"], "catalog_theme_id": theme_id},
+                           scene_events=story_events.reset(story_id))
+            story_events.publish(story_id, "completed")
+            return jsonify({"story_id": story_id, "status": "completed"})
+
+    if not isinstance(user_theme, str) or not user_theme.strip():
+        # A theme_id alone only works for themes in the catalog.
+        return jsonify({'error': 'Unknown theme_id' if data.get('theme_id') else 'Missing user_theme in request body'}), 400
+
+    # Initialize story status as 'processing'. Stories with a theme_id add
+    # what they generate to the catalog.
+    stories.create(story_id, status="processing", catalog_theme_id=theme_id,
+                   scene_events=story_events.reset(story_id))
+
+    if INIT_COALESCING:
+        flight = init_key(user_theme)
+        role, scene_id = init_flights.join(flight, story_id)
+        while role == "cached" and not stories.get_scene(scene_id):
+            # The scene was evicted since; this story needs a flight of its own.
+            init_flights.drop(flight, scene_id)
+            role, scene_id = init_flights.join(flight, story_id)
+        if role == "cached":
+            adopt_scene(story_id, scene_id)
+            return jsonify({"story_id": story_id, "status": "completed"})
+        if role == "follower":
+            # The leader's job completes this story too (see share_first_scene).
+            return jsonify({"story_id": story_id, "status": "processing"})
+
+    # Queue background processing on the worker pool.
+    try:
+        start_story_job(story_id, user_theme)
+    except QueueFull as e:
+        stories.delete(story_id)
+        if INIT_COALESCING:
+            for waiting_id in init_flights.fail(init_key(user_theme)):
+                stories.update(waiting_id, status='error')
+                story_events.publish(waiting_id, "error", {"error": "Server is busy, please retry later"})
+        return busy_response(e)
 
     # Return the story_id immediately.
     return jsonify({"story_id": story_id, "status": "processing"})
@@ -352,23 +1230,307 @@ def next_scene():
     if story_id not in stories:
         return jsonify({'error': 'Invalid story_id'}), 400
 
+    # ?from_scene=<scene_id> continues from an earlier scene instead of the latest.
+    from_scene = request.args.get('from_scene') or data.get('from_scene')
+    context = None
+    if from_scene:
+        context = scene_context(from_scene)
+        if context is None:
+            return jsonify({'error': 'Invalid from_scene'}), 400
+
+    stories.update(story_id, scene_events=story_events.reset(story_id))
+    if catalog and context is None:
+        current = stories.get_context(story_id)
+        node = current.get("catalog_theme_id") and catalog.child(current.get("scene_id"), user_action)
+        if node:
+            print(f"[{story_id}] Serving catalog scene for: {user_action}")
+            serve_catalog_node(story_id, node, current["scene_id"], user_action)
+            return jsonify({"story_id": story_id, "status": "completed"})
+
+    if context is not None:
+        # Speculation ran ahead from the latest scene, not this one.
+        speculation.discard(story_id)
+        speculative_job = None
+    else:
+        speculative_job = speculation.claim(story_id, user_action)
+    if speculative_job and speculative_job.succeeded():
+        # The scene for this action was already generated in the background.
+        print(f"[{story_id}] Serving speculative scene for: {user_action}")
+        scene_id = complete_scene(story_id, speculative_job.result(), user_action)
+        watch_late_media([story_id], scene_id, {})
+        return jsonify({"story_id": story_id, "status": "completed"})
+
+    if speculative_job and not speculative_job.started:
+        # Still queued behind other work; generating live gets a higher priority.
+        speculative_job.cancel()
+        speculative_job = None
+
     # Mark the story as processing the next scene.
-    stories[story_id]['status'] = "processing"
-    threading.Thread(target=process_story, args=(story_id, None, user_action)).start()
+    previous_status = stories.get(story_id)['status']
+    stories.update(story_id, status="processing", narration=None)
+    try:
+        start_story_job(story_id, user_action=user_action, speculative_job=speculative_job, context=context)
+    except QueueFull as e:
+        stories.update(story_id, status=previous_status)
+        return busy_response(e)
 
     return jsonify({"story_id": story_id, "status": "processing"})
 
+@app.route('/fork', methods=['POST'])
+def fork():
+    """
+    Starts a new story at an existing scene: either `scene_id` (as returned in
+    each scene's result) or the latest scene of `story_id`. The new story
+    shares every earlier scene with the original instead of copying it.
+    """
+    data = request.get_json()
+    if not data or ('scene_id' not in data and 'story_id' not in data):
+        return jsonify({'error': 'Missing scene_id or story_id in request body'}), 400
+
+    scene_id = data.get('scene_id')
+    if not scene_id:
+        scene_id = stories.get_context(data['story_id']).get('scene_id')
+    node = stories.get_scene(scene_id) if scene_id else None
+    if node is None:
+        return jsonify({'error': 'Invalid scene_id'}), 400
+
+    story_id = str(uuid.uuid4())
+    stories.create(story_id, status="completed", result=node["result"], **scene_context(scene_id),
+                   scene_events=story_events.reset(story_id))
+    story_events.publish(story_id, "completed")
+    return jsonify({"story_id": story_id, "status": "completed", "scene_id": scene_id})
+
+def debug_requested():
+    """?debug=1 adds each scene's stage timings and upstream call trace to its status."""
+    return request.args.get('debug', '').lower() in ('1', 'true', 'yes')
+
+def status_payload(story_id, story_data, debug=False):
+    result = dict(story_data.get("result", {}))
+    if result.get("narration_audio"):
+        # Stored as a path; clients fetch it from this server.
+        result["narration_audio"] = request.host_url.rstrip("/") + result["narration_audio"]
+    if result.get("slideshow"):
+        # Cached images are paths too; uncached ones are still DALLE URLs.
+        result["slideshow"] = [
+            request.host_url.rstrip("/") + url if url.startswith("/") else url for url in result["slideshow"]
+        ]
+    payload = {
+        "status": story_data.get("status", "unknown"),
+        "result": result,
+    }
+    if debug:
+        # A few KB per scene, so only sent when asked for.
+        payload["timings"] = story_data.get("timings", {})
+        payload["trace"] = story_data.get("trace", [])
+    if story_data.get("narration"):
+        # The scene is still processing, but its narration can already be played.
+        narration = story_data["narration"]
+        payload["narration"] = dict(narration, audio=request.host_url.rstrip("/") + narration["audio"])
+    return payload
+
+def events_are_local(story_id, story_data):
+    """Whether this worker's event log is for the story's current scene, i.e. this worker started it."""
+    token = story_events.scene(story_id)
+    return token is not None and token == (story_data or {}).get("scene_events")
+
+def wait_for_scene(story_id, timeout):
+    """
+    Waits up to `timeout` seconds for the story's current scene to finish and
+    returns the stored story. Scenes started by another worker publish no
+    events here, so for those the stored status is re-read every
+    STATUS_RECHECK_SECONDS instead.
+    """
+    deadline = time.monotonic() + timeout
+    story_data = stories.get(story_id)
+    while (story_data or {}).get("status") == "processing":
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if events_are_local(story_id, story_data):
+            story_events.wait_until_done(story_id, min(remaining, STATUS_RECHECK_SECONDS))
+        else:
+            time.sleep(min(remaining, STATUS_RECHECK_SECONDS))
+        story_data = stories.get(story_id)
+    return story_data
+
 @app.route('/story_status/<story_id>', methods=['GET'])
 def story_status(story_id):
+    story_data = stories.get(story_id)
+    if story_data is None:
+        return jsonify({'error': 'Invalid story_id'}), 400
+
+    # Optional long-poll: ?wait=N holds the request until the scene finishes
+    # (or N seconds pass) instead of answering "processing" straight away.
+    wait = min(request.args.get('wait', 0, type=float), 60)
+    if wait > 0 and story_data.get("status") == "processing":
+        story_data = wait_for_scene(story_id, wait) or story_data
+
+    return jsonify(status_payload(story_id, story_data, debug_requested()))
+
+@app.route('/story_events/<story_id>', methods=['GET'])
+def story_events_stream(story_id):
+    """
+    Server-Sent Events stream of the current scene's progress: llm_done,
+    images_done, video_done, audio_done, then completed (carrying the same
+    payload as /story_status) or error. The stream closes after either,
+    unless the scene completed without a video or narration that may still
+    arrive (degraded "timeout"): it then stays open and sends video_done /
+    audio_done with the full payload again until nothing more is coming.
+    """
     if story_id not in stories:
         return jsonify({'error': 'Invalid story_id'}), 400
 
-    story_data = stories[story_id]
+    last_seq = request.headers.get('Last-Event-ID', 0, type=int)
+    debug = debug_requested()
+
+    def stream():
+        after = last_seq
+        idle_since = time.monotonic()
+        # The degraded stages last sent, once the scene has completed.
+        sent_degraded = None
+        while True:
+            story_data = stories.get(story_id) or {}
+            if events_are_local(story_id, story_data):
+                events = story_events.wait(story_id, after, timeout=STATUS_RECHECK_SECONDS)
+            else:
+                # Started by another worker, whose events never reach this one.
+                events = []
+                if sent_degraded is not None or story_data.get("status") not in TERMINAL_EVENTS:
+                    time.sleep(STATUS_RECHECK_SECONDS)
+            if not events:
+                # Nothing published here; see whether the stored scene moved on.
+                story_data = stories.get(story_id) or {}
+                degraded = story_data.get("result", {}).get("degraded", {})
+                if sent_degraded is None and story_data.get("status") in TERMINAL_EVENTS:
+                    events = [(None, story_data["status"], {})]
+                elif sent_degraded is not None:
+                    events = [
+                        (None, STAGE_EVENTS[stage], {}) for stage, reason in sent_degraded.items()
+                        if degraded.get(stage) != reason
+                    ]
+            if not events:
+                if time.monotonic() - idle_since >= 15:
+                    # Keeps proxies from closing an idle connection.
+                    yield ": keepalive\n\n"
+                    idle_since = time.monotonic()
+                continue
+            idle_since = time.monotonic()
+            for seq, event, data in events:
+                if seq is not None:
+                    after = seq
+                if event == "completed" or sent_degraded is not None:
+                    story_data = stories.get(story_id) or {}
+                    data = status_payload(story_id, story_data, debug)
+                event_id = f"id: {seq}\n" if seq is not None else ""
+                yield f"{event_id}event: {event}\ndata: {json.dumps(data)}\n\n"
+                if event == "error":
+                    return
+                if event == "completed" or sent_degraded is not None:
+                    result = story_data.get("result", {})
+                    if not awaiting_media(result):
+                        return
+                    sent_degraded = dict(result.get("degraded", {}))
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+@app.route('/trees', methods=['POST'])
+def start_tree():
+    """Starts pre-generating every branch of a new story up to max_depth (at most TREE_MAX_DEPTH) actions deep."""
+    data = request.get_json()
+    if not data or not isinstance(data.get('user_theme'), str) or not data['user_theme'].strip():
+        return jsonify({'error': 'Missing user_theme in request body'}), 400
+
+    max_depth = data.get('max_depth', 5)
+    # bool is an int too, but "max_depth": true is a client bug.
+    if isinstance(max_depth, bool) or not isinstance(max_depth, int) or max_depth < 1:
+        return jsonify({'error': 'max_depth must be a positive integer'}), 400
+    build = tree_builder.start(data['user_theme'], min(max_depth, TREE_MAX_DEPTH))
+    return jsonify(build.progress())
+
+@app.route('/trees/<tree_id>/resume', methods=['POST'])
+def resume_tree(tree_id):
+    """Continues an interrupted build; nodes already in its checkpoint log are kept."""
+    build = tree_builder.resume(tree_id)
+    if build is None:
+        return jsonify({'error': 'Invalid tree_id'}), 400
+    return jsonify(build.progress())
+
+@app.route('/trees/<tree_id>', methods=['GET'])
+def get_tree(tree_id):
+    build = tree_builder.get(tree_id)
+    if build is None:
+        return jsonify({'error': 'Invalid tree_id'}), 400
+    return jsonify(dict(build.progress(), tree=build.tree()))
+
+@app.route('/images/<key>.png', methods=['GET'])
+def cached_image(key):
+    if not image_cache.contains(key):
+        abort(404)
+    response = send_file(image_cache.path(key), mimetype="image/png", conditional=True)
+    # Keys are content hashes, so the bytes behind a URL never change.
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+@app.route('/audio/<key>.mp3', methods=['GET'])
+def narration_audio(key):
+    asset = narration_streams.get(key)
+    if asset is not None:
+        # Still streaming in: send what is there and follow the file as it grows
+        # (chunked, so playback can start right away).
+        response = Response(stream_with_context(asset.follow()), mimetype="audio/mpeg")
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    if not audio_cache.contains(key):
+        partial = narration_streams.partial_path(key)
+        if partial is None:
+            abort(404)
+        # Streaming in on another worker sharing the cache: follow its file instead.
+        response = Response(stream_with_context(follow_file(partial)), mimetype="audio/mpeg")
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    # send_file handles Range requests and ETag / If-None-Match for us.
+    response = send_file(audio_cache.path(key), mimetype="audio/mpeg", conditional=True)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
     return jsonify({
-        "status": story_data.get("status", "unknown"),
-        "result": story_data.get("result", {})
+        "images": image_cache.stats(),
+        "narration": dict(audio_cache.stats(), **narration_flight.stats(), **narration_streams.stats()),
+        "initialize": init_flights.stats(),
+        "frames": media_prep.stats() if media_prep else None,
     })
 
+@app.route('/scheduler_stats', methods=['GET'])
+def scheduler_stats():
+    return jsonify({
+        "jobs": scheduler.stats(),
+        "async_in_flight": async_pipeline.in_flight if async_pipeline else None,
+        "stages": stage_limits.stats(),
+        "speculation": speculation.stats(),
+        "image_calls": (async_pipeline.image_calls if async_pipeline else image_calls).stats(),
+        "runway": dict(
+            runway_client.accounts.stats(),
+            assets_moved=(async_pipeline.runway if async_pipeline else runway_client).assets.moved,
+        ),
+    })
+
+@app.route('/catalog_stats', methods=['GET'])
+def catalog_stats():
+    return jsonify(catalog.stats() if catalog else {})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/context_stats', methods=['GET'])
+def context_stats():
+    return jsonify(storylines.stats())
+
 # -------------------------------------------------------------------
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
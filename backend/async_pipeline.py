@@ -0,0 +1,672 @@
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import time
+
+import httpx
+from openai import AsyncOpenAI
+from elevenlabs.client import AsyncElevenLabs
+
+from cache import make_key
+from poller import next_delay, PollTimeout, PollCancelled, TaskFailed
+from runway import (task_polls, task_video_url, RUNWAY_EXPECTED_SECONDS, RUNWAY_TASK_DEADLINE, RUNWAY_POLL_MAX_ERRORS,
+                    STREAM_CHUNK_SIZE)
+from runway_accounts import AccountAssets
+from json_stream import SceneStreamParser
+from metrics import span, upstream_retries, upstream_first_byte, upstream_bytes, counted_async
+from storyline import estimate_tokens
+from hedging import HedgedCalls
+from scene_race import SceneRace, scene_llm_seconds
+from prompts import init_story_prompt, story_part_prompt, parse_scene_reply, InvalidSceneReply, streamed_scene_prompt
+from scheduler import QueueFull
+from stages import StageCancelled, StageError
+
+
+class EventLoopThread:
+    """Runs an asyncio event loop on a background thread so sync code can submit coroutines."""
+
+    def __init__(self, name="pipeline-loop"):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name=name, daemon=True).start()
+
+    def submit(self, coro):
+        """Schedules `coro` on the loop and returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+
+class AsyncRunway:
+    """The useapi.net Runway endpoints used by RunwayUnofficial, on a shared httpx.AsyncClient."""
+
+    def __init__(self, http, base_url, api_key, accounts, expected_seconds=45, deadline=600, media_prep=None,
+                 max_poll_errors=3):
+        self.http = http
+        self.media_prep = media_prep
+        self.base_url = base_url
+        self.api_key = api_key
+        # The RunwayAccounts whose task slots are shared with RunwayUnofficial.
+        self.accounts = accounts
+        self.expected_seconds = expected_seconds
+        self.deadline = deadline
+        self.max_poll_errors = max_poll_errors
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.assets = AccountAssets(max_entries=512)
+        self._task_accounts = {}
+        # Polls of abandoned tasks, kept until they free their slots.
+        self._releasing = set()
+
+    async def upload_image(self, image_url, account=None):
+        asset_id = self.assets.get(image_url, account)
+        if asset_id:
+            return asset_id
+
+        account = account or self.accounts.preferred()
+        with span("runway_upload", account=account.email):
+            if os.path.exists(image_url):
+                asset_id = await self._upload_file(image_url, account)
+            else:
+                # Not cached locally: stream it to a temporary file first.
+                with tempfile.TemporaryDirectory() as directory:
+                    asset_id = await self._upload_file(await self._download(image_url, directory), account)
+
+        self.assets.add(account, image_url, asset_id)
+        return asset_id
+
+    async def _download(self, image_url, directory):
+        path = os.path.join(directory, image_url.split("?")[0].split("/")[-1] or "image.png")
+        async with self.http.stream("GET", image_url) as image_response:
+            if image_response.status_code != 200:
+                raise Exception(f"Failed to download image from {image_url}")
+            with open(path, "wb") as f:
+                async for chunk in counted_async(image_response.aiter_bytes(STREAM_CHUNK_SIZE), "image_download"):
+                    f.write(chunk)
+        return path
+
+    async def _upload_file(self, image_path, account):
+        # Sent as a video-sized frame where possible.
+        path = await self.media_prep.prepare_async(image_path) if self.media_prep else image_path
+        filename = image_path.split("/")[-1]
+        size = os.path.getsize(path)
+        response = await self.accounts.call_async(account, lambda: self.http.post(
+            f"{self.base_url}/assets/",
+            params={"name": filename.split('.')[0], "email": account.email},
+            headers={**self.headers, "Content-Type": _content_type(path), "Content-Length": str(size)},
+            content=_read_chunks(path),
+        ))
+        upstream_bytes.inc(size, call="runway_upload")
+        if response.status_code != 200:
+            raise Exception(f"Failed to upload image: {response.text}")
+        return response.json()['assetId']
+
+    async def create_video_task(self, asset_ids, video_generation_prompt):
+        """Like RunwayUnofficial.create_video_task: the task's slot is held until wait_for_task() returns."""
+        account = await self.accounts.acquire_async(prefer=self.assets.usual_owner(asset_ids))
+        try:
+            asset_ids = [await self._asset_on(account, asset_id) for asset_id in asset_ids]
+            task_id = await self._create_task(account, asset_ids, video_generation_prompt)
+        except BaseException:
+            self.accounts.release(account, ok=False)
+            raise
+        self._task_accounts[task_id] = account
+        return task_id
+
+    async def _asset_on(self, account, asset_id):
+        owner, image_url = self.assets.owner(asset_id)
+        if owner is None or owner is account:
+            return asset_id
+        self.assets.record_move()
+        return await self.upload_image(image_url, account)
+
+    async def _create_task(self, account, asset_ids, video_generation_prompt):
+        payload = {
+            "firstImage_assetId": asset_ids[0],
+            "middleImage_assetId": asset_ids[1] if len(asset_ids) > 2 else None,
+            "lastImage_assetId": asset_ids[-1],
+            "text_prompt": video_generation_prompt,
+            "aspect_ratio": "landscape",
+            "seconds": 10,
+            "maxJobs": account.max_jobs
+        }
+        with span("runway_create", account=account.email):
+            response = await self.accounts.call_async(account, lambda: self.http.post(
+                f"{self.base_url}/gen3turbo/create", headers=self.headers, json=payload
+            ))
+            if response.status_code != 200:
+                raise Exception(f"Failed to create video generation task: {response.text}")
+        return response.json()['taskId']
+
+    async def wait_for_task(self, task_id, min_interval=1.0, max_interval=15.0, cancel_event=None):
+        """
+        Polls on the same schedule, and with the same tolerance for failed
+        polls, as TaskPoller, without a thread. Raises PollCancelled soon after
+        `cancel_event` is set.
+        """
+        started = time.monotonic()
+        with span("runway_wait") as attrs:
+            attrs["polls"] = 0
+            try:
+                video_url = await self._poll_task(task_id, started, min_interval, max_interval, cancel_event, attrs)
+            except (PollCancelled, asyncio.CancelledError):
+                # Runway keeps rendering the task, so its slot stays taken.
+                task = asyncio.ensure_future(self._release_when_done(task_id, started, min_interval, max_interval))
+                self._releasing.add(task)
+                task.add_done_callback(self._releasing.discard)
+                raise
+            except Exception:
+                self._release_task(task_id, False)
+                raise
+            finally:
+                task_polls.observe(attrs["polls"])
+        self._release_task(task_id, True)
+        return video_url
+
+    async def _poll_task(self, task_id, started, min_interval, max_interval, cancel_event, attrs):
+        errors = 0
+        while True:
+            elapsed = time.monotonic() - started
+            delay = next_delay(elapsed, self.expected_seconds, min_interval, max_interval)
+            delay *= 1 + random.uniform(-0.2, 0.2)
+            await _sleep_unless(cancel_event, max(0.0, min(delay, self.deadline - elapsed)))
+            if cancel_event is not None and cancel_event.is_set():
+                raise PollCancelled(f"Stopped polling task {task_id}")
+
+            attrs["polls"] += 1
+            try:
+                video_url = task_video_url(
+                    await self.http.get(f"{self.base_url}/tasks/{task_id}", headers=self.headers)
+                )
+                errors = 0
+            except TaskFailed:
+                raise
+            except Exception as e:
+                errors += 1
+                if errors >= self.max_poll_errors:
+                    raise
+                print(f"Polling task {task_id} failed ({errors}/{self.max_poll_errors}): {e}")
+                video_url = None
+            if video_url:
+                return video_url
+
+            if time.monotonic() - started >= self.deadline:
+                raise PollTimeout(f"Task {task_id} not done after {self.deadline}s ({attrs['polls']} polls)")
+
+    def _release_task(self, task_id, ok):
+        account = self._task_accounts.pop(task_id, None)
+        if account is not None:
+            self.accounts.release(account, ok)
+
+    async def _release_when_done(self, task_id, started, min_interval, max_interval):
+        """Keeps polling a task nobody waits for any more, to free its account's slot once it ends."""
+        ok = False
+        try:
+            await self._poll_task(task_id, started, min_interval, max_interval, None, {"polls": 0})
+            ok = True
+        except Exception as e:
+            print(f"Task {task_id} ended after it was abandoned: {e}")
+        finally:
+            self._release_task(task_id, ok)
+
+
+async def _sleep_unless(cancel_event, seconds, step=0.5):
+    """Sleeps for `seconds`, waking up early once `cancel_event` (a threading.Event) is set."""
+    end = time.monotonic() + seconds
+    while cancel_event is None or not cancel_event.is_set():
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(remaining if cancel_event is None else min(remaining, step))
+
+
+async def _read_chunks(path, chunk_size=STREAM_CHUNK_SIZE):
+    """Streams a file from disk without blocking the event loop."""
+    with open(path, "rb") as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _content_type(path):
+    ext = path.lower().rsplit(".", 1)[-1]
+    return {"jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}.get(ext, "image/png")
+
+
+class AsyncPipeline:
+    """
+    The scene generation pipeline on a single event loop: async OpenAI,
+    ElevenLabs and HTTP clients with pooled connections, so hundreds of
+    stories can be in flight without a thread each.
+
+    Caches and the image URL -> local file mapping are shared with the
+    threaded pipeline in app.py and passed in.
+    """
+
+    def __init__(self, openai_api_key, openai_model, elevenlabs_api_key, useapi_base_url, useapi_api_key,
+                 runway_accounts, image_cache, audio_cache, resolve_image, limits, max_in_flight=500,
+                 streaming=True, json_mode=True, elevenlabs_base_url=None, narration_streams=None,
+                 media_prep=None, image_hedge_percentile=90, image_retries=2, scene_models=None, llm_race=1):
+        self.openai_model = openai_model
+        # Scene model by tier ("opening", "continuation") and completions raced per attempt.
+        self.scene_models = scene_models or {"opening": openai_model, "continuation": openai_model}
+        self.llm_race = llm_race
+        self.streaming = streaming
+        self.json_mode = json_mode
+        # A StreamingAssets to stream narration into, or None to buffer it.
+        self.narration_streams = narration_streams
+        self.image_cache = image_cache
+        self.audio_cache = audio_cache
+        self.resolve_image = resolve_image
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+            timeout=httpx.Timeout(120.0, connect=10.0),
+        )
+        self.openai = AsyncOpenAI(api_key=openai_api_key)
+        self.elevenlabs = AsyncElevenLabs(api_key=elevenlabs_api_key, base_url=elevenlabs_base_url)
+        self.runway = AsyncRunway(
+            self.http, useapi_base_url, useapi_api_key, runway_accounts,
+            expected_seconds=RUNWAY_EXPECTED_SECONDS, deadline=RUNWAY_TASK_DEADLINE, media_prep=media_prep,
+            max_poll_errors=RUNWAY_POLL_MAX_ERRORS,
+        )
+        self.limits = {name: asyncio.Semaphore(n) for name, n in limits.items()}
+        # Hedged, retried DALLE calls; duplicates only when an image slot is free.
+        self.image_calls = HedgedCalls(
+            "dalle",
+            percentile=image_hedge_percentile,
+            retries=image_retries,
+            can_hedge=lambda: not self.limits["images"].locked(),
+        )
+        self._narrations = {}
+
+    def admit(self, coro):
+        """
+        Wraps a story job so it counts against `max_in_flight`; raises
+        QueueFull (closing the coroutine) when the pipeline is saturated.
+        """
+        with self._in_flight_lock:
+            if self.in_flight >= self.max_in_flight:
+                coro.close()
+                raise QueueFull(retry_after=5)
+            self.in_flight += 1
+
+        async def run():
+            try:
+                return await coro
+            finally:
+                with self._in_flight_lock:
+                    self.in_flight -= 1
+        return run()
+
+    async def _scene_completion(self, prompt, model, on_image_prompt, on_narration, attempt):
+        options = {"response_format": {"type": "json_object"}} if self.json_mode else {}
+        prompt_tokens = estimate_tokens(prompt)
+        async with self.limits["llm"]:
+            with span("llm", attempt=attempt + 1, model=model):
+                if self.streaming:
+                    parser = SceneStreamParser(on_image_prompt, on_narration)
+                    stream = await self.openai.chat.completions.create(
+                        model=model,
+                        messages=[{"role": "user", "content": prompt}],
+                        stream=True,
+                        stream_options={"include_usage": True},
+                        **options,
+                    )
+                    parts = []
+                    # Closed if the racer is cancelled, so a losing stream stops costing tokens.
+                    async with stream:
+                        async for chunk in stream:
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                parts.append(chunk.choices[0].delta.content)
+                                parser.feed(chunk.choices[0].delta.content)
+                            if getattr(chunk, "usage", None):
+                                prompt_tokens = chunk.usage.prompt_tokens
+                    assistant_reply = "".join(parts).strip()
+                else:
+                    response = await self.openai.chat.completions.create(
+                        model=model,
+                        messages=[{"role": "user", "content": prompt}],
+                        **options,
+                    )
+                    assistant_reply = response.choices[0].message.content.strip()
+                    if getattr(response, "usage", None):
+                        prompt_tokens = response.usage.prompt_tokens
+        return assistant_reply, prompt_tokens
+
+    async def _race_completion(self, race, racer, prompt, image_count, attempt, max_retries):
+        on_image_prompt, on_narration = race.callbacks(racer)
+        try:
+            assistant_reply, prompt_tokens = await self._scene_completion(
+                prompt, race.model, on_image_prompt, on_narration, attempt
+            )
+            result_json = parse_scene_reply(assistant_reply, image_count)
+            result_json["prompt_tokens"] = prompt_tokens
+        except asyncio.CancelledError:
+            race.finish(racer, outcome="stopped")
+            raise
+        except InvalidSceneReply as e:
+            print(f"{e} (attempt {attempt + 1}/{max_retries})")
+            upstream_retries.inc(call="llm", reason="invalid_reply")
+            race.last_reply = assistant_reply
+            race.finish(racer, outcome="invalid")
+        except Exception as e:
+            race.finish(racer, outcome="error", error=e)
+        else:
+            race.finish(racer, result_json)
+
+    async def _complete(self, prompt, image_count, max_retries, on_image_prompt=None, on_narration=None,
+                        tier="continuation"):
+        """Like app.request_scene: each attempt races `llm_race` completions; the losers are cancelled."""
+        started = time.monotonic()
+        streamed = {}
+        for attempt in range(max_retries):
+            race = SceneRace(self.llm_race, tier, self.scene_models[tier], on_image_prompt, on_narration, streamed)
+            attempt_prompt = streamed_scene_prompt(prompt, streamed, image_count) if streamed else prompt
+            racers = [
+                asyncio.ensure_future(
+                    self._race_completion(race, racer, attempt_prompt, image_count, attempt, max_retries)
+                )
+                for racer in range(self.llm_race)
+            ]
+            try:
+                result_json = await race.result_async()
+            finally:
+                for task in racers:
+                    task.cancel()
+            if result_json is not None:
+                scene_llm_seconds.observe(time.monotonic() - started, tier=tier)
+                return result_json
+
+        print(f"All attempts failed. Last response: {race.last_reply}")
+        return None
+
+    async def init_story(self, user_theme, max_retries=3, on_image_prompt=None, on_narration=None):
+        return await self._complete(init_story_prompt(user_theme), 3, max_retries, on_image_prompt, on_narration,
+                                    tier="opening")
+
+    async def generate_story_part(self, user_action, last_image_prompt, storyline, core_details, max_retries=3,
+                                  on_image_prompt=None, on_narration=None):
+        result_json = await self._complete(
+            story_part_prompt(user_action, last_image_prompt, storyline, core_details),
+            2, max_retries, on_image_prompt, on_narration,
+        )
+        if result_json:
+            result_json["storyline"] = result_json.get("new_storyline", "")
+        return result_json
+
+    async def _request_image(self, prompt, image_size, model, quality):
+        async with self.limits["images"]:
+            with self.image_calls.timed(), span("dalle"):
+                response = await self.openai.images.generate(
+                    model=model, prompt=prompt, size=image_size, quality=quality, n=1
+                )
+        return response.data[0].url
+
+    async def generate_single_image(self, prompt, image_size="1792x1024", model="dall-e-3", quality="hd"):
+        key = make_key(model, prompt, image_size, quality)
+        if self.image_cache.lookup(key):
+            return f"/images/{key}.png"
+
+        try:
+            image_url = await self.image_calls.call_async(self._request_image, prompt, image_size, model, quality)
+        except Exception as e:
+            print(f"Error generating image for prompt '{prompt}': {e}")
+            return None
+
+        try:
+            tmp_path = self.image_cache.temp_path(key)
+            try:
+                with span("image_download"), open(tmp_path, "wb") as f:
+                    async with self.http.stream("GET", image_url) as image_response:
+                        image_response.raise_for_status()
+                        async for chunk in counted_async(image_response.aiter_bytes(STREAM_CHUNK_SIZE), "image_download"):
+                            await asyncio.to_thread(f.write, chunk)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self.image_cache.put_file(key, tmp_path)
+            return f"/images/{key}.png"
+        except Exception as e:
+            print(f"Error caching image for prompt '{prompt}': {e}")
+            return image_url
+
+    async def generate_narration(self, text, voice_id, model_id="eleven_multilingual_v2", output_format="mp3_44100_128"):
+        key = make_key(text, voice_id, model_id, output_format)
+        if self.audio_cache.lookup(key):
+            return f"/audio/{key}.mp3"
+
+        if self.narration_streams is not None:
+            asset, created = self.narration_streams.start(key)
+            if created:
+                task = asyncio.ensure_future(self._stream_narration(key, asset, text, voice_id, model_id, output_format))
+                # Keeps streaming after this returns.
+                self._narrations[key] = task
+                task.add_done_callback(lambda _: self._narrations.pop(key, None))
+            loop = asyncio.get_running_loop()
+            ready = loop.create_future()
+            asset.when_ready(lambda: loop.call_soon_threadsafe(_resolve, ready))
+            await ready
+            if not asset.size or asset.error is not None:
+                raise Exception(f"Narration failed: {asset.error}")
+            return f"/audio/{key}.mp3"
+
+        # Identical narrations in flight share one upstream call.
+        task = self._narrations.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._synthesize(key, text, voice_id, model_id, output_format))
+            self._narrations[key] = task
+            task.add_done_callback(lambda _: self._narrations.pop(key, None))
+        await asyncio.shield(task)
+        return f"/audio/{key}.mp3"
+
+    async def _synthesize(self, key, text, voice_id, model_id, output_format):
+        async with self.limits["tts"]:
+            with span("tts"):
+                chunks = []
+                async for chunk in self.elevenlabs.text_to_speech.convert(
+                    text=text, voice_id=voice_id, model_id=model_id, output_format=output_format,
+                ):
+                    chunks.append(chunk)
+        await asyncio.to_thread(self.audio_cache.put, key, b"".join(chunks))
+
+    async def _stream_narration(self, key, asset, text, voice_id, model_id, output_format):
+        try:
+            async with self.limits["tts"]:
+                with span("tts") as attrs:
+                    async for chunk in self.elevenlabs.text_to_speech.stream(
+                        text=text, voice_id=voice_id, model_id=model_id, output_format=output_format,
+                    ):
+                        if asset.first_byte is None:
+                            upstream_first_byte.observe(time.monotonic() - asset.started, call="tts")
+                        asset.append(chunk)
+                    attrs["first_byte"] = asset.first_byte
+            self.narration_streams.finish(key, asset)
+        except asyncio.CancelledError as e:
+            self.narration_streams.fail(key, asset, e)
+            raise
+        except Exception as e:
+            print(f"Error streaming narration {key}: {e}")
+            self.narration_streams.fail(key, asset, e)
+
+    async def generate_scene(self, story_id, generate_llm, voice_id, previous_image_url=None, cancel=None,
+                             on_stage_done=None, timings=None, budgets=None, late=None, degraded=None):
+        """
+        Async counterpart of app.generate_scene. `generate_llm(on_image_prompt,
+        on_narration)` is a coroutine function that streams the scene; images
+        and narration start as soon as their prompt / text arrives. Returns
+        (stage results, timings) with the same stage names as the threaded
+        pipeline. Pass `timings` to see how far a failed scene got.
+
+        With `budgets`, the video and narration may fail or run late without
+        failing the scene: `degraded` gets the reason for each, and `late` the
+        tasks of the ones still running.
+        """
+        started = time.monotonic()
+        timings = {} if timings is None else timings
+        late = {} if late is None else late
+        degraded = {} if degraded is None else degraded
+        budgets = {name: seconds for name, seconds in (budgets or {}).items() if seconds}
+        results = {}
+
+        def check_cancel():
+            if cancel is not None and cancel.is_set():
+                raise StageCancelled(f"{story_id} was cancelled")
+
+        async def stage(name, coro):
+            # Every stage is started up front, so each also checks for
+            # cancellation whenever it is done waiting on another (check_cancel).
+            try:
+                check_cancel()
+            except StageCancelled:
+                coro.close()
+                raise
+            start = time.monotonic()
+            try:
+                result = await coro
+            except StageCancelled:
+                raise
+            except Exception as e:
+                if cancel is not None and cancel.is_set():
+                    raise StageCancelled(f"{story_id} was cancelled") from e
+                raise StageError(name, e)
+            finally:
+                end = time.monotonic()
+                timings[name] = {
+                    "start": round(start - started, 3),
+                    "end": round(end - started, 3),
+                    "duration": round(end - start, 3),
+                }
+            results[name] = result
+            # Late stages are attached by the caller once they finish.
+            if on_stage_done and name not in late:
+                on_stage_done(name, result)
+            return result
+
+        async def within_budget(name, task):
+            if name not in budgets:
+                return await task
+            try:
+                await asyncio.wait_for(asyncio.shield(task), max(0.0, started + budgets[name] - time.monotonic()))
+            except asyncio.TimeoutError:
+                degraded[name] = "timeout"
+                late[name] = task
+            except StageError as e:
+                print(f"[{story_id}] Optional stage '{name}' failed: {e.error!r}")
+                degraded[name] = "error"
+
+        image_count = 3 if previous_image_url is None else 2
+        loop = asyncio.get_running_loop()
+        image_prompts = [loop.create_future() for _ in range(image_count)]
+        narration_text = loop.create_future()
+
+        def dispatch(future, value):
+            if not future.done():
+                future.set_result(value)
+
+        def on_image_prompt(index, prompt):
+            if index < image_count:
+                dispatch(image_prompts[index], prompt)
+
+        async def llm():
+            print(f"[{story_id}] Generating LLM response...")
+            generated_story = await generate_llm(on_image_prompt, lambda text: dispatch(narration_text, text))
+            if not generated_story:
+                raise Exception("Error generating LLM response")
+            # Keep the scene consistent with whatever was already handed off.
+            for i, future in enumerate(image_prompts):
+                if future.done():
+                    generated_story["image_prompts"][i] = future.result()
+                else:
+                    future.set_result(generated_story["image_prompts"][i])
+            if narration_text.done():
+                generated_story["narration"] = narration_text.result()
+            else:
+                narration_text.set_result(generated_story["narration"])
+            print(f"[{story_id}]" + str(generated_story))
+            return generated_story
+
+        async def image(prompt_future):
+            prompt = await prompt_future
+            check_cancel()
+            image_url = await self.generate_single_image(prompt)
+            if not image_url:
+                raise Exception("Image failed to generate")
+            return image_url
+
+        async def upload(image_task):
+            image_url = await image_task
+            check_cancel()
+            return await self.runway.upload_image(self.resolve_image(image_url) or image_url)
+
+        async def collect(name, tasks):
+            return await stage(name, _gather(tasks))
+
+        async def video(upload_tasks):
+            asset_ids = await asyncio.gather(*upload_tasks)
+            generated_story = await llm_task
+            async with self.limits["video"]:
+                check_cancel()
+                task_id = await self.runway.create_video_task(list(asset_ids), generated_story.get("video_generation_prompt"))
+                print(f"[{story_id}] Task created: {task_id}")
+                return await self.runway.wait_for_task(task_id, cancel_event=cancel)
+
+        async def narration():
+            text = await narration_text
+            check_cancel()
+            return await self.generate_narration(text, voice_id)
+
+        llm_task = asyncio.ensure_future(stage("llm", llm()))
+        tasks = [llm_task]
+        try:
+            image_tasks = [
+                asyncio.ensure_future(stage(f"image_{i}", image(image_prompts[i])))
+                for i in range(image_count)
+            ]
+            upload_tasks = []
+            if previous_image_url is not None:
+                upload_tasks.append(asyncio.ensure_future(stage("upload_previous", upload(_done(previous_image_url)))))
+            upload_tasks += [
+                asyncio.ensure_future(stage(f"upload_{i}", upload(image_tasks[i]))) for i in range(image_count)
+            ]
+            images_task = asyncio.ensure_future(collect("images", image_tasks))
+            video_task = asyncio.ensure_future(stage("video", video(upload_tasks)))
+            narration_task = asyncio.ensure_future(stage("narration", narration()))
+            tasks += image_tasks + upload_tasks + [images_task, video_task, narration_task]
+            if not budgets:
+                await asyncio.gather(llm_task, images_task, video_task, narration_task)
+            else:
+                await asyncio.gather(llm_task, images_task)
+                await within_budget("video", video_task)
+                await within_budget("narration", narration_task)
+        finally:
+            # A late video still needs its uploads.
+            keep = set(late.values()) | (set(upload_tasks) if "video" in late else set())
+            for task in tasks:
+                if task not in keep:
+                    task.cancel()
+            for future in image_prompts + [narration_text]:
+                future.cancel()
+            elapsed = round(time.monotonic() - started, 3)
+            timings["total"] = {"start": 0.0, "end": elapsed, "duration": elapsed}
+
+        return results, timings
+
+
+async def _gather(tasks):
+    return list(await asyncio.gather(*tasks))
+
+
+async def _done(value):
+    return value
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
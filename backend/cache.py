@@ -0,0 +1,291 @@
+import os
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def make_key(*parts):
+    """Content-addressed cache key: a sha256 over the parts that define the output."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    A size-bounded byte cache on local disk. Entries are files named after their
+    key; when the total size goes over `max_bytes` the least recently used
+    entries are deleted. Existing files are picked up on startup, so the cache
+    survives restarts.
+
+    Several processes (e.g. gunicorn workers) can share a directory: an entry
+    another process wrote is picked up the first time it is asked for, and one
+    it evicted is dropped from this process's index once it is found missing.
+    """
+
+    def __init__(self, directory, max_bytes, extension=""):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.extension) or name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name[:len(name) - len(self.extension)], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+    def _adopt(self, key):
+        """Indexes `key` if another process sharing the directory has written it. Returns whether it exists."""
+        try:
+            size = os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = size
+                self._size += size
+        return True
+
+    def _forget(self, key):
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+
+    def contains(self, key):
+        with self._lock:
+            known = key in self._entries
+        if not known:
+            return self._adopt(key)
+        if os.path.exists(self.path(key)):
+            return True
+        # Evicted by another process.
+        self._forget(key)
+        return False
+
+    def lookup(self, key):
+        """Returns the path of a cached entry (counting a hit or a miss), or None."""
+        with self._lock:
+            known = key in self._entries
+            if known:
+                self._entries.move_to_end(key)
+        path = self.path(key)
+        try:
+            if not known and not self._adopt(key):
+                raise FileNotFoundError(path)
+            # Keep the on-disk order in line with the in-memory LRU for restarts.
+            os.utime(path)
+        except FileNotFoundError:
+            self._forget(key)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def get(self, key):
+        path = self.lookup(key)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def put(self, key, data):
+        """Stores `data` under `key` and returns its path."""
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._size += len(data)
+            self._evict()
+        return path
+
+    def temp_path(self, key):
+        """A unique path next to the entry for `key`, to write it at before put_file()."""
+        return f"{self.path(key)}.{uuid.uuid4().hex}.tmp"
+
+    def put_stream(self, key, chunks):
+        """Stores an iterable of byte chunks under `key` without holding them all in memory; returns its path."""
+        tmp_path = self.temp_path(key)
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return self.put_file(key, tmp_path)
+
+    def put_file(self, key, src_path):
+        """Moves a finished file (on the same filesystem) into the cache under `key`; returns its path."""
+        path = self.path(key)
+        size = os.path.getsize(src_path)
+        os.replace(src_path, path)
+
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._size += size
+            self._evict()
+        return path
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the
+    function, and everyone who arrives while it is running waits for and
+    shares its result (or its exception).
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "coalesced": self.coalesced}
+
+
+class SharedResults:
+    """
+    Non-blocking single-flight with a short-lived result cache, for work that
+    many callers ask for at once but that runs in the background.
+
+    join() tells each caller whether it should run the work ("leader"), will
+    be handed the leader's result ("follower"), or can use a result finished
+    less than `ttl` seconds ago ("cached"). The leader reports back with
+    finish() or fail(), which return the followers to notify.
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.coalesced = 0
+        self.cache_hits = 0
+        self._waiting = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def join(self, key, subscriber):
+        """Returns (role, cached result or None)."""
+        with self._lock:
+            cached = self._results.get(key)
+            if cached and cached[1] > time.monotonic():
+                self.cache_hits += 1
+                return "cached", cached[0]
+            if key in self._waiting:
+                self._waiting[key].append(subscriber)
+                self.coalesced += 1
+                return "follower", None
+            self._waiting[key] = [subscriber]
+            return "leader", None
+
+    def subscribers(self, key):
+        """Everyone waiting on `key`, leader included."""
+        with self._lock:
+            return list(self._waiting.get(key, []))
+
+    def finish(self, key, result):
+        with self._lock:
+            waiting = self._waiting.pop(key, [])
+            now = time.monotonic()
+            for expired in [k for k, (_, expires) in self._results.items() if expires <= now]:
+                del self._results[expired]
+            self._results[key] = (result, now + self.ttl)
+        return waiting[1:]
+
+    def fail(self, key):
+        with self._lock:
+            waiting = self._waiting.pop(key, [])
+        return waiting[1:]
+
+    def drop(self, key, result):
+        """
+        Forgets a cached result that join() handed out but that turned out to
+        be unusable, so joining again leads (or follows) a new run.
+        """
+        with self._lock:
+            cached = self._results.get(key)
+            if cached and cached[0] == result:
+                del self._results[key]
+            self.cache_hits -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._waiting),
+                "coalesced": self.coalesced,
+                "cache_hits": self.cache_hits,
+            }
@@ -0,0 +1,119 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+
+class StoryCatalog:
+    """
+    Pre-generated story trees, indexed on disk so a scene is one primary-key
+    lookup away and nothing is parsed until it is asked for.
+
+    Each theme has a root scene; every other scene is stored under its parent
+    scene and the action that leads to it. A node is the scene's hot record
+    (what /story_status returns) plus the story context to continue from it.
+    """
+
+    def __init__(self, path="catalog.db"):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS themes (
+                theme_id TEXT PRIMARY KEY,
+                user_theme TEXT NOT NULL,
+                root_id TEXT NOT NULL
+            )""")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS nodes (
+                scene_id TEXT PRIMARY KEY,
+                theme_id TEXT NOT NULL,
+                parent_id TEXT,
+                action TEXT,
+                node TEXT NOT NULL
+            )""")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS nodes_parent_action ON nodes (parent_id, action)")
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def root(self, theme_id):
+        """The root node of a theme, or None if the theme isn't in the catalog."""
+        row = self._conn().execute(
+            "SELECT n.node FROM themes t JOIN nodes n ON n.scene_id = t.root_id WHERE t.theme_id = ?",
+            (theme_id,),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def child(self, scene_id, action):
+        """The node reached from `scene_id` by `action`, or None."""
+        row = self._conn().execute(
+            "SELECT node FROM nodes WHERE parent_id = ? AND action = ?", (scene_id, action)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, theme_id, parent_id, action, record, context, user_theme=None):
+        """
+        Adds a generated scene to the catalog; a root scene (no parent) also
+        registers the theme. Scenes that are already known are left alone.
+        """
+        node = {"record": record, "context": context}
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO nodes (scene_id, theme_id, parent_id, action, node) VALUES (?, ?, ?, ?, ?)",
+                (context["scene_id"], theme_id, parent_id, action, json.dumps(node)),
+            )
+            if parent_id is None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO themes (theme_id, user_theme, root_id) VALUES (?, ?, ?)",
+                    (theme_id, user_theme or "", context["scene_id"]),
+                )
+
+    def import_tree_log(self, theme_id, path):
+        """
+        Loads a tree checkpoint log (trees/<tree_id>.jsonl) into the catalog one
+        line at a time. Returns the number of nodes read.
+        """
+        user_theme = None
+        count = 0
+        scene_ids = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry["type"] == "tree":
+                    user_theme = entry["user_theme"]
+                    continue
+                node = entry["node"]
+                scene_ids[node["node_id"]] = node["context"]["scene_id"]
+                # The log refers to parents by tree node id; the catalog by scene id.
+                parent_id = scene_ids.get(node["parent"]) if node["parent"] else None
+                self.add(theme_id, parent_id, node["action"], node["record"], node["context"], user_theme)
+                count += 1
+        return count
+
+    def stats(self):
+        conn = self._conn()
+        return {
+            "themes": conn.execute("SELECT COUNT(*) FROM themes").fetchone()[0],
+            "nodes": conn.execute("SELECT COUNT(*) FROM nodes").fetchone()[0],
+        }
+
+
+if __name__ == "__main__":
+    # python catalog.py <theme_id> trees/<tree_id>.jsonl [catalog.db]
+    catalog = StoryCatalog(sys.argv[3] if len(sys.argv) > 3 else os.getenv('CATALOG_PATH', 'catalog.db'))
+    print(f"Imported {catalog.import_tree_log(sys.argv[1], sys.argv[2])} scenes into {catalog.path}")
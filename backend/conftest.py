@@ -0,0 +1,3 @@
+# test_api.py and bfs_test.py are scripts run by hand against a live server,
+# not unit tests; the unit tests are in tests/.
+collect_ignore = ["test_api.py", "bfs_test.py"]
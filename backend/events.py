@@ -0,0 +1,80 @@
+import threading
+import time
+import uuid
+
+# Events after which a scene is finished, one way or another.
+TERMINAL_EVENTS = ("completed", "error")
+
+
+class StoryEvents:
+    """
+    In-memory log of progress events for the scene each story is currently
+    generating. Subscribers (SSE streams and long-polls) block on wait() until
+    something newer than the last event they saw is published.
+    """
+
+    def __init__(self, max_events=50):
+        self.max_events = max_events
+        self._logs = {}
+        self._scenes = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def reset(self, story_id):
+        """
+        Starts a fresh log for a new scene so old completions aren't replayed.
+        Returns a token for the scene; stored with the story, it tells other
+        workers (whose logs never see this scene) not to trust their own.
+        """
+        token = uuid.uuid4().hex
+        with self._cond:
+            self._logs[story_id] = []
+            self._scenes[story_id] = token
+            self._cond.notify_all()
+        return token
+
+    def scene(self, story_id):
+        """Returns the token of the scene this process's log is for, or None."""
+        with self._cond:
+            return self._scenes.get(story_id)
+
+    def publish(self, story_id, event, data=None):
+        with self._cond:
+            self._seq += 1
+            log = self._logs.setdefault(story_id, [])
+            log.append((self._seq, event, data or {}))
+            del log[:-self.max_events]
+            self._cond.notify_all()
+
+    def discard(self, story_id):
+        with self._cond:
+            self._logs.pop(story_id, None)
+            self._scenes.pop(story_id, None)
+
+    def wait(self, story_id, after=0, timeout=15):
+        """
+        Returns the events published after sequence number `after`, waiting up
+        to `timeout` seconds for at least one. Returns [] on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                events = [e for e in self._logs.get(story_id, []) if e[0] > after]
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                self._cond.wait(remaining)
+
+    def wait_until_done(self, story_id, timeout):
+        """Blocks until the current scene has a terminal event or `timeout` passes."""
+        deadline = time.monotonic() + timeout
+        after = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            events = self.wait(story_id, after, remaining)
+            for seq, event, _ in events:
+                after = seq
+                if event in TERMINAL_EVENTS:
+                    return True
@@ -0,0 +1,481 @@
+"""
+Local stand-ins for the OpenAI (chat + images), ElevenLabs and useapi.net
+Runway endpoints the pipeline calls, so it can be benchmarked without
+spending anything (see load_test.py). Each provider answers after a
+lognormally distributed delay, fails a configurable share of requests with
+500s and turns requests away with 429s past its rate or concurrency limit.
+
+    python fake_providers.py --port 8100 --seed 1 --time-scale 0.1
+
+and start the app with
+
+    OPENAI_BASE_URL=http://localhost:8100/v1
+    ELEVENLABS_BASE_URL=http://localhost:8100
+    USEAPI_BASE_URL=http://localhost:8100/v1/runwayml
+    RUNWAY_EXPECTED_SECONDS=4.5     # runway_task median x time scale
+"""
+import argparse
+import base64
+import io
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+from flask import Flask, request, jsonify, Response, abort, stream_with_context
+from PIL import Image
+
+# Per provider: median latency in seconds and lognormal sigma, share of
+# requests that fail, sustained requests/second and burst (rate 0 = no
+# limit), and how many requests may be in flight at once (0 = no limit).
+# For runway_task the latency is how long a video task runs and the
+# concurrency is the account's maxJobs.
+DEFAULT_PROFILE = {
+    "chat":        {"median": 7.0,  "sigma": 0.35, "error_rate": 0.01, "invalid_rate": 0.02},
+    "images":      {"median": 14.0, "sigma": 0.25, "error_rate": 0.02, "rate": 0.5, "burst": 15},
+    "files":       {"median": 0.3,  "sigma": 0.5},
+    "tts":         {"median": 1.5,  "sigma": 0.3,  "error_rate": 0.01, "concurrency": 10},
+    "runway":      {"median": 0.4,  "sigma": 0.4,  "error_rate": 0.01},
+    "runway_task": {"median": 45.0, "sigma": 0.25, "error_rate": 0.03, "concurrency": 5},
+}
+
+WORDS = (
+    "lantern forest river tower shadow crystal meadow storm harbor ruin "
+    "dragon compass whisper ember glacier orchard bridge mirror canyon comet"
+).split()
+
+
+class Provider:
+    """The latency, failures and limits of one simulated provider."""
+
+    def __init__(self, name, rng, time_scale=1.0, median=1.0, sigma=0.0, error_rate=0.0,
+                 invalid_rate=0.0, rate=0, burst=1, concurrency=0):
+        self.name = name
+        self.rng = rng
+        self.time_scale = time_scale
+        self.median = median
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.invalid_rate = invalid_rate
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.concurrency = concurrency
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self.in_flight = 0
+        self.counts = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "max_in_flight": 0}
+        self._lock = threading.Lock()
+
+    def latency(self):
+        return self.median * math.exp(self.rng.gauss(0, self.sigma)) * self.time_scale
+
+    def chance(self, rate):
+        return self.rng.random() < rate
+
+    def admit(self):
+        """
+        Takes a request slot. Returns None if admitted, otherwise the number of
+        seconds the client should wait before retrying.
+        """
+        with self._lock:
+            self.counts["requests"] += 1
+            if self.rate:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate * self._speedup)
+                self._refilled = now
+                if self._tokens < 1:
+                    self.counts["rate_limited"] += 1
+                    return (1 - self._tokens) / (self.rate * self._speedup)
+                self._tokens -= 1
+            if self.concurrency and self.in_flight >= self.concurrency:
+                self.counts["rate_limited"] += 1
+                return self.median * self.time_scale
+            self.in_flight += 1
+            self.counts["max_in_flight"] = max(self.counts["max_in_flight"], self.in_flight)
+            return None
+
+    @property
+    def _speedup(self):
+        # Limits are scaled with latencies, so a compressed run sees the same contention.
+        return 1 / self.time_scale if self.time_scale else 1
+
+    def release(self, ok):
+        with self._lock:
+            self.in_flight -= 1
+            self.counts["ok" if ok else "errors"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, in_flight=self.in_flight)
+
+
+app = Flask(__name__)
+providers = {}
+# Runway task id -> {"account", "done_at", "failed"}.
+tasks = {}
+tasks_lock = threading.Lock()
+# Runway account email -> {"expires_at", "tasks", "max_in_flight"}; sessions
+# expire after token_ttl seconds (0 = never).
+accounts = {}
+token_ttl = 0
+image_bytes = b""
+
+
+def configure(profile=None, seed=None, time_scale=1.0, error_rate=None, image_size=(1792, 1024), ttl=0):
+    """(Re)creates the providers from DEFAULT_PROFILE updated with `profile`."""
+    global image_bytes, token_ttl
+    token_ttl = ttl
+    rng = random.Random(seed)
+    providers.clear()
+    for name, settings in DEFAULT_PROFILE.items():
+        settings = dict(settings, **(profile or {}).get(name, {}))
+        if error_rate is not None:
+            settings["error_rate"] = error_rate
+        providers[name] = Provider(name, rng, time_scale, **settings)
+    with tasks_lock:
+        tasks.clear()
+        accounts.clear()
+
+    # Incompressible noise, so downloads and uploads are about DALLE HD sized.
+    width, height = image_size
+    image = Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    image_bytes = buffer.getvalue()
+
+
+def error_response(status, message, retry_after=None):
+    response = jsonify({"error": {"message": message, "type": "fake_provider_error"}})
+    response.status_code = status
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def simulate(name, respond):
+    """Answers with `respond()` after the provider's latency, or with a 429 / 500."""
+    provider = providers[name]
+    retry_after = provider.admit()
+    if retry_after is not None:
+        return error_response(429, f"{name}: rate limit exceeded", retry_after)
+    ok = False
+    try:
+        time.sleep(provider.latency())
+        if provider.chance(provider.error_rate):
+            return error_response(500, f"{name}: simulated failure")
+        ok = True
+        return respond()
+    finally:
+        provider.release(ok)
+
+
+def scene_reply(prompt, rng, invalid=False):
+    """A scene in the JSON shape init_story_prompt / story_part_prompt ask for."""
+    def phrase(n):
+        return " ".join(rng.choice(WORDS) for _ in range(n))
+
+    image_count = 2 if "two new image prompts" in prompt else 3
+    if invalid:
+        # Exercises the app's retry on replies that don't validate (which keeps
+        # whatever the invalid reply already streamed into the scene).
+        image_count += 1
+    core_details = "Digital painting of a wandering cartographer with a brass compass,"
+    storyline = f"The traveller reaches the {phrase(3)} and finds a {phrase(2)}."
+    return json.dumps({
+        "storyline": storyline,
+        "new_storyline": storyline,
+        "image_prompts": [f"{core_details} {phrase(6)}" for _ in range(image_count)],
+        "video_generation_prompt": f"Slow pan across the {phrase(3)}.",
+        "narration": f"The {phrase(2)} glows ahead. Something stirs by the {phrase(2)}.",
+        "actions": [f"Follow the {phrase(2)}", f"Climb the {phrase(2)}"],
+        "core_details": core_details,
+    })
+
+
+# ----------------------------
+# OpenAI
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    data = request.get_json()
+    prompt = data["messages"][-1]["content"]
+    provider = providers["chat"]
+    if "running summary" in prompt:
+        content = f"So far the traveller has crossed the {' and the '.join(WORDS[:4])}."
+    else:
+        content = scene_reply(prompt, provider.rng, invalid=provider.chance(provider.invalid_rate))
+    usage = {
+        "prompt_tokens": len(prompt) // 4,
+        "completion_tokens": len(content) // 4,
+        "total_tokens": (len(prompt) + len(content)) // 4,
+    }
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = data.get("model") or "fake"
+
+    if not data.get("stream"):
+        return simulate("chat", lambda: jsonify({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        }))
+
+    retry_after = provider.admit()
+    if retry_after is not None:
+        return error_response(429, "chat: rate limit exceeded", retry_after)
+    if provider.chance(provider.error_rate):
+        provider.release(False)
+        return error_response(500, "chat: simulated failure")
+
+    def chunk(delta, finish_reason=None, **extra):
+        choices = [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else []
+        body = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": choices,
+            **extra,
+        }
+        return f"data: {json.dumps(body)}\n\n"
+
+    def stream():
+        ok = False
+        try:
+            # The first token after ~15% of the reply time, the rest spread evenly.
+            duration = provider.latency()
+            pieces = [content[i:i + 24] for i in range(0, len(content), 24)]
+            time.sleep(duration * 0.15)
+            yield chunk({"role": "assistant", "content": ""})
+            for piece in pieces:
+                yield chunk({"content": piece})
+                time.sleep(duration * 0.85 / len(pieces))
+            yield chunk({}, "stop")
+            if (data.get("stream_options") or {}).get("include_usage"):
+                yield chunk(None, usage=usage)
+            yield "data: [DONE]\n\n"
+            ok = True
+        finally:
+            provider.release(ok)
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream")
+
+
+@app.route('/v1/images/generations', methods=['POST'])
+def images_generations():
+    data = request.get_json()
+    return simulate("images", lambda: jsonify({
+        "created": int(time.time()),
+        "data": [{
+            "url": f"{request.host_url}files/images/{uuid.uuid4().hex}.png",
+            "revised_prompt": data.get("prompt", ""),
+        } for _ in range(data.get("n", 1))],
+    }))
+
+
+@app.route('/files/images/<name>.png', methods=['GET'])
+def image_file(name):
+    return simulate("files", lambda: Response(image_bytes, mimetype="image/png"))
+
+
+# ----------------------------
+# ElevenLabs
+@app.route('/v1/text-to-speech/<voice_id>', methods=['POST'])
+def text_to_speech(voice_id):
+    text = (request.get_json() or {}).get("text", "")
+    # About 128 kbit/s at 2.5 words a second.
+    size = int(len(text.split()) / 2.5 * 16000) + 1024
+    return simulate("tts", lambda: Response(b"ID3" + bytes(size), mimetype="audio/mpeg"))
+
+
+@app.route('/v1/text-to-speech/<voice_id>/stream', methods=['POST'])
+def text_to_speech_stream(voice_id):
+    text = (request.get_json() or {}).get("text", "")
+    size = int(len(text.split()) / 2.5 * 16000) + 1024
+    provider = providers["tts"]
+    retry_after = provider.admit()
+    if retry_after is not None:
+        return error_response(429, "tts: rate limit exceeded", retry_after)
+    if provider.chance(provider.error_rate):
+        provider.release(False)
+        return error_response(500, "tts: simulated failure")
+
+    def stream():
+        ok = False
+        try:
+            # Audio is produced faster than real time: the first chunk after
+            # ~20% of the clip's synthesis time, the rest spread evenly.
+            duration = provider.latency()
+            chunks = [b"ID3" + bytes(min(4096, size))] + [bytes(4096)] * (size // 4096)
+            time.sleep(duration * 0.2)
+            for chunk in chunks:
+                yield chunk
+                time.sleep(duration * 0.8 / len(chunks))
+            ok = True
+        finally:
+            provider.release(ok)
+
+    return Response(stream_with_context(stream()), mimetype="audio/mpeg")
+
+
+# ----------------------------
+# useapi.net Runway
+def _jwt(expires_at):
+    """A JWT-shaped token carrying just an `exp` claim."""
+    def part(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+    claims = {"exp": int(expires_at)} if expires_at else {}
+    return f"{part({'alg': 'none'})}.{part(claims)}.fake"
+
+
+def _session_error(email):
+    """A 401 like useapi.net's for an account that was never added or whose session expired, else None."""
+    with tasks_lock:
+        account = accounts.get(email)
+    if account is None or (account["expires_at"] and time.time() >= account["expires_at"]):
+        return error_response(401, f"runway: no valid session for {email}")
+    return None
+
+
+def _account_of(asset_or_task_id):
+    # useapi.net ids embed the account: user:<n>-runwayml:<email>:asset:<uuid>
+    parts = asset_or_task_id.split(":")
+    return parts[2] if len(parts) >= 5 else None
+
+
+@app.route('/v1/runwayml/accounts/<email>', methods=['POST'])
+def runway_account(email):
+    def add():
+        expires_at = time.time() + token_ttl if token_ttl else 0
+        with tasks_lock:
+            account = accounts.setdefault(email, {"tasks": 0, "max_in_flight": 0})
+            account["expires_at"] = expires_at
+        return jsonify({"jwt": {"token": _jwt(expires_at)}})
+
+    return simulate("runway", add)
+
+
+@app.route('/v1/runwayml/assets/', methods=['POST'])
+def runway_asset():
+    request.get_data()
+    email = request.args.get("email")
+
+    def upload():
+        if email is None:
+            return jsonify({"assetId": f"asset-{uuid.uuid4().hex}"})
+        return _session_error(email) or jsonify({"assetId": f"user:1-runwayml:{email}:asset:{uuid.uuid4().hex}"})
+
+    return simulate("runway", upload)
+
+
+@app.route('/v1/runwayml/gen3turbo/create', methods=['POST'])
+def runway_create():
+    task_provider = providers["runway_task"]
+    payload = request.get_json(silent=True) or {}
+    asset_ids = [payload.get(key) for key in ("firstImage_assetId", "middleImage_assetId", "lastImage_assetId")]
+    emails = {_account_of(asset_id) for asset_id in asset_ids if asset_id}
+
+    def create():
+        if len(emails) > 1:
+            return error_response(400, "runway: assets belong to different accounts")
+        email = emails.pop() if emails else None
+        if email is not None:
+            error = _session_error(email)
+            if error is not None:
+                return error
+        now = time.monotonic()
+        with tasks_lock:
+            # maxJobs applies per account, as on useapi.net.
+            active = [task for task in tasks.values() if task["done_at"] > now]
+            running = sum(1 for task in active if task["account"] == email)
+            if task_provider.concurrency and running >= task_provider.concurrency:
+                task_provider.counts["rate_limited"] += 1
+                return error_response(429, "runway: maxJobs reached", task_provider.median * task_provider.time_scale)
+            task_id = f"user:1-runwayml:{email}:task:{uuid.uuid4().hex}" if email else f"task-{uuid.uuid4().hex}"
+            tasks[task_id] = {
+                "account": email,
+                "done_at": now + task_provider.latency(),
+                "failed": task_provider.chance(task_provider.error_rate),
+            }
+            task_provider.counts["requests"] += 1
+            task_provider.counts["max_in_flight"] = max(task_provider.counts["max_in_flight"], len(active) + 1)
+            if email in accounts:
+                accounts[email]["tasks"] += 1
+                accounts[email]["max_in_flight"] = max(accounts[email]["max_in_flight"], running + 1)
+        return jsonify({"taskId": task_id})
+
+    return simulate("runway", create)
+
+
+@app.route('/v1/runwayml/tasks/<task_id>', methods=['GET'])
+def runway_task(task_id):
+    with tasks_lock:
+        task = tasks.get(task_id)
+    if task is None:
+        abort(404)
+
+    def status():
+        if time.monotonic() < task["done_at"]:
+            return jsonify({"taskId": task_id, "status": "RUNNING"})
+        if not task.get("counted"):
+            task["counted"] = True
+            providers["runway_task"].counts["errors" if task["failed"] else "ok"] += 1
+        if task["failed"]:
+            return jsonify({"taskId": task_id, "status": "FAILED", "error": "simulated failure"})
+        return jsonify({
+            "taskId": task_id,
+            "status": "SUCCEEDED",
+            "artifacts": [{"url": f"{request.host_url}files/videos/{task_id}.mp4"}],
+        })
+
+    return simulate("runway", status)
+
+
+@app.route('/files/videos/<name>.mp4', methods=['GET'])
+def video_file(name):
+    return Response(bytes(64 * 1024), mimetype="video/mp4")
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Per-provider request counts, for load_test.py's report."""
+    result = {name: provider.stats() for name, provider in providers.items()}
+    with tasks_lock:
+        result["runway_accounts"] = {
+            email: {"tasks": account["tasks"], "max_in_flight": account["max_in_flight"]}
+            for email, account in accounts.items()
+        }
+    return jsonify(result)
+
+
+configure()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI / ElevenLabs / useapi.net providers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="Multiplies every latency and divides every rate limit.")
+    parser.add_argument("--error-rate", type=float, default=None,
+                        help="Failure rate for every provider, overriding the profile.")
+    parser.add_argument("--profile", help="JSON file of per-provider settings to override.")
+    parser.add_argument("--token-ttl", type=float, default=0,
+                        help="Seconds until a Runway account session expires (0 = never).")
+    args = parser.parse_args()
+
+    profile = None
+    if args.profile:
+        with open(args.profile, encoding="utf-8") as f:
+            profile = json.load(f)
+    configure(profile, seed=args.seed, time_scale=args.time_scale, error_rate=args.error_rate, ttl=args.token_ttl)
+    print(f"Fake providers on http://{args.host}:{args.port} (time scale {args.time_scale})")
+    app.run(host=args.host, port=args.port, threaded=True)
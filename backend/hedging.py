@@ -0,0 +1,219 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+import openai
+
+from metrics import registry, upstream_retries
+
+upstream_hedges = registry.counter(
+    "upstream_hedges_total", "Duplicate requests sent for slow upstream calls, by which copy won.", ("call", "outcome")
+)
+
+
+def transient_error(error):
+    """Whether a failed upstream call is worth repeating: rate limits, 5xx, timeouts and dropped connections."""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (openai.APIConnectionError, ConnectionError, TimeoutError))
+
+
+class LatencyTracker:
+    """The latencies of the last `window` successful calls of one kind."""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._recent.append(seconds)
+
+    @contextmanager
+    def timed(self):
+        """Observes how long the block takes, if it doesn't raise."""
+        start = time.monotonic()
+        yield
+        self.observe(time.monotonic() - start)
+
+    def percentile(self, q):
+        """The q-th percentile of recent latencies, or None until there are enough of them."""
+        with self._lock:
+            if len(self._recent) < self.min_samples:
+                return None
+            ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+class HedgedCalls:
+    """
+    Runs calls of one kind (e.g. DALLE generations) so that one slow or failed
+    request doesn't set the pace:
+
+    - a call still running past the `percentile` latency of recent calls gets
+      one duplicate, and whichever copy succeeds first is used;
+    - a call whose copies all fail is retried, up to `retries` times, if
+      `retry_on(error)` says the error is transient; any other error (e.g. a
+      rejected prompt) is raised at once.
+
+    `can_hedge()` is checked before sending a duplicate, so duplicates only go
+    out when the provider has capacity to spare. `percentile=0` disables
+    hedging. Sync calls run on `executor`; call_async() runs coroutines.
+
+    Calls time themselves with `with calls.timed():` around the upstream
+    request, after taking any local slot they queue for, so the hedge delay
+    tracks the provider's latency rather than time spent waiting here.
+    """
+
+    def __init__(self, name, executor=None, percentile=90, retries=2, backoff=0.5,
+                 window=200, min_samples=20, can_hedge=None, retry_on=transient_error):
+        self.name = name
+        self.executor = executor
+        self.percentile = percentile
+        self.retries = retries
+        self.backoff = backoff
+        self.can_hedge = can_hedge or (lambda: True)
+        self.retry_on = retry_on
+        self.latencies = LatencyTracker(window, min_samples)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.retried = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def timed(self):
+        """Context manager recording one call's upstream latency."""
+        return self.latencies.timed()
+
+    def hedge_delay(self):
+        if not self.percentile:
+            return None
+        return self.latencies.percentile(self.percentile)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _should_hedge(self, delay):
+        if delay is None or not self.can_hedge():
+            return False
+        self._count("hedged")
+        return True
+
+    def _settled(self, index, hedged):
+        """Records which copy of a hedged call won."""
+        if not hedged:
+            return
+        if index > 0:
+            self._count("hedge_wins")
+        upstream_hedges.inc(call=self.name, outcome="hedge" if index > 0 else "original")
+
+    def _retry(self, attempt, error):
+        if attempt >= self.retries or not self.retry_on(error):
+            self._count("failed")
+            return None
+        self._count("retried")
+        upstream_retries.inc(call=self.name, reason="error")
+        print(f"{self.name} call failed, retrying ({attempt + 1}/{self.retries}): {error}")
+        return self.backoff * 2 ** attempt
+
+    # ----------------------------
+    # Threads
+    def _submit(self, fn, args):
+        # Copies of the call see the caller's context variables (e.g. the scene's trace).
+        return self.executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def call(self, fn, *args):
+        """Returns fn(*args), hedged and retried; raises the last error if every attempt fails."""
+        self._count("calls")
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(fn, args)
+            except Exception as e:
+                delay = self._retry(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def _attempt(self, fn, args):
+        futures = [self._submit(fn, args)]
+        delay = self.hedge_delay()
+        done, _ = wait(futures, timeout=delay)
+        if not done and self._should_hedge(delay):
+            futures.append(self._submit(fn, args))
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The other copy can't be interrupted; its result is dropped.
+                    self._settled(futures.index(future), len(futures) > 1)
+                    return future.result()
+                error = future.exception()
+                if not self.retry_on(error):
+                    # The other copy would fail the same way.
+                    raise error
+        raise error
+
+    # ----------------------------
+    # asyncio
+    async def call_async(self, fn, *args):
+        """Async counterpart of call() for a coroutine function `fn`."""
+        self._count("calls")
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt_async(fn, args)
+            except Exception as e:
+                delay = self._retry(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _attempt_async(self, fn, args):
+        tasks = [asyncio.ensure_future(fn(*args))]
+        try:
+            delay = self.hedge_delay()
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._should_hedge(delay):
+                tasks.append(asyncio.ensure_future(fn(*args)))
+
+            error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._settled(tasks.index(task), len(tasks) > 1)
+                        return task.result()
+                    error = task.exception()
+                    if not self.retry_on(error):
+                        raise error
+            raise error
+        finally:
+            # The losing copy is abandoned.
+            for task in tasks:
+                task.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "retried": self.retried,
+                "failed": self.failed,
+                "hedge_delay": self.hedge_delay(),
+            }
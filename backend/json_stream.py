@@ -0,0 +1,72 @@
+import json
+
+
+class SceneStreamParser:
+    """
+    Incrementally scans a streamed JSON scene object and reports each complete
+    `image_prompts` entry and the `narration` string as soon as its closing
+    quote arrives, long before the rest of the reply has been generated.
+
+    It only tracks enough structure to know where it is in the top-level
+    object; the full reply is still parsed and validated with json.loads once
+    the stream ends.
+    """
+
+    def __init__(self, on_image_prompt=None, on_narration=None):
+        self.on_image_prompt = on_image_prompt
+        self.on_narration = on_narration
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string = []
+        self._key = None
+        self._expect_key = False
+        self._array_index = 0
+
+    def feed(self, text):
+        for ch in text:
+            if self._in_string:
+                self._string.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._string_done("".join(self._string))
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string = [ch]
+            elif ch in "{[":
+                self._stack.append(ch)
+                if len(self._stack) == 1:
+                    self._expect_key = True
+                elif len(self._stack) == 2:
+                    self._array_index = 0
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+            elif ch == ":" and len(self._stack) == 1:
+                self._expect_key = False
+            elif ch == ",":
+                if len(self._stack) == 1:
+                    self._expect_key = True
+                elif len(self._stack) == 2 and self._stack[-1] == "[":
+                    self._array_index += 1
+
+    def _string_done(self, raw):
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+
+        depth = len(self._stack)
+        if depth == 1:
+            if self._expect_key:
+                self._key = value
+            elif self._key == "narration" and self.on_narration:
+                self.on_narration(value)
+        elif depth == 2 and self._stack[-1] == "[" and self._key == "image_prompts" and self.on_image_prompt:
+            self.on_image_prompt(self._array_index, value)
@@ -0,0 +1,224 @@
+"""
+Drives the API with N concurrent simulated users and reports scene latency
+percentiles, throughput and server memory. Meant to be run against an app
+whose providers point at fake_providers.py, so scheduler and caching changes
+can be compared run against run:
+
+    python load_test.py --url http://localhost:5000 --users 20 --scenes 3 \
+        --fake-url http://localhost:8100 --out report.json
+
+Each user starts a story with /initialize, waits for it with the
+/story_status long-poll, then plays `--scenes` more scenes with /next_scene.
+A scene's latency is from the request that started it until /story_status
+reports it completed; 429s are retried after Retry-After and counted.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile of `values` (q in 0..100)."""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+class LoadTest:
+    def __init__(self, base_url, users, scenes, ramp=0.0, think=0.0, same_theme=False,
+                 scene_timeout=600, seed=None):
+        self.base_url = base_url.rstrip("/")
+        self.users = users
+        self.scenes = scenes
+        self.ramp = ramp
+        self.think = think
+        self.same_theme = same_theme
+        self.scene_timeout = scene_timeout
+        self.rng = random.Random(seed)
+        self.results = []
+        self.rejected = 0
+        self.memory = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def post(self, session, path, body):
+        """POSTs, retrying 429s after their Retry-After."""
+        while True:
+            response = session.post(f"{self.base_url}{path}", json=body, timeout=30)
+            if response.status_code != 429:
+                response.raise_for_status()
+                return response.json()
+            with self._lock:
+                self.rejected += 1
+            time.sleep(float(response.headers.get("Retry-After", 1)))
+
+    def wait_for_scene(self, session, story_id):
+        deadline = time.monotonic() + self.scene_timeout
+        while time.monotonic() < deadline:
+            response = session.get(f"{self.base_url}/story_status/{story_id}", params={"wait": 30, "debug": 1}, timeout=60)
+            response.raise_for_status()
+            data = response.json()
+            if data["status"] in ("completed", "error"):
+                return data
+        return {"status": "timeout"}
+
+    def record(self, user, kind, started, data):
+        entry = {
+            "user": user,
+            "kind": kind,
+            "status": data["status"],
+            "latency": time.monotonic() - started,
+            "timings": {name: t["duration"] for name, t in data.get("timings", {}).items()},
+        }
+        with self._lock:
+            self.results.append(entry)
+        return entry
+
+    def user(self, index):
+        time.sleep(self.ramp * index / max(self.users, 1))
+        session = requests.Session()
+        theme = "A lighthouse keeper's last night on the island" if self.same_theme else \
+            f"A lighthouse keeper's last night on island number {index}"
+        try:
+            started = time.monotonic()
+            story_id = self.post(session, "/initialize", {"user_theme": theme})["story_id"]
+            data = self.wait_for_scene(session, story_id)
+            self.record(index, "initialize", started, data)
+
+            for _ in range(self.scenes):
+                actions = data.get("result", {}).get("actions") or []
+                if data["status"] != "completed" or not actions:
+                    return
+                time.sleep(self.think)
+                started = time.monotonic()
+                self.post(session, "/next_scene", {"story_id": story_id, "user_action": self.rng.choice(actions)})
+                data = self.wait_for_scene(session, story_id)
+                self.record(index, "next_scene", started, data)
+        except Exception as e:
+            print(f"[user {index}] {e}")
+            self.record(index, "error", time.monotonic(), {"status": "error"})
+
+    def sample_memory(self, interval=1.0):
+        """Reads the server's RSS from /metrics until the run ends."""
+        while not self._stop.is_set():
+            try:
+                text = requests.get(f"{self.base_url}/metrics", timeout=5).text
+                match = re.search(r"^process_resident_memory_bytes (\S+)$", text, re.MULTILINE)
+                if match:
+                    self.memory.append(float(match.group(1)))
+            except Exception as e:
+                print(f"Could not read /metrics: {e}")
+            self._stop.wait(interval)
+
+    def run(self):
+        sampler = threading.Thread(target=self.sample_memory, daemon=True)
+        sampler.start()
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.users) as executor:
+            list(executor.map(self.user, range(self.users)))
+        elapsed = time.monotonic() - started
+        self._stop.set()
+        sampler.join()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        completed = [r for r in self.results if r["status"] == "completed"]
+        stages = {}
+        for r in completed:
+            for name, duration in r["timings"].items():
+                if name.startswith(("image_prompt_", "narration_text")):
+                    continue  # Signals, not stages.
+                stages.setdefault(name, []).append(duration)
+        return {
+            "users": self.users,
+            "scenes_per_user": self.scenes + 1,
+            "elapsed": elapsed,
+            "scenes_completed": len(completed),
+            "scenes_failed": len(self.results) - len(completed),
+            "requests_rejected": self.rejected,
+            "throughput_per_minute": len(completed) / elapsed * 60 if elapsed else 0,
+            "latency": {
+                "all": summarize([r["latency"] for r in completed]),
+                "initialize": summarize([r["latency"] for r in completed if r["kind"] == "initialize"]),
+                "next_scene": summarize([r["latency"] for r in completed if r["kind"] == "next_scene"]),
+            },
+            "stages": {name: summarize(values) for name, values in sorted(stages.items())},
+            "memory_bytes": {
+                "start": self.memory[0] if self.memory else None,
+                "peak": max(self.memory) if self.memory else None,
+                "end": self.memory[-1] if self.memory else None,
+            },
+        }
+
+
+def print_report(report):
+    def seconds(value):
+        return "-" if value is None else f"{value:.2f}s"
+
+    print(f"\n{report['users']} users x {report['scenes_per_user']} scenes in {report['elapsed']:.1f}s")
+    print(f"Completed {report['scenes_completed']}, failed {report['scenes_failed']}, "
+          f"429s {report['requests_rejected']}, {report['throughput_per_minute']:.1f} scenes/min")
+    for name, stats in list(report["latency"].items()) + list(report["stages"].items()):
+        print(f"  {name:<16} n={stats['count']:<5} p50={seconds(stats['p50'])} "
+              f"p95={seconds(stats['p95'])} p99={seconds(stats['p99'])} max={seconds(stats['max'])}")
+    memory = report["memory_bytes"]
+    if memory["peak"] is not None:
+        print(f"  server RSS: start {memory['start'] / 2**20:.0f} MiB, peak {memory['peak'] / 2**20:.0f} MiB, "
+              f"end {memory['end'] / 2**20:.0f} MiB")
+    for name, stats in report.get("providers", {}).items():
+        print(f"  {name:<16} {stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the story API.")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--scenes", type=int, default=2, help="/next_scene calls per user after /initialize.")
+    parser.add_argument("--ramp", type=float, default=0.0, help="Seconds over which the users start.")
+    parser.add_argument("--think", type=float, default=0.0, help="Seconds each user waits between scenes.")
+    parser.add_argument("--same-theme", action="store_true", help="Every user starts the same theme.")
+    parser.add_argument("--scene-timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--fake-url", help="fake_providers.py URL, to include its request counts.")
+    parser.add_argument("--out", help="Write the report as JSON to this file.")
+    args = parser.parse_args()
+
+    if args.fake_url:
+        before = requests.get(f"{args.fake_url.rstrip('/')}/stats").json()
+    test = LoadTest(args.url, args.users, args.scenes, ramp=args.ramp, think=args.think,
+                    same_theme=args.same_theme, scene_timeout=args.scene_timeout, seed=args.seed)
+    report = test.run()
+    if args.fake_url:
+        after = requests.get(f"{args.fake_url.rstrip('/')}/stats").json()
+        # Only what this run sent.
+        report["providers"] = {
+            name: {key: value - before[name].get(key, 0) if key in ("requests", "ok", "errors", "rate_limited")
+                   else value for key, value in stats.items()}
+            for name, stats in after.items()
+        }
+
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved report to {args.out}")
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+from cache import make_key
+from metrics import span
+
+# Runway renders 1280:768 landscape video; larger frames are only scaled down again on its side.
+FRAME_SIZE = (1280, 768)
+
+# Frame format -> cache file extension.
+FORMATS = {"jpeg": ".jpg", "webp": ".webp"}
+
+
+def prepare_frame(src_path, dst_path, size, fmt, quality):
+    """
+    Scales and center-crops the image at `src_path` to exactly `size` and
+    writes it to `dst_path` as `fmt`. Runs in a worker process.
+    """
+    with Image.open(src_path) as image:
+        frame = ImageOps.fit(image.convert("RGB"), size, Image.LANCZOS)
+    # Huffman optimization would take ~10x longer for ~10% fewer bytes.
+    frame.save(dst_path, format="JPEG" if fmt == "jpeg" else "WEBP", quality=quality)
+    return os.path.getsize(dst_path)
+
+
+def file_digest(path):
+    """sha256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _mp_context():
+    """
+    Workers are forked while this process has no other threads yet: a fork
+    of a threaded process can inherit locks held by threads that don't exist
+    in the child. Past that point (or where fork isn't the default, e.g.
+    macOS) they start from a fresh interpreter, which re-imports the server's
+    main module in each worker.
+    """
+    method = multiprocessing.get_start_method()
+    if method == "fork" and threading.active_count() > 1:
+        method = "forkserver"
+    return multiprocessing.get_context(method)
+
+
+def _server_alive(server_pid):
+    if os.getppid() == server_pid:
+        return True
+    if os.name != "posix":
+        return False
+    # Under forkserver the parent is the fork server, which stays up as long
+    # as its workers do; ask about the server itself.
+    try:
+        os.kill(server_pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _exit_with_parent(server_pid):
+    """
+    Worker initializer. Workers inherit both ends of the pool's queues, so
+    they never see the server go away if it is killed without shutting the
+    pool down; this makes them exit on their own.
+    """
+    def watch():
+        while _server_alive(server_pid):
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class MediaPrep:
+    """
+    Turns cached DALLE PNGs into the frames uploaded to Runway: resized to
+    FRAME_SIZE and re-encoded as JPEG or WebP. Decoding and resizing hold the
+    GIL for around a hundred milliseconds per image, so this runs in a process
+    pool rather than in request threads or on the event loop. Prepared frames
+    are kept in `cache` (a DiskCache with the format's extension), keyed by
+    the source image's contents.
+
+    Create it while the server is starting up, before it starts any threads,
+    so the pool can fork its workers (see _mp_context).
+    """
+
+    def __init__(self, cache, fmt="jpeg", quality=85, size=FRAME_SIZE, workers=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported frame format {fmt!r}, expected one of {sorted(FORMATS)}")
+        self.cache = cache
+        self.fmt = fmt
+        self.quality = quality
+        self.size = tuple(size)
+        self.prepared = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+        self._workers = workers or os.cpu_count() or 1
+        self._executor = None
+        # A worker started from a fresh interpreter imports the server's main
+        # module, and with it this class; only the server itself gets a pool.
+        if multiprocessing.current_process().name == "MainProcess":
+            # Start the workers now, while the server is still starting up,
+            # rather than from a busy request thread later.
+            self._pool().submit(os.getpid).result()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers, mp_context=_mp_context(),
+                    initializer=_exit_with_parent, initargs=(os.getpid(),),
+                )
+            return self._executor
+
+    def key(self, src_path):
+        # By contents: different images can share a file name (or a path, over time).
+        return make_key(file_digest(src_path), self.size, self.fmt, self.quality)
+
+    def _submit(self, src_path, key):
+        tmp_path = self.cache.temp_path(key)
+        return tmp_path, self._pool().submit(prepare_frame, src_path, tmp_path, self.size, self.fmt, self.quality)
+
+    def _store(self, src_path, key, tmp_path, future):
+        try:
+            size = future.result()
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            # The original image still works, it's just bigger.
+            print(f"Could not prepare frame from {src_path}, using the original: {e}")
+            return src_path
+        with self._lock:
+            self.prepared += 1
+            self.bytes_in += os.path.getsize(src_path)
+            self.bytes_out += size
+        return self.cache.put_file(key, tmp_path)
+
+    def prepare(self, src_path):
+        """Returns the path of the prepared frame for the local image `src_path`."""
+        key = self.key(src_path)
+        path = self.cache.lookup(key)
+        if path:
+            return path
+        with span("media_prep"):
+            tmp_path, future = self._submit(src_path, key)
+            future.exception()
+        return self._store(src_path, key, tmp_path, future)
+
+    async def prepare_async(self, src_path):
+        key = await asyncio.to_thread(self.key, src_path)
+        path = self.cache.lookup(key)
+        if path:
+            return path
+        with span("media_prep"):
+            tmp_path, future = self._submit(src_path, key)
+            await asyncio.wait([asyncio.wrap_future(future)])
+        return self._store(src_path, key, tmp_path, future)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "format": self.fmt,
+                "size": "x".join(map(str, self.size)),
+                "prepared": self.prepared,
+                "failed": self.failed,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "frames": self.cache.stats(),
+            }
@@ -0,0 +1,232 @@
+import bisect
+import contextvars
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; upstream calls range from cached hits to multi-minute Runway tasks.
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _label_text(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value set directly, or read from `fn()` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        if self.fn is not None:
+            values = self.fn()
+            with self._lock:
+                # fn returns either a number or {label values tuple: number}.
+                self._values = values if isinstance(values, dict) else {(): values}
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, (list(c), t, n)) for key, (c, t, n) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _label_text(self.labelnames + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labelnames + ("le",), key + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Metrics rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), fn=None):
+        return self.add(Gauge(name, help, labelnames, fn))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+upstream_seconds = registry.histogram(
+    "upstream_request_seconds", "Latency of each call to an upstream provider.", ("call", "outcome")
+)
+upstream_retries = registry.counter(
+    "upstream_retries_total", "Upstream calls that were retried.", ("call", "reason")
+)
+upstream_bytes = registry.counter(
+    "upstream_bytes_total", "Bytes downloaded from or uploaded to upstream providers.", ("call",)
+)
+upstream_first_byte = registry.histogram(
+    "upstream_first_byte_seconds", "Time to the first chunk of a streamed upstream response.", ("call",)
+)
+
+
+def counted(chunks, call):
+    """Passes byte chunks through, adding their size to upstream_bytes_total."""
+    for chunk in chunks:
+        upstream_bytes.inc(len(chunk), call=call)
+        yield chunk
+
+
+async def counted_async(chunks, call):
+    async for chunk in chunks:
+        upstream_bytes.inc(len(chunk), call=call)
+        yield chunk
+
+
+def resident_memory_bytes():
+    """Current RSS of this process; the peak where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is the peak, in kilobytes.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+registry.gauge("process_resident_memory_bytes", "Resident memory of the server process.",
+               fn=resident_memory_bytes)
+
+
+# ----------------------------
+# Tracing: spans recorded while a trace is active in the current context are
+# collected for that scene. The context follows asyncio tasks and StageGraph
+# stages, so spans land in the right story.
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end, **attrs):
+        span = {
+            "name": name,
+            "start": round(start - self.started, 3),
+            "duration": round(end - start, 3),
+        }
+        span.update(attrs)
+        with self._lock:
+            self.spans.append(span)
+
+
+@contextmanager
+def tracing():
+    """Collects the spans recorded in this context (and the stages it starts)."""
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(call, **attrs):
+    """
+    Times one upstream call: observes upstream_request_seconds and, inside a
+    trace, records a span. Extra attributes can be added to the yielded dict.
+    """
+    start = time.monotonic()
+    attrs = dict(attrs)
+    outcome = "ok"
+    try:
+        yield attrs
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        end = time.monotonic()
+        upstream_seconds.observe(end - start, call=call, outcome=outcome)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(call, start, end, outcome=outcome, **attrs)
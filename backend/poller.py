@@ -0,0 +1,176 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, InvalidStateError
+
+
+class PollTimeout(Exception):
+    pass
+
+
+class PollCancelled(Exception):
+    pass
+
+
+class TaskFailed(Exception):
+    """Raised by a check when the task itself failed, as opposed to the check request."""
+
+
+def next_delay(elapsed, expected, min_interval, max_interval):
+    """
+    Seconds until the next poll of a task that has been running for `elapsed`
+    seconds and usually takes about `expected`. Polls are sparse early on,
+    densest around the expected completion time, and back off again once the
+    task is overdue.
+    """
+    remaining = expected - elapsed
+    if remaining > 0:
+        delay = remaining / 2
+    else:
+        delay = min_interval + (-remaining) / 4
+    return min(max(delay, min_interval), max_interval)
+
+
+class PollHandle:
+    def __init__(self, task_id, check, expected, deadline, min_interval, max_interval, cancel_event, max_errors):
+        self.task_id = task_id
+        self.check = check
+        self.expected = expected
+        self.deadline = deadline
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.cancel_event = cancel_event or threading.Event()
+        self.max_errors = max_errors
+        self.started = time.monotonic()
+        self.polls = 0
+        # Checks in a row that raised something other than TaskFailed.
+        self.errors = 0
+        self.future = Future()
+
+    def cancel(self):
+        self.cancel_event.set()
+        self._finish(error=PollCancelled(f"Stopped polling task {self.task_id}"))
+
+    def _finish(self, result=None, error=None):
+        try:
+            if error is not None:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(result)
+        except InvalidStateError:
+            # Already cancelled.
+            pass
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class TaskPoller:
+    """
+    Polls many long-running upstream tasks from a single scheduling thread.
+
+    watch() registers a task with a `check(task_id)` function that returns
+    None while the task is still running, returns the task's result once it
+    is done, or raises TaskFailed if it failed. Any other exception is taken
+    as a failed check (a dropped connection, a 5xx) and the task is polled
+    again, unless `max_errors` checks in a row have failed. The checks
+    themselves run on a small shared pool so one slow request doesn't hold up
+    every other task.
+
+    A task whose `cancel_event` is set is let go within `cancel_interval`
+    seconds, even if its next poll is much further off.
+    """
+
+    def __init__(self, workers=4, jitter=0.2, name="poller", cancel_interval=1.0):
+        self.jitter = jitter
+        self.cancel_interval = cancel_interval
+        self._heap = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-check")
+        self._name = name
+        self._started = False
+
+    def watch(self, task_id, check, expected=60, deadline=600, min_interval=1.0, max_interval=15.0, cancel_event=None,
+              max_errors=3):
+        handle = PollHandle(task_id, check, expected, deadline, min_interval, max_interval, cancel_event, max_errors)
+        self._schedule(handle)
+        return handle
+
+    def _schedule(self, handle):
+        elapsed = time.monotonic() - handle.started
+        delay = next_delay(elapsed, handle.expected, handle.min_interval, handle.max_interval)
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        # Never sleep past the deadline; the last poll lands right on it.
+        delay = max(0.0, min(delay, handle.deadline - elapsed))
+        with self._cond:
+            # Started by the first watch() rather than at import, so the server
+            # is still single-threaded while it sets up (see media_prep.py).
+            if not self._started:
+                threading.Thread(target=self._loop, name=self._name, daemon=True).start()
+                self._started = True
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._order), handle))
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = None
+                    if self._heap:
+                        timeout = min(self._heap[0][0] - time.monotonic(), self.cancel_interval)
+                    self._cond.wait(timeout)
+                    self._drop_cancelled()
+                _, _, handle = heapq.heappop(self._heap)
+            self._executor.submit(self._poll, handle)
+
+    def _drop_cancelled(self):
+        """Finishes and unschedules waiting tasks that were cancelled. Called with the lock held."""
+        if not any(handle.cancel_event.is_set() or handle.future.done() for _, _, handle in self._heap):
+            return
+        waiting = []
+        for entry in self._heap:
+            handle = entry[2]
+            if handle.cancel_event.is_set():
+                handle.cancel()
+            elif not handle.future.done():
+                waiting.append(entry)
+        heapq.heapify(waiting)
+        self._heap = waiting
+
+    def _poll(self, handle):
+        if handle.future.done():
+            return
+        if handle.cancel_event.is_set():
+            handle.cancel()
+            return
+
+        handle.polls += 1
+        try:
+            result = handle.check(handle.task_id)
+            handle.errors = 0
+        except TaskFailed as e:
+            handle._finish(error=e)
+            return
+        except Exception as e:
+            handle.errors += 1
+            if handle.errors >= handle.max_errors:
+                handle._finish(error=e)
+                return
+            print(f"Polling task {handle.task_id} failed ({handle.errors}/{handle.max_errors}): {e}")
+            result = None
+
+        if result is not None:
+            handle._finish(result)
+        elif time.monotonic() - handle.started >= handle.deadline:
+            handle._finish(error=PollTimeout(
+                f"Task {handle.task_id} not done after {handle.deadline}s ({handle.polls} polls)"
+            ))
+        else:
+            self._schedule(handle)
+
+    def stats(self):
+        with self._cond:
+            return {"watching": len(self._heap)}
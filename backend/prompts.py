@@ -0,0 +1,122 @@
+import json
+
+
+class InvalidSceneReply(Exception):
+    pass
+
+
+def init_story_prompt(user_theme):
+    return f"""
+    You are an AI Narration and Storyteller assistant. Create a narrative using the user provided theme, with either a cartoon or realistic style. To help yourself create this narrative, give an overview of it in 2-3 sentences. Now this narrative must end with the story being able to go in several directions, and explicitly state the next possible actions the users can take, like an interactive story.
+
+    Additionally, create three image descriptions to showcase the scene over 10 seconds. When crafting these image descriptions, follow these important guidelines to ensure consistency across all images:
+    1. **Consistent Core Details:** Use the exact same core character description and style attributes for every image prompt. Only modify the scenario portion to depict different dynamic actions or emotions.
+    2. **Active, Full-Body Poses:** Use dynamic, active verbs in each scenario so that the character is depicted in full-body action poses rather than static or close-up shots.
+    3. **Uniform Background and Style:** Keep the background and overall visual style (digital painting, gradient shading, clean linework, vibrant palette, stylized proportions) consistent throughout the three prompts.
+    4. **Exact Template Usage:** Always use a consistent template for the core character and style. For example, you might use the following template:
+       "Digital painting of a distinctly feminine green-eyed, white-furred tabaxi monk (with fluffy cheeks and a tuft on her head) with gradient shading, clean linework, vibrant palette, and stylized proportions. Wearing a simple green monk tunic and carrying a pack, [scenario]"
+       **Important:** This tabaxi monk example is provided solely as an example. You may choose a different character description if it better fits your narrative, but whichever core character you choose must remain exactly the same across all three image prompts.
+       Replace "[scenario]" with a brief description that always includes:
+         - a specific setting,
+         - a dynamic action (using strong, active verbs), and
+         - an emotion that the character is expressing.
+
+    Additionally, include a new key "core_details" in your JSON output. This key should contain the exact string used to define the core character and style (i.e. the part before the [scenario]). This value will be used by later scenes to ensure consistency.
+
+    You will output only valid JSON—no extra keys, no Markdown formatting, and no disclaimers.
+    Your JSON must have the following keys in the top-level object:
+    1. storyline: String. This contains a text description of the storyline so far.
+    2. image_prompts: List of 3 Strings. Each is a prompt to DALLE, which will generate an image for part of the scene.
+    3. video_generation_prompt: String. This prompt is to a video generation model which will be fed the 3 images, and this text to create the video. (no need to mention here that the video should be 10 seconds). Keep it concise.
+    4. narration: A textual narration which will be used as closed captioning and be read aloud along the video. 2 short sentences max (to fit in 10 sec video).
+    5. actions: List of 2 Strings, which are two possible actions for the user to take.
+    6. core_details: String. The core character and style template to be used for all image prompts in subsequent scenes.
+
+    Output must be valid JSON with exactly these keys.
+
+    Note for the image descriptions: you should not depict any extreme violence/weapons/gore etc. as to not get blocked by content moderation filters. Also, remember that the 3 images must be of similar scenes (not drastically different) to smoothly transition the narrative. Consistency is key—keep the character’s appearance and the background uniform.
+
+    User Provided Theme: {user_theme}
+    """
+
+
+def story_part_prompt(user_action, last_image_prompt, storyline="", core_details=""):
+    return f"""
+    You are an AI Narration and Storyteller assistant. Create the next scene based on the past storyline and the core character details provided.
+
+    Storyline so far:
+    {storyline}
+
+    Core character and style details:
+    {core_details}
+
+    The user has chosen the following action:
+    {user_action}
+
+    Please provide an overview of the new scene in 2-3 sentences. At the end of your scene, clearly list two possible actions that the user can take next.
+
+    IMPORTANT FOR IMAGE GENERATION:
+    - The video for the new scene will be generated from three images.
+    - The **first image** is already provided from the previous scene. Its prompt was:
+         "{last_image_prompt}"
+    - Please **do not** generate a new prompt for this first image.
+    - Instead, generate exactly **two new image prompts** for the current scene that continue the narrative.
+    - Ensure that the two new image prompts have consistent style with the previous scene.
+
+    Also, provide a concise video generation prompt that instructs a video generation model to produce a 10-second video using the three images (in the following order: first image from previous scene, then the two new images).
+
+    You will output only valid JSON—no extra keys, no Markdown formatting, and no disclaimers.
+    Your JSON must have the following keys:
+    1. new_storyline: String. A text description of solely the new content of the storyline.
+    2. image_prompts: List of 2 Strings. Each is a prompt to DALLE for generating a new image.
+    3. video_generation_prompt: String. This prompt is to a video generation model which will be fed the 3 images, and this text to create the video. (no need to mention here that the video should be 10 seconds). Keep it concise.
+    4. narration: A textual narration which will be used as closed captioning and be read aloud along the video (2 short sentences max)
+    5. actions: List of 2 Strings, which are two possible actions for the user to take.
+    6. core_details: String. An updated version of the core character and style template if needed.
+    """
+
+
+def streamed_scene_prompt(prompt, streamed, image_count):
+    """
+    `prompt` for another attempt at a scene whose narration or image prompts
+    were already streamed into it (see SceneRace): the new reply has to
+    reuse them word for word.
+    """
+    kept = []
+    if "narration" in streamed:
+        kept.append(f"- narration: {json.dumps(streamed['narration'])}")
+    for index, image_prompt in sorted(streamed.get("image_prompts", {}).items()):
+        if index < image_count:
+            kept.append(f"- image_prompts[{index}]: {json.dumps(image_prompt)}")
+    kept = "\n    ".join(kept)
+    return prompt + f"""
+    Part of this scene is already being shown to the user. Use these values exactly as given, and write the rest of the scene to match them:
+    {kept}
+    """
+
+
+def storyline_summary_prompt(summary, scenes, max_words):
+    new_scenes = "\n".join(f"- {scene}" for scene in scenes)
+    return f"""
+    You are maintaining the running summary of an interactive story. Update the summary below so that it also covers the new scenes.
+    Keep the characters, places, goals and unresolved threads a storyteller needs to continue the story; drop moment-to-moment detail.
+    Write at most {max_words} words of plain prose. Output only the updated summary.
+
+    Current summary:
+    {summary or "(none yet)"}
+
+    New scenes, in order:
+    {new_scenes}
+    """
+
+
+def parse_scene_reply(assistant_reply, image_count):
+    """Parses the LLM's JSON reply, raising InvalidSceneReply if it can't be used."""
+    try:
+        result_json = json.loads(assistant_reply)
+    except json.JSONDecodeError:
+        raise InvalidSceneReply("Error parsing JSON")
+
+    if "image_prompts" not in result_json or len(result_json["image_prompts"]) != image_count:
+        raise InvalidSceneReply("Image prompts invalid")
+    return result_json
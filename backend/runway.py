@@ -1,11 +1,16 @@
 import os
+import json
 import requests
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 from runwayml import RunwayML
-import time
-import json
-from PIL import Image
-import io
+from poller import TaskPoller, TaskFailed, PollCancelled
+from runway_accounts import RunwayAccount, RunwayAccounts, AccountAssets
+from metrics import registry, span, counted, upstream_bytes
 
 load_dotenv()
 
@@ -15,6 +20,108 @@ RUNWAY_EMAIL = os.getenv('RUNWAY_EMAIL')
 
 
 RUNWAY_PASSWORD = os.getenv('RUNWAY_PASSWORD')
+# Video tasks each account runs at once.
+RUNWAY_MAX_JOBS = int(os.getenv('RUNWAY_MAX_JOBS', '5'))
+# More accounts, as a JSON list of {"email": ..., "password": ..., "max_jobs": ...},
+# multiply video throughput. Defaults to the single RUNWAY_EMAIL account.
+RUNWAY_ACCOUNTS = json.loads(os.getenv('RUNWAY_ACCOUNTS') or 'null') or [
+    {"email": RUNWAY_EMAIL, "password": RUNWAY_PASSWORD, "max_jobs": RUNWAY_MAX_JOBS}
+]
+RUNWAY_CAPACITY = sum(account.get("max_jobs", RUNWAY_MAX_JOBS) for account in RUNWAY_ACCOUNTS)
+# Overridable so the pipeline can be pointed at fake_providers.py.
+USEAPI_BASE_URL = os.getenv('USEAPI_BASE_URL', 'https://api.useapi.net/v1/runwayml')
+
+# Typical and maximum time for a 10 second video task, used to schedule polls.
+RUNWAY_EXPECTED_SECONDS = float(os.getenv('RUNWAY_EXPECTED_SECONDS', '45'))
+RUNWAY_TASK_DEADLINE = float(os.getenv('RUNWAY_TASK_DEADLINE', '600'))
+# Status polls in a row that may fail (connection errors, 5xx) before a task is given up on.
+RUNWAY_POLL_MAX_ERRORS = int(os.getenv('RUNWAY_POLL_MAX_ERRORS', '3'))
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# One polling loop shared by every in-flight video task.
+task_poller = TaskPoller(name="runway-poller")
+task_polls = registry.histogram(
+    "runway_task_polls", "Status polls needed per Runway video task.", buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55)
+)
+
+
+# (connect, read) timeouts for every useapi.net request, matching the async client.
+RUNWAY_CONNECT_TIMEOUT = float(os.getenv('RUNWAY_CONNECT_TIMEOUT', '10'))
+RUNWAY_READ_TIMEOUT = float(os.getenv('RUNWAY_READ_TIMEOUT', '120'))
+
+
+class PostSafeRetry(Retry):
+    """
+    Retries GETs on 429/5xx, but POSTs only on 429: a 5xx from a gateway says
+    nothing about whether the task behind it was created (and billed).
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method and method.upper() == "POST" and status_code != 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter that applies `timeout` to requests that don't set their own."""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def task_video_url(response):
+    """
+    Reads a useapi.net task status response: the video URL once the task has
+    succeeded, or None while it runs. Raises TaskFailed if the task failed;
+    anything else raised (429/5xx, a body that isn't JSON) is worth polling
+    again.
+    """
+    if response.status_code == 429 or response.status_code >= 500:
+        raise Exception(f"Task status request returned {response.status_code}")
+    task_data = response.json()
+    if response.status_code != 200:
+        raise TaskFailed(f"Task status request returned {response.status_code}: {task_data}")
+
+    if task_data['status'] == 'SUCCEEDED':
+        # Return the video URL from artifacts
+        if task_data['artifacts'] and len(task_data['artifacts']) > 0:
+            return task_data['artifacts'][0]['url']
+        raise TaskFailed("No video URL found in completed task")
+    elif task_data['status'] == 'FAILED':
+        raise TaskFailed(f"Task failed: {task_data.get('error')}")
+    return None
+
+
+def create_session(pool_size=32):
+    """
+    A pooled keep-alive session with (connect, read) timeouts. Connection
+    errors and 429s are retried with backoff; other 5xx only for GETs.
+    """
+    retry = PostSafeRetry(
+        total=3,
+        read=0,  # Never replay a request the server may already have acted on.
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry,
+        timeout=(RUNWAY_CONNECT_TIMEOUT, RUNWAY_READ_TIMEOUT),
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 
 class RunwayClient:
     def __init__(self):
@@ -34,67 +141,43 @@ class RunwayClient:
         task_id = task.id
         print(task_id)
 
-        # Poll the task until it's complete
-        time.sleep(10)  # Wait for a second before polling
-        task = self.runway_client.tasks.retrieve(task_id)
-        while task.status not in ['SUCCEEDED', 'FAILED']:
-            time.sleep(2)  # Wait for ten seconds before polling
+        def check(task_id):
             task = self.runway_client.tasks.retrieve(task_id)
+            if task.status == 'SUCCEEDED':
+                return task
+            if task.status == 'FAILED':
+                raise TaskFailed(f"Task failed: {task}")
+            return None
+
+        # Poll the task until it's complete
+        task = task_poller.watch(
+            task_id, check, expected=RUNWAY_EXPECTED_SECONDS, deadline=RUNWAY_TASK_DEADLINE,
+            max_errors=RUNWAY_POLL_MAX_ERRORS,
+        ).result()
 
         print('Task complete:', task)
         print(task.output)
         return task
 
 class RunwayUnofficial:
-    def __init__(self):
-        self.base_url = "https://api.useapi.net/v1/runwayml"
+    def __init__(self, media_prep=None):
+        self.base_url = USEAPI_BASE_URL
+        # A MediaPrep that shrinks cached images before upload, or None to upload them as they are.
+        self.media_prep = media_prep
         self.headers = {
             "Authorization": f"Bearer {USEAPI_API_KEY}",
             "Content-Type": "application/json"
         }
-        self.token_file = ".runway_token"
-        self.token = self._load_token()
-        if not self.token:
-            self._authenticate()
-
-    def _load_token(self):
-        try:
-            if os.path.exists(self.token_file):
-                with open(self.token_file, 'r') as f:
-                    return json.load(f)
-        except Exception as e:
-            print(f"Warning: Could not load token: {str(e)}")
-        return None
-
-    def _save_token(self, token):
-        try:
-            directory = os.path.dirname(os.path.abspath(self.token_file))
-            os.makedirs(directory, exist_ok=True)
-            
-            with open(self.token_file, 'w') as f:
-                json.dump(token, f)
-        except Exception as e:
-            print(f"Warning: Could not save token to file: {str(e)}")
-
-    def _authenticate(self):
-        payload = {
-            "email": RUNWAY_EMAIL,
-            "password": RUNWAY_PASSWORD,
-            "maxJobs": 5,
-        }
-        
-        r = requests.post(
-            f"{self.base_url}/accounts/{RUNWAY_EMAIL}", 
-            headers=self.headers, 
-            json=payload
+        self.session = create_session()
+        self._upload_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="runway-upload")
+        self.accounts = RunwayAccounts(
+            [RunwayAccount(a["email"], a.get("password"), a.get("max_jobs", RUNWAY_MAX_JOBS)) for a in RUNWAY_ACCOUNTS],
+            self.base_url, USEAPI_API_KEY, self.session,
         )
-        try:
-            self.token = r.json()['jwt']  # This is a dictionary
-            if "token" not in self.token:
-                raise Exception("Token not found in response")
-            self._save_token(self.token)
-        except Exception as e:
-            print(f"Error: {e}, {r.text}")
+        # Uploaded images, so the previous scene's last image isn't re-uploaded.
+        self.assets = AccountAssets(max_entries=512)
+        # Task id -> the account whose slot it holds.
+        self._task_accounts = {}
 
     def _get_content_type(self, filename):
         ext = filename.lower().split('.')[-1]
@@ -103,51 +186,125 @@ class RunwayUnofficial:
             'jpg': 'image/jpeg',
             'jpeg': 'image/jpeg',
             'gif': 'image/gif',
+            'webp': 'image/webp',
             'mp4': 'video/mp4'
         }
         return content_types.get(ext, 'image/png')
 
 
-    def _upload_image(self, image_url):
+    def _upload_image(self, image_url, account):
         print("Uploading image")
-        # First download the image from the URL
-        image_response = requests.get(image_url)
-        if image_response.status_code != 200:
-            raise Exception(f"Failed to download image from {image_url}")
-        
-        # Display the image using PIL
-        #image = Image.open(io.BytesIO(image_response.content))
-        #image.show()
+        if not os.path.exists(image_url):
+            # Not cached locally: stream it to a temporary file first.
+            with tempfile.TemporaryDirectory() as directory:
+                return self._upload_image(self._download(image_url, directory), account)
+
+        # Sent as a video-sized frame where possible.
+        path = self.media_prep.prepare(image_url) if self.media_prep else image_url
 
         # Get filename from URL and determine content type
         filename = image_url.split("?")[0].split("/")[-1]
-        content_type = self._get_content_type(filename)
+        content_type = self._get_content_type(path)
 
         upload_headers = {
             "Authorization": f"Bearer {USEAPI_API_KEY}",
             "Content-Type": content_type
         }
         url = f"{self.base_url}/assets/?name={filename.split('.')[0]}"
-        #print(url)
-        #print(upload_headers)
-        response = requests.post(
-            url,
-            headers=upload_headers,
-            data=image_response.content,
-        )
+
+        def send():
+            with open(path, 'rb') as f:
+                # requests streams file objects from disk (and rewinds them for retries).
+                return self.session.post(
+                    url,
+                    headers=upload_headers,
+                    params={"email": account.email},
+                    data=f,
+                )
+        response = self.accounts.call(account, send)
+        upstream_bytes.inc(os.path.getsize(path), call="runway_upload")
 
         if response.status_code != 200:
             raise Exception(f"Failed to upload image: {response.text}")
             
         return response.json()['assetId']
 
-    def generate_video(self, image_urls, video_generation_prompt):
-        # Upload all images and get their asset IDs
-        asset_ids = []
-        for url in image_urls:
-            asset_id = self._upload_image(url)
-            asset_ids.append(asset_id)
+    def _download(self, image_url, directory):
+        """Streams `image_url` into `directory`, under its own filename, and returns the path."""
+        path = os.path.join(directory, image_url.split("?")[0].split("/")[-1] or "image.png")
+        with self.session.get(image_url, stream=True) as image_response:
+            if image_response.status_code != 200:
+                raise Exception(f"Failed to download image from {image_url}")
+            with open(path, 'wb') as f:
+                for chunk in counted(image_response.iter_content(STREAM_CHUNK_SIZE), "image_download"):
+                    f.write(chunk)
+        return path
+
+    def upload_image(self, image_url, account=None):
+        """
+        Uploads an image (URL or local path) and returns its assetId, reusing
+        earlier uploads. Without an `account`, an upload to any account is
+        reused, and new ones go to the account likeliest to run the video.
+        """
+        asset_id = self.assets.get(image_url, account)
+        if asset_id:
+            return asset_id
+
+        account = account or self.accounts.preferred()
+        with span("runway_upload", account=account.email):
+            asset_id = self._upload_image(image_url, account)
+        self.assets.add(account, image_url, asset_id)
+        return asset_id
+
+    def _asset_on(self, account, asset_id):
+        """`asset_id`, or the same image uploaded to `account` if it was uploaded to another one."""
+        owner, image_url = self.assets.owner(asset_id)
+        if owner is None or owner is account:
+            return asset_id
+        self.assets.record_move()
+        return self.upload_image(image_url, account)
+
+    def upload_image_async(self, image_source):
+        """
+        Returns a future for the assetId of `image_source`, which is either an
+        image URL / path or a future that resolves to one. In the latter case
+        the upload starts as soon as that image is ready.
+        """
+        result = Future()
+
+        def start(source):
+            try:
+                image_url = source.result() if isinstance(source, Future) else source
+                upload = self._upload_executor.submit(self.upload_image, image_url)
+            except Exception as e:
+                result.set_exception(e)
+                return
+            upload.add_done_callback(lambda f: _copy_future(f, result))
+
+        if isinstance(image_source, Future):
+            image_source.add_done_callback(start)
+        else:
+            start(image_source)
+        return result
 
+    def create_video_task(self, asset_ids, video_generation_prompt):
+        """
+        Starts a video task on an account with a free slot (waiting for one if
+        every account is busy) and returns its id. The slot is held until
+        wait_for_task() returns.
+        """
+        account = self.accounts.acquire(prefer=self.assets.usual_owner(asset_ids))
+        try:
+            # A task can only use assets of its own account.
+            asset_ids = [self._asset_on(account, asset_id) for asset_id in asset_ids]
+            task_id = self._create_task(account, asset_ids, video_generation_prompt)
+        except Exception:
+            self.accounts.release(account, ok=False)
+            raise
+        self._task_accounts[task_id] = account
+        return task_id
+
+    def _create_task(self, account, asset_ids, video_generation_prompt):
         # Prepare the video generation payload
         payload = {
             "firstImage_assetId": asset_ids[0],
@@ -156,38 +313,83 @@ class RunwayUnofficial:
             "text_prompt": video_generation_prompt,
             "aspect_ratio": "landscape",
             "seconds": 10,
-            "maxJobs": 5
+            "maxJobs": account.max_jobs
         }
 
         # Create the video generation task
-        response = requests.post(
-            f"{self.base_url}/gen3turbo/create",
-            headers=self.headers,
-            json=payload
-        )
-        if response.status_code != 200:
-            raise Exception(f"Failed to create video generation task: {response.text}")
+        with span("runway_create", account=account.email):
+            response = self.accounts.call(account, lambda: self.session.post(
+                f"{self.base_url}/gen3turbo/create",
+                headers=self.headers,
+                json=payload
+            ))
+            if response.status_code != 200:
+                raise Exception(f"Failed to create video generation task: {response.text}")
 
         task_id = response.json()['taskId']
-        print(f"Task created: {task_id}")
+        print(f"Task created: {task_id} ({account.email})")
+        return task_id
 
-        # Poll for task completion
-        while True:
-            task_response = requests.get(
-                f"{self.base_url}/tasks/{task_id}",
-                headers=self.headers
+    def _check_task(self, task_id):
+        return task_video_url(self.session.get(
+            f"{self.base_url}/tasks/{task_id}",
+            headers=self.headers
+        ))
+
+    def wait_for_task(self, task_id, cancel_event=None):
+        """Blocks until the task finishes, raising PollTimeout past RUNWAY_TASK_DEADLINE."""
+        with span("runway_wait") as attrs:
+            handle = task_poller.watch(
+                task_id,
+                self._check_task,
+                expected=RUNWAY_EXPECTED_SECONDS,
+                deadline=RUNWAY_TASK_DEADLINE,
+                cancel_event=cancel_event,
+                max_errors=RUNWAY_POLL_MAX_ERRORS,
             )
-            task_data = task_response.json()
-            
-            if task_data['status'] == 'SUCCEEDED':
-                print(task_data)
-                # Return the video URL from artifacts
-                if task_data['artifacts'] and len(task_data['artifacts']) > 0:
-                    return task_data['artifacts'][0]['url']
-                raise Exception("No video URL found in completed task")
-            
-            elif task_data['status'] == 'FAILED':
-                raise Exception(f"Task failed: {task_data.get('error')}")
-            
-            time.sleep(1.5)  # Wait before polling again
+            try:
+                result = handle.result()
+            except PollCancelled:
+                # Runway keeps rendering the task, so its slot stays taken.
+                self._release_when_done(task_id, handle)
+                raise
+            except Exception:
+                self._release_task(task_id, False)
+                raise
+            finally:
+                attrs["polls"] = handle.polls
+                task_polls.observe(handle.polls)
+            self._release_task(task_id, True)
+            return result
+
+    def _release_task(self, task_id, ok):
+        account = self._task_accounts.pop(task_id, None)
+        if account is not None:
+            self.accounts.release(account, ok)
+
+    def _release_when_done(self, task_id, cancelled):
+        """Keeps polling a task nobody waits for any more, to free its account's slot once it ends."""
+        elapsed = time.monotonic() - cancelled.started
+        handle = task_poller.watch(
+            task_id,
+            self._check_task,
+            expected=max(0.0, RUNWAY_EXPECTED_SECONDS - elapsed),
+            deadline=max(0.0, RUNWAY_TASK_DEADLINE - elapsed),
+            max_errors=RUNWAY_POLL_MAX_ERRORS,
+        )
+        handle.future.add_done_callback(lambda future: self._release_task(task_id, future.exception() is None))
+
+    def generate_video(self, image_urls, video_generation_prompt):
+        # Upload all images concurrently and get their asset IDs
+        uploads = [self.upload_image_async(url) for url in image_urls]
+        asset_ids = [upload.result() for upload in uploads]
+
+        task_id = self.create_video_task(asset_ids, video_generation_prompt)
+        return self.wait_for_task(task_id)
+
 
+def _copy_future(source, target):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
@@ -0,0 +1,302 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from metrics import registry
+
+runway_authentications = registry.counter(
+    "runway_authentications_total", "Runway account (re-)authentications with useapi.net.", ("account", "reason")
+)
+
+# Responses meaning useapi.net no longer holds a valid Runway session for the account.
+AUTH_ERRORS = (401, 403)
+
+
+def token_expiry(jwt):
+    """Unix time at which a Runway JWT (useapi.net's {"token": ...} dict) expires, or None if unknown."""
+    if not isinstance(jwt, dict):
+        return None
+    if jwt.get("exp"):
+        return float(jwt["exp"])
+    try:
+        payload = jwt["token"].split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class RunwayAccount:
+    """A Runway account registered with useapi.net, and the video tasks running on it."""
+
+    def __init__(self, email, password, max_jobs=5):
+        self.email = email
+        self.password = password
+        self.max_jobs = max_jobs
+        self.jwt = None
+        # When this process last authenticated the account, or None.
+        self.authenticated_at = None
+        self.active = 0
+        self.tasks = 0
+        self.failed = 0
+        self.authentications = 0
+        self.auth_lock = threading.Lock()
+
+    def free_slots(self):
+        return self.max_jobs - self.active
+
+    def needs_token(self, margin):
+        """Whether the token is missing or has less than `margin` seconds (or half its lifetime) left."""
+        if self.jwt is None:
+            return True
+        expires = token_expiry(self.jwt)
+        if expires is None:
+            return False
+        if self.authenticated_at is not None:
+            margin = min(margin, (expires - self.authenticated_at) / 2)
+        return expires - time.time() < margin
+
+
+class RunwayAccounts:
+    """
+    The Runway accounts video tasks are spread over, each with `max_jobs`
+    task slots. A task takes a slot on the account with the most free ones
+    (preferring the account its images were uploaded to) and gives it back
+    when it finishes, so throughput grows with the number of accounts instead
+    of tasks queueing up at useapi.net behind one account's limit.
+
+    Each account's session is (re-)registered with useapi.net when it is
+    about to expire or a request is rejected for it. Tokens are kept in
+    `token_file` across restarts.
+    """
+
+    def __init__(self, accounts, base_url, api_key, session, token_file=".runway_token", refresh_margin=300):
+        if not accounts:
+            raise ValueError("At least one Runway account is needed")
+        self.accounts = list(accounts)
+        self.base_url = base_url
+        self.headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        self.session = session
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self.waiting = 0
+        self._cond = threading.Condition()
+        self._file_lock = threading.Lock()
+
+        self._load_tokens()
+        for account in self.accounts:
+            if account.needs_token(self.refresh_margin):
+                self._authenticate(account, "startup")
+
+    # ----------------------------
+    # Tokens
+    def _load_tokens(self):
+        try:
+            if not os.path.exists(self.token_file):
+                return
+            with open(self.token_file, 'r') as f:
+                tokens = json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not load token: {str(e)}")
+            return
+        if "token" in tokens:
+            # Written when there was only ever one account.
+            tokens = {self.accounts[0].email: tokens}
+        for account in self.accounts:
+            account.jwt = tokens.get(account.email)
+
+    def _save_tokens(self):
+        with self._file_lock:
+            try:
+                directory = os.path.dirname(os.path.abspath(self.token_file))
+                os.makedirs(directory, exist_ok=True)
+                with open(self.token_file, 'w') as f:
+                    json.dump({a.email: a.jwt for a in self.accounts if a.jwt is not None}, f)
+            except Exception as e:
+                print(f"Warning: Could not save token to file: {str(e)}")
+
+    def _authenticate(self, account, reason):
+        payload = {
+            "email": account.email,
+            "password": account.password,
+            "maxJobs": account.max_jobs,
+        }
+        r = self.session.post(f"{self.base_url}/accounts/{account.email}", headers=self.headers, json=payload)
+        try:
+            jwt = r.json()['jwt']  # This is a dictionary
+            if "token" not in jwt:
+                raise Exception("Token not found in response")
+        except Exception as e:
+            print(f"Error authenticating Runway account {account.email}: {e}, {r.text}")
+            return
+        account.jwt = jwt
+        account.authenticated_at = time.time()
+        account.authentications += 1
+        runway_authentications.inc(account=account.email, reason=reason)
+        self._save_tokens()
+
+    def ensure_token(self, account):
+        """Re-authenticates `account` if its token is missing or about to expire."""
+        if not account.needs_token(self.refresh_margin):
+            return
+        with account.auth_lock:
+            if account.needs_token(self.refresh_margin):
+                self._authenticate(account, "expiring")
+
+    def refresh(self, account, rejected_jwt):
+        """Re-authenticates `account` after `rejected_jwt` was refused, unless another request already did."""
+        with account.auth_lock:
+            if account.jwt is rejected_jwt:
+                self._authenticate(account, "rejected")
+
+    def call(self, account, send):
+        """
+        Returns `send()`, an HTTP request made for `account`, with a fresh
+        token: re-authenticates and sends it once more if it is rejected.
+        """
+        self.ensure_token(account)
+        jwt = account.jwt
+        response = send()
+        if response.status_code in AUTH_ERRORS:
+            self.refresh(account, jwt)
+            response = send()
+        return response
+
+    async def call_async(self, account, send):
+        """call() for a coroutine function `send`; authentication runs off the event loop."""
+        if account.needs_token(self.refresh_margin):
+            await asyncio.to_thread(self.ensure_token, account)
+        jwt = account.jwt
+        response = await send()
+        if response.status_code in AUTH_ERRORS:
+            await asyncio.to_thread(self.refresh, account, jwt)
+            response = await send()
+        return response
+
+    # ----------------------------
+    # Task slots
+    def _free_account(self, prefer):
+        if prefer is not None and prefer.free_slots() > 0:
+            return prefer
+        account = max(self.accounts, key=RunwayAccount.free_slots)
+        return account if account.free_slots() > 0 else None
+
+    def preferred(self):
+        """The account new uploads should go to: the one likeliest to have a slot for their task."""
+        with self._cond:
+            return max(self.accounts, key=RunwayAccount.free_slots)
+
+    def acquire(self, prefer=None, timeout=None):
+        """
+        Takes a task slot, on `prefer` if it has one free and otherwise on the
+        account with the most. Blocks until one is free; returns None if
+        `timeout` passes first.
+        """
+        with self._cond:
+            self.waiting += 1
+            try:
+                if not self._cond.wait_for(lambda: self._free_account(prefer) is not None, timeout):
+                    return None
+            finally:
+                self.waiting -= 1
+            account = self._free_account(prefer)
+            account.active += 1
+            account.tasks += 1
+            return account
+
+    async def acquire_async(self, prefer=None, poll_interval=1.0):
+        """acquire() without blocking the event loop. Video tasks take tens of seconds, so polling is fine."""
+        while True:
+            account = self.acquire(prefer, timeout=0)
+            if account is not None:
+                return account
+            await asyncio.sleep(poll_interval)
+
+    def release(self, account, ok=True):
+        with self._cond:
+            account.active -= 1
+            if not ok:
+                account.failed += 1
+            self._cond.notify_all()
+
+    def capacity(self):
+        return sum(account.max_jobs for account in self.accounts)
+
+    def stats(self):
+        now = time.time()
+        with self._cond:
+            accounts = []
+            for account in self.accounts:
+                expires = token_expiry(account.jwt)
+                accounts.append({
+                    "email": account.email,
+                    "max_jobs": account.max_jobs,
+                    "active": account.active,
+                    "utilization": account.active / account.max_jobs if account.max_jobs else None,
+                    "tasks": account.tasks,
+                    "failed": account.failed,
+                    "authentications": account.authentications,
+                    "token_expires_in": None if expires is None else round(expires - now),
+                })
+            return {
+                "capacity": self.capacity(),
+                "active": sum(account.active for account in self.accounts),
+                "waiting": self.waiting,
+                "accounts": accounts,
+            }
+
+
+class AccountAssets:
+    """
+    useapi.net assetIds by account and image source, so images (like the
+    previous scene's last one) aren't re-uploaded. An asset can only be used
+    by tasks on the account it was uploaded to.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.moved = 0
+        self._ids = OrderedDict()  # (email, source) -> assetId
+        self._owners = {}  # assetId -> (account, source)
+        self._lock = threading.Lock()
+
+    def get(self, source, account=None):
+        """The assetId of `source` on `account`, or on any account if None."""
+        with self._lock:
+            if account is not None:
+                keys = [(account.email, source)]
+            else:
+                keys = [key for key in reversed(self._ids) if key[1] == source][:1]
+            for key in keys:
+                if key in self._ids:
+                    self._ids.move_to_end(key)
+                    return self._ids[key]
+        return None
+
+    def add(self, account, source, asset_id):
+        with self._lock:
+            self._ids[(account.email, source)] = asset_id
+            self._owners[asset_id] = (account, source)
+            while len(self._ids) > self.max_entries:
+                _, evicted = self._ids.popitem(last=False)
+                self._owners.pop(evicted, None)
+
+    def record_move(self):
+        """Counts an image uploaded again because its task runs on another account."""
+        with self._lock:
+            self.moved += 1
+
+    def owner(self, asset_id):
+        """(account, source) of an asset uploaded here, or (None, None)."""
+        with self._lock:
+            return self._owners.get(asset_id, (None, None))
+
+    def usual_owner(self, asset_ids):
+        """The account most of `asset_ids` were uploaded to, or None."""
+        owners = Counter(self.owner(asset_id)[0] for asset_id in asset_ids)
+        owners.pop(None, None)
+        return owners.most_common(1)[0][0] if owners else None
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from metrics import registry
+
+scene_llm_calls = registry.counter(
+    "scene_llm_calls_total",
+    "Scene completions by model tier, model and outcome: used, invalid, error, or wasted / stopped "
+    "(lost a race after finishing / while running).",
+    ("tier", "model", "outcome"),
+)
+scene_llm_seconds = registry.histogram(
+    "scene_llm_seconds", "Time to a valid scene reply, including retries and races.", ("tier",)
+)
+
+
+class SceneRace:
+    """
+    One attempt at a scene reply made with `size` completions at once: the
+    first reply that validates is used and the others are stopped, so a slow
+    or invalid completion no longer sets the scene's pace.
+
+    A racer's image prompts and narration are streamed into the scene (the
+    callbacks) only when it races alone: with several racers, whichever
+    streamed first may not be the first to validate, and what it streamed
+    can't be taken back. What was streamed is recorded in `streamed`
+    ({"narration": text, "image_prompts": {index: prompt}}, shared by the
+    attempts of one scene) so a retry can be asked to keep it. Racers report
+    how they ended with finish(); a racer still running should give up once
+    `stopped` is set.
+    """
+
+    def __init__(self, size, tier, model, on_image_prompt=None, on_narration=None, streamed=None):
+        self.size = size
+        self.tier = tier
+        self.model = model
+        self.on_image_prompt = on_image_prompt if size == 1 else None
+        self.on_narration = on_narration if size == 1 else None
+        self.streamed = {} if streamed is None else streamed
+        self.stopped = threading.Event()
+        # The last reply that didn't validate, for the logs.
+        self.last_reply = None
+        self._pending = size
+        self._invalid = 0
+        self._error = None
+        self._winner = Future()
+        self._lock = threading.Lock()
+
+    def callbacks(self, racer):
+        """The (on_image_prompt, on_narration) callbacks for one racer's stream parser."""
+        def on_image_prompt(index, prompt):
+            if self.on_image_prompt:
+                # The scene keeps the first one it was given.
+                self.streamed.setdefault("image_prompts", {}).setdefault(index, prompt)
+                self.on_image_prompt(index, prompt)
+
+        def on_narration(text):
+            if self.on_narration:
+                self.streamed.setdefault("narration", text)
+                self.on_narration(text)
+        return on_image_prompt, on_narration
+
+    def finish(self, racer, result=None, outcome=None, error=None):
+        """
+        Records how `racer` ended: with a validated `result`, or with outcome
+        "invalid", "error" (with the `error`) or "stopped".
+        """
+        with self._lock:
+            self._pending -= 1
+            if result is not None:
+                outcome = "wasted" if self._winner.done() else "used"
+                if outcome == "used":
+                    self._winner.set_result(result)
+                    self.stopped.set()
+            elif outcome == "invalid":
+                self._invalid += 1
+            elif outcome == "error":
+                self._error = error
+            if self._pending == 0 and not self._winner.done():
+                if self._invalid or self._error is None:
+                    # Worth another attempt.
+                    self._winner.set_result(None)
+                else:
+                    self._winner.set_exception(self._error)
+        scene_llm_calls.inc(tier=self.tier, model=self.model, outcome=outcome)
+
+    def result(self):
+        """
+        The first valid reply; None if every racer's reply was invalid (worth
+        another attempt). Raises if they all failed or nothing can be retried.
+        """
+        return self._winner.result()
+
+    async def result_async(self):
+        return await asyncio.wrap_future(self._winner)
@@ -0,0 +1,55 @@
+import uuid
+
+
+def make_scene_node(parent_id, action, context, result, scene_id=None):
+    """
+    An immutable snapshot of one finished scene. It holds only what the scene
+    added (its storyline delta and media refs) plus a pointer to the scene it
+    continues, so any number of stories can branch off a shared prefix.
+
+    `context` is the story context right after the scene was applied. A new
+    scene gets a new `scene_id`; catalog scenes keep the one they were made with.
+    """
+    scene = context["scenes"][-1]
+    scene_id = scene_id or str(uuid.uuid4())
+    return {
+        "scene_id": scene_id,
+        "parent_id": parent_id,
+        "action": action,
+        "n": scene["n"],
+        "storyline": scene["text"],
+        "core_details": context.get("core_details", ""),
+        "last_image_prompt": context.get("last_image_prompt", ""),
+        "last_image_url": context.get("last_image_url", ""),
+        "story_summary": context.get("story_summary", ""),
+        "summary_through": context.get("summary_through", -1),
+        "result": dict(result, scene_id=scene_id),
+    }
+
+
+def context_from_scene(get_scene, scene_id, max_scenes):
+    """
+    Rebuilds the story context as of `scene_id` by walking at most
+    `max_scenes` parent pointers. Returns None for unknown scenes.
+    """
+    node = get_scene(scene_id)
+    if node is None:
+        return None
+
+    scenes = []
+    current = node
+    while current is not None and len(scenes) < max_scenes and current["n"] > node["summary_through"]:
+        scenes.append({"n": current["n"], "text": current["storyline"]})
+        # Ancestors that have been evicted are simply left out.
+        current = get_scene(current["parent_id"]) if current["parent_id"] else None
+    scenes.reverse()
+
+    return {
+        "scene_id": node["scene_id"],
+        "scenes": scenes,
+        "story_summary": node["story_summary"],
+        "summary_through": node["summary_through"],
+        "core_details": node["core_details"],
+        "last_image_prompt": node["last_image_prompt"],
+        "last_image_url": node["last_image_url"],
+    }
@@ -0,0 +1,175 @@
+import heapq
+import math
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+# Lower numbers run first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SPECULATIVE = 10
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobScheduler:
+    """
+    A fixed pool of worker threads pulling story jobs from a priority queue.
+
+    Interactive jobs and background ones (any lower priority: speculative
+    scenes, storyline summaries) are bounded separately by `max_queue` and
+    `max_background_queue`, and submit() raises QueueFull only when the job's
+    own share is full, so callers can answer with 429 / Retry-After without
+    background work ever causing one. Background jobs also never hold more
+    than `background_workers` workers at once; the rest stay free for
+    interactive jobs.
+    """
+
+    def __init__(self, workers=8, max_queue=32, background_workers=None, max_background_queue=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        if background_workers is None:
+            background_workers = workers // 2
+        # At least one worker is always left for interactive jobs (unless there is only one).
+        self.background_workers = max(1, min(background_workers, workers - 1))
+        self.max_background_queue = max_queue if max_background_queue is None else max_background_queue
+        self.running = 0
+        self.background_running = 0
+        self.completed = 0
+        self.rejected = 0
+        self._queue = []
+        self._queued = {False: 0, True: 0}  # background? -> jobs waiting
+        self._order = itertools.count()
+        self._waits = deque(maxlen=200)
+        self._durations = deque(maxlen=200)
+        self._cond = threading.Condition()
+
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"story-worker-{i}", daemon=True).start()
+
+    def submit(self, fn, *args, priority=PRIORITY_INTERACTIVE):
+        background = priority > PRIORITY_INTERACTIVE
+        future = Future()
+        with self._cond:
+            limit = self.max_background_queue if background else self.max_queue
+            if self._queued[background] >= limit:
+                self.rejected += 1
+                full = True
+            else:
+                full = False
+                self._queued[background] += 1
+                heapq.heappush(self._queue, (priority, next(self._order), time.monotonic(), fn, args, future))
+                self._cond.notify()
+        if full:
+            raise QueueFull(self.retry_after())
+        return future
+
+    def _runnable(self):
+        """
+        Whether the job at the head of the queue can start. Interactive jobs
+        sort first, so the head is a background job only if none are waiting.
+        """
+        if not self._queue:
+            return False
+        return self._queue[0][0] <= PRIORITY_INTERACTIVE or self.background_running < self.background_workers
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(self._runnable)
+                priority, _, queued_at, fn, args, future = heapq.heappop(self._queue)
+                background = priority > PRIORITY_INTERACTIVE
+                self._queued[background] -= 1
+                if not future.set_running_or_notify_cancel():
+                    continue
+                started = time.monotonic()
+                self._waits.append(started - queued_at)
+                self.running += 1
+                if background:
+                    self.background_running += 1
+
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._cond:
+                    self.running -= 1
+                    if background:
+                        self.background_running -= 1
+                        # A background job waiting on the cap can start now.
+                        self._cond.notify()
+                    self.completed += 1
+                    self._durations.append(time.monotonic() - started)
+
+    def retry_after(self):
+        """Rough number of seconds until an interactive queue slot frees up."""
+        with self._cond:
+            durations = list(self._durations)
+            queued = self._queued[False]
+        average = sum(durations) / len(durations) if durations else 60
+        return max(1, math.ceil(average * (queued / self.workers)))
+
+    def stats(self):
+        with self._cond:
+            waits = list(self._waits)
+            return {
+                "workers": self.workers,
+                "running": self.running,
+                "queue_depth": self._queued[False],
+                "max_queue": self.max_queue,
+                "background_workers": self.background_workers,
+                "background_running": self.background_running,
+                "background_queued": self._queued[True],
+                "max_background_queue": self.max_background_queue,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "max_wait": round(max(waits), 3) if waits else 0.0,
+            }
+
+
+class StageLimits:
+    """
+    Independent concurrency limits per upstream provider stage, e.g.
+    {"llm": 8, "images": 6, "video": 5, "tts": 4}. Use as:
+
+        with stage_limits.acquire("images"):
+            ...
+    """
+
+    def __init__(self, limits):
+        self.limits = dict(limits)
+        self._semaphores = {name: threading.BoundedSemaphore(n) for name, n in limits.items()}
+        self._in_use = {name: 0 for name in limits}
+        self._waiting = {name: 0 for name in limits}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, stage):
+        semaphore = self._semaphores[stage]
+        with self._lock:
+            self._waiting[stage] += 1
+        semaphore.acquire()
+        with self._lock:
+            self._waiting[stage] -= 1
+            self._in_use[stage] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use[stage] -= 1
+            semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {"limit": self.limits[name], "in_use": self._in_use[name], "waiting": self._waiting[name]}
+                for name in self.limits
+            }
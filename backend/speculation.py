@@ -0,0 +1,132 @@
+import threading
+from concurrent.futures import Future
+
+from stages import StageCancelled
+
+
+def _start_thread(fn, *args):
+    threading.Thread(target=fn, args=args, daemon=True).start()
+
+
+class SpeculativeJob:
+    """A background generation of the scene that follows one candidate action."""
+
+    def __init__(self, action, release=None):
+        self.action = action
+        self.started = False
+        self.cancel_event = threading.Event()
+        self.future = Future()
+        self._release = release or (lambda: None)
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Cancels the job. One still queued is finished now and gives back its slot."""
+        with self._lock:
+            self.cancel_event.set()
+            if self.started or self.future.done():
+                return
+            self.future.set_exception(StageCancelled(f"Speculation for '{self.action}' was cancelled"))
+        self._release()
+
+    def begin(self):
+        """Marks the job as running, or returns False if it was cancelled while queued."""
+        with self._lock:
+            if self.future.done():
+                return False
+            self.started = True
+            return True
+
+    def done(self):
+        return self.future.done()
+
+    def succeeded(self):
+        return self.future.done() and self.future.exception() is None
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class SpeculativeScenes:
+    """
+    Pre-generates the next scene for each action offered at the end of a scene,
+    so that /next_scene can hand back a finished (or already running) result.
+
+    `generate(story_id, context, action, cancel_event)` must return the same
+    story update that process_story would apply for that action.
+
+    At most `max_per_story` jobs are started per scene and at most `max_global`
+    run at once across the server; actions that don't get a slot are simply
+    generated live when chosen.
+
+    Jobs are started with `submit(fn, *args)`, a new thread by default.
+    """
+
+    def __init__(self, generate, max_per_story=2, max_global=8, submit=None):
+        self.generate = generate
+        self.submit = submit or _start_thread
+        self.max_per_story = max_per_story
+        self._global_slots = threading.BoundedSemaphore(max_global)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, story_id, context, actions):
+        """Starts speculative jobs for the actions of the scene that just completed."""
+        self.discard(story_id)
+
+        jobs = {}
+        for action in actions[:self.max_per_story]:
+            if not self._global_slots.acquire(blocking=False):
+                print(f"[{story_id}] Server-wide speculation limit reached, skipping '{action}'")
+                break
+            job = SpeculativeJob(action, release=self._global_slots.release)
+            try:
+                self.submit(self._run, story_id, dict(context), job)
+            except Exception as e:
+                self._global_slots.release()
+                print(f"[{story_id}] Could not start speculation for '{action}': {e}")
+                continue
+            jobs[action] = job
+
+        with self._lock:
+            self._jobs[story_id] = jobs
+        if jobs:
+            print(f"[{story_id}] Speculatively generating {len(jobs)} next scene(s)")
+
+    def _run(self, story_id, context, job):
+        if not job.begin():
+            # cancel() already gave the slot back.
+            return
+        try:
+            job.future.set_result(self.generate(story_id, context, job.action, job.cancel_event))
+        except Exception as e:
+            job.future.set_exception(e)
+        finally:
+            self._global_slots.release()
+
+    def claim(self, story_id, action):
+        """
+        Returns the job for the chosen action (finished or still running), or
+        None if there isn't one. Every other job for the story is cancelled.
+        """
+        with self._lock:
+            jobs = self._jobs.pop(story_id, {})
+        job = jobs.pop(action, None)
+        for other in jobs.values():
+            other.cancel()
+        return job
+
+    def discard(self, story_id):
+        """Cancels and forgets every speculative job for a story."""
+        with self._lock:
+            jobs = self._jobs.pop(story_id, {})
+        for job in jobs.values():
+            job.cancel()
+
+    def stats(self):
+        with self._lock:
+            jobs = [job for story_jobs in self._jobs.values() for job in story_jobs.values()]
+        return {
+            "stories": len(self._jobs),
+            "running": sum(1 for job in jobs if not job.done()),
+            "ready": sum(1 for job in jobs if job.succeeded()),
+        }
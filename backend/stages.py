@@ -0,0 +1,253 @@
+import contextvars
+import functools
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Shared pool for stage bodies. Stages mostly block on upstream APIs, so the
+# pool is sized for I/O rather than CPU.
+_stage_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="stage")
+
+
+class StageError(Exception):
+    def __init__(self, stage, error):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class StageCancelled(Exception):
+    pass
+
+
+def _settle(target, source):
+    """Gives future `target` the outcome of future `source`."""
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+class StageGraph:
+    """
+    A small dependency graph of named stages. Each stage starts as soon as all
+    of the stages it depends on have finished, and receives their results as
+    positional arguments (in the order the dependencies were listed).
+
+    Per-stage timings are recorded relative to the start of run(), so the
+    total wall-clock time can be compared against the sum of the stages.
+
+    If a `cancel` event is given and gets set, no further stages are started
+    and run() raises StageCancelled once the running stages have returned.
+    `on_done(name, result)` is called as each stage finishes successfully.
+
+    Signals are stages without a body: another stage completes them early
+    with provide(), e.g. to hand off part of its output before it returns.
+
+    Optional stages may fail, or miss a deadline (seconds after run() starts),
+    without failing the graph: their result is None and `degraded[name]` says
+    why, and optional stages that depend on them are degraded the same way
+    without running. Once only overdue optional stages are left, running or
+    not yet started, run() returns without them. They keep going in the
+    background (those not started yet still start once their dependencies
+    finish), and a future for each is left in `late`.
+    """
+
+    def __init__(self, name, executor=None, cancel=None, on_done=None):
+        self.name = name
+        self.executor = executor or _stage_executor
+        self.cancel = cancel
+        self.on_done = on_done
+        self.stages = {}
+        self.results = {}
+        self.errors = {}
+        self.timings = {}
+        self.degraded = {}
+        self.late = {}
+        self._signals = {}
+        self._optional = {}
+        self._started = None
+        self._lock = threading.Lock()
+
+    def add(self, name, fn, deps=(), optional=False, deadline=None):
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage '{name}'")
+        for dep in deps:
+            # Dependencies must be declared first, which also keeps the graph acyclic.
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = (fn, tuple(deps))
+        if optional or deadline is not None:
+            self._optional[name] = deadline
+        return self
+
+    def _overdue(self, name, elapsed):
+        return self._optional.get(name) is not None and elapsed >= self._optional[name]
+
+    def add_signal(self, name):
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage '{name}'")
+        self.stages[name] = (None, ())
+        self._signals[name] = Future()
+        return self
+
+    def provide(self, name, value):
+        """Completes a signal. Returns False if it had already been provided."""
+        future = self._signals[name]
+        with self._lock:
+            if future.done():
+                return False
+            offset = round(time.monotonic() - (self._started or time.monotonic()), 3)
+            self.timings[name] = {"start": offset, "end": offset, "duration": 0.0}
+            future.set_result(value)
+        return True
+
+    def _run_stage(self, name, fn, args, started):
+        start = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            end = time.monotonic()
+            with self._lock:
+                self.timings[name] = {
+                    "start": round(start - started, 3),
+                    "end": round(end - started, 3),
+                    "duration": round(end - start, 3),
+                }
+
+    def run(self):
+        """
+        Runs every stage and returns a dict of stage name -> result.
+        If a stage fails, no new stages are started; stages already running
+        are allowed to finish and a StageError is raised for the first failure.
+        """
+        started = self._started = time.monotonic()
+        pending = {name: stage for name, stage in self.stages.items() if name not in self._signals}
+        running = {future: name for name, future in self._signals.items()}
+        first_error = None
+
+        while pending or running:
+            if pending and self.cancel is not None and self.cancel.is_set():
+                pending.clear()
+                if first_error is None:
+                    first_error = StageCancelled(f"{self.name} was cancelled")
+
+            for name, (fn, deps) in list(pending.items()):
+                degraded_deps = [dep for dep in deps if dep in self.degraded]
+                if degraded_deps and name in self._optional:
+                    # It can't do anything useful without them.
+                    del pending[name]
+                    self.results[name] = None
+                    self.degraded[name] = self.degraded[degraded_deps[0]]
+                    continue
+                if all(dep in self.results for dep in deps):
+                    del pending[name]
+                    args = [self.results[dep] for dep in deps]
+                    # Stages see the caller's context variables (e.g. the scene's trace).
+                    future = self.executor.submit(
+                        contextvars.copy_context().run, self._run_stage, name, fn, args, started
+                    )
+                    running[future] = name
+
+            if first_error is None and running and all(
+                name in self._signals and not future.done() for future, name in running.items()
+            ):
+                # No stage is left running that could provide these.
+                first_error = StageError(", ".join(sorted(running.values())), "signal was never provided")
+                pending.clear()
+
+            if first_error is not None:
+                # Signals that will never arrive mustn't keep the graph waiting.
+                for future, name in list(running.items()):
+                    if name in self._signals and not future.done():
+                        del running[future]
+
+            if not running:
+                break
+
+            elapsed = time.monotonic() - started
+            if first_error is None and all(
+                self._overdue(name, elapsed) for name in list(pending) + list(running.values())
+            ):
+                # Only late optional stages are left; finish without them.
+                self._detach(pending, running, started)
+                break
+
+            # Wake up for the next deadline of a running or waiting stage, if any.
+            deadlines = [
+                self._optional[name] - elapsed for name in list(pending) + list(running.values())
+                if self._optional.get(name) is not None and not self._overdue(name, elapsed)
+            ]
+            done, _ = wait(running, timeout=min(deadlines) if deadlines else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    self.results[name] = future.result()
+                    if self.on_done:
+                        self.on_done(name, self.results[name])
+                except Exception as e:
+                    self.errors[name] = e
+                    if name in self._optional:
+                        print(f"[{self.name}] Optional stage '{name}' failed: {e!r}")
+                        self.results[name] = None
+                        self.degraded[name] = "error"
+                        continue
+                    if first_error is None:
+                        first_error = StageError(name, e)
+                    # Don't start anything new once a stage has failed.
+                    pending.clear()
+
+        elapsed = round(time.monotonic() - started, 3)
+        self.timings["total"] = {"start": 0.0, "end": elapsed, "duration": elapsed}
+        if first_error is not None:
+            raise first_error
+        return self.results
+
+    def _detach(self, pending, running, started):
+        """Leaves the remaining (overdue optional) stages to finish in the background, with futures in `late`."""
+        results = dict(self.results)
+        futures = {name: Future() for name in pending}
+        for future, name in running.items():
+            self.late[name] = future
+        self.late.update(futures)
+        for name in list(pending) + list(running.values()):
+            self.results[name] = None
+            self.degraded[name] = "timeout"
+        if pending:
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=context.run, args=(self._run_late, dict(pending), dict(running), results, futures, started),
+                name=f"{self.name}-late", daemon=True,
+            ).start()
+
+    def _run_late(self, pending, running, results, futures, started):
+        """Drives the stages _detach() left behind, starting each once its dependencies finish."""
+        while pending and running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if future.exception() is None:
+                    results[name] = future.result()
+            if self.cancel is not None and self.cancel.is_set():
+                break
+            for name, (fn, deps) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    del pending[name]
+                    args = [results[dep] for dep in deps]
+                    future = self.executor.submit(
+                        contextvars.copy_context().run, self._run_stage, name, fn, args, started
+                    )
+                    future.add_done_callback(functools.partial(_settle, futures[name]))
+                    running[future] = name
+        for name in pending:
+            futures[name].set_exception(StageError(name, "a stage it depends on failed, or the graph was cancelled"))
+
+    def summary(self):
+        """Returns a one-line description of the stage timings for logging."""
+        parts = [
+            f"{name}={t['duration']:.1f}s"
+            for name, t in self.timings.items() if name != "total"
+        ]
+        total = self.timings.get("total", {}).get("duration", 0.0)
+        serial = sum(t["duration"] for name, t in self.timings.items() if name != "total")
+        return f"{' '.join(parts)} | wall={total:.1f}s (serial would be {serial:.1f}s)"
@@ -0,0 +1,317 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Fields needed to generate the next scene. They are much larger than the
+# record status lookups read, so they are kept apart from it.
+CONTEXT_FIELDS = (
+    "scene_id", "scenes", "story_summary", "summary_through",
+    "core_details", "last_image_prompt", "last_image_url", "catalog_theme_id",
+)
+
+
+def split_fields(fields):
+    """Splits story fields into (hot record fields, context fields)."""
+    hot = {k: v for k, v in fields.items() if k not in CONTEXT_FIELDS}
+    context = {k: v for k, v in fields.items() if k in CONTEXT_FIELDS}
+    return hot, context
+
+
+class StoryStore:
+    """
+    Where story state lives between requests. Each story has a small hot
+    record (status, result, timings) and a separate context with everything
+    needed for the next scene. get() only ever reads the hot record.
+
+    Stories not touched for `ttl` seconds are evicted.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def create(self, story_id, **fields):
+        raise NotImplementedError
+
+    def get(self, story_id):
+        """Returns a copy of the hot record, or None for unknown stories."""
+        raise NotImplementedError
+
+    def get_context(self, story_id):
+        raise NotImplementedError
+
+    def update(self, story_id, **fields):
+        raise NotImplementedError
+
+    def delete(self, story_id):
+        raise NotImplementedError
+
+    def evict_idle(self):
+        """
+        Removes stories idle for longer than the TTL and returns their ids.
+        Scene nodes nobody has read for the TTL go too.
+        """
+        raise NotImplementedError
+
+    def put_scene(self, node):
+        """Stores an immutable scene node (see scenes.make_scene_node)."""
+        raise NotImplementedError
+
+    def get_scene(self, scene_id):
+        raise NotImplementedError
+
+    def update_scene_result(self, scene_id, change):
+        """
+        Replaces a scene's result with `change(result)`, atomically. Only for
+        media that arrives after its scene was stored; the storyline is never
+        changed. Returns the new result, or None if the scene is gone.
+        """
+        raise NotImplementedError
+
+    def __contains__(self, story_id):
+        return self.get(story_id) is not None
+
+
+class MemoryStoryStore(StoryStore):
+    """In-process store: an LRU of at most `max_stories` stories with TTL eviction."""
+
+    def __init__(self, ttl, max_stories=10000, max_scenes=100000):
+        super().__init__(ttl)
+        self.max_stories = max_stories
+        self.max_scenes = max_scenes
+        self._records = OrderedDict()
+        self._contexts = {}
+        # Nodes are never modified, so they are shared rather than copied.
+        self._scenes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _touch(self, story_id):
+        record = self._records[story_id]
+        record["updated_at"] = time.time()
+        self._records.move_to_end(story_id)
+        return record
+
+    def create(self, story_id, **fields):
+        hot, context = split_fields(fields)
+        with self._lock:
+            self._records[story_id] = {"record": hot, "updated_at": time.time()}
+            self._contexts[story_id] = context
+            while len(self._records) > self.max_stories:
+                old_id, _ = self._records.popitem(last=False)
+                self._contexts.pop(old_id, None)
+
+    def get(self, story_id):
+        with self._lock:
+            if story_id not in self._records:
+                return None
+            return dict(self._touch(story_id)["record"])
+
+    def get_context(self, story_id):
+        with self._lock:
+            return dict(self._contexts.get(story_id, {}))
+
+    def update(self, story_id, **fields):
+        hot, context = split_fields(fields)
+        with self._lock:
+            if story_id not in self._records:
+                raise KeyError(story_id)
+            self._touch(story_id)["record"].update(hot)
+            self._contexts[story_id].update(context)
+
+    def delete(self, story_id):
+        with self._lock:
+            self._records.pop(story_id, None)
+            self._contexts.pop(story_id, None)
+
+    def evict_idle(self):
+        cutoff = time.time() - self.ttl
+        evicted = []
+        with self._lock:
+            # Oldest first, so we can stop at the first story still in use.
+            while self._records:
+                story_id, entry = next(iter(self._records.items()))
+                if entry["updated_at"] >= cutoff:
+                    break
+                self._records.popitem(last=False)
+                self._contexts.pop(story_id, None)
+                evicted.append(story_id)
+            while self._scenes and next(iter(self._scenes.values()))[1] < cutoff:
+                self._scenes.popitem(last=False)
+        return evicted
+
+    def put_scene(self, node):
+        with self._lock:
+            self._scenes[node["scene_id"]] = (node, time.time())
+            while len(self._scenes) > self.max_scenes:
+                self._scenes.popitem(last=False)
+
+    def get_scene(self, scene_id):
+        with self._lock:
+            if scene_id not in self._scenes:
+                return None
+            node, _ = self._scenes[scene_id]
+            self._scenes[scene_id] = (node, time.time())
+            self._scenes.move_to_end(scene_id)
+            return node
+
+    def update_scene_result(self, scene_id, change):
+        with self._lock:
+            if scene_id not in self._scenes:
+                return None
+            node, used_at = self._scenes[scene_id]
+            node = dict(node, result=change(dict(node["result"])))
+            self._scenes[scene_id] = (node, used_at)
+            return node["result"]
+
+
+class SQLiteStoryStore(StoryStore):
+    """
+    File-backed store. Survives restarts and can be shared by several
+    gunicorn workers on the same machine (which must then share the image and
+    audio cache directories too). Reads don't write, so a story counts as idle
+    once it hasn't been updated for the TTL.
+    """
+
+    def __init__(self, ttl, path="stories.db"):
+        super().__init__(ttl)
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stories (
+                story_id TEXT PRIMARY KEY,
+                record TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS stories_updated_at ON stories (updated_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS contexts (
+                story_id TEXT PRIMARY KEY,
+                context TEXT NOT NULL
+            )""")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS scenes (
+                scene_id TEXT PRIMARY KEY,
+                node TEXT NOT NULL,
+                used_at REAL NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS scenes_used_at ON scenes (used_at)")
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def create(self, story_id, **fields):
+        hot, context = split_fields(fields)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO stories (story_id, record, updated_at) VALUES (?, ?, ?)",
+                (story_id, json.dumps(hot), time.time()),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO contexts (story_id, context) VALUES (?, ?)",
+                (story_id, json.dumps(context)),
+            )
+
+    def get(self, story_id):
+        row = self._conn().execute(
+            "SELECT record FROM stories WHERE story_id = ?", (story_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_context(self, story_id):
+        row = self._conn().execute(
+            "SELECT context FROM contexts WHERE story_id = ?", (story_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def update(self, story_id, **fields):
+        hot, context = split_fields(fields)
+        conn = self._conn()
+        with conn:
+            # BEGIN IMMEDIATE so concurrent read-modify-writes don't interleave.
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT record FROM stories WHERE story_id = ?", (story_id,)).fetchone()
+            if row is None:
+                raise KeyError(story_id)
+            record = json.loads(row[0])
+            record.update(hot)
+            conn.execute(
+                "UPDATE stories SET record = ?, updated_at = ? WHERE story_id = ?",
+                (json.dumps(record), time.time(), story_id),
+            )
+            if context:
+                row = conn.execute("SELECT context FROM contexts WHERE story_id = ?", (story_id,)).fetchone()
+                merged = json.loads(row[0]) if row else {}
+                merged.update(context)
+                conn.execute(
+                    "INSERT OR REPLACE INTO contexts (story_id, context) VALUES (?, ?)",
+                    (story_id, json.dumps(merged)),
+                )
+
+    def delete(self, story_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM stories WHERE story_id = ?", (story_id,))
+            conn.execute("DELETE FROM contexts WHERE story_id = ?", (story_id,))
+
+    def evict_idle(self):
+        cutoff = time.time() - self.ttl
+        conn = self._conn()
+        with conn:
+            rows = conn.execute("SELECT story_id FROM stories WHERE updated_at < ?", (cutoff,)).fetchall()
+            evicted = [row[0] for row in rows]
+            conn.executemany("DELETE FROM stories WHERE story_id = ?", rows)
+            conn.executemany("DELETE FROM contexts WHERE story_id = ?", rows)
+            conn.execute("DELETE FROM scenes WHERE used_at < ?", (cutoff,))
+        return evicted
+
+    def put_scene(self, node):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO scenes (scene_id, node, used_at) VALUES (?, ?, ?)",
+                (node["scene_id"], json.dumps(node), time.time()),
+            )
+
+    def get_scene(self, scene_id):
+        conn = self._conn()
+        row = conn.execute("SELECT node, used_at FROM scenes WHERE scene_id = ?", (scene_id,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time() - self.ttl / 10:
+            # Keeps scenes that are still being branched from; at most one write per TTL/10.
+            with conn:
+                conn.execute("UPDATE scenes SET used_at = ? WHERE scene_id = ?", (time.time(), scene_id))
+        return json.loads(row[0])
+
+    def update_scene_result(self, scene_id, change):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT node FROM scenes WHERE scene_id = ?", (scene_id,)).fetchone()
+            if row is None:
+                return None
+            node = json.loads(row[0])
+            node["result"] = change(node["result"])
+            conn.execute("UPDATE scenes SET node = ? WHERE scene_id = ?", (json.dumps(node), scene_id))
+        return node["result"]
+
+
+def create_story_store(backend, ttl, path="stories.db", max_stories=10000, max_scenes=100000):
+    if backend == "memory":
+        return MemoryStoryStore(ttl, max_stories=max_stories, max_scenes=max_scenes)
+    if backend == "sqlite":
+        return SQLiteStoryStore(ttl, path=path)
+    raise ValueError(f"Unknown story store backend '{backend}'")
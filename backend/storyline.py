@@ -0,0 +1,155 @@
+import threading
+
+
+def estimate_tokens(text):
+    """Rough token count for English prose (about four characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def _start_thread(fn, *args):
+    threading.Thread(target=fn, args=args, daemon=True).start()
+
+
+class StorylineContext:
+    """
+    Keeps the storyline sent to the LLM bounded as a story grows.
+
+    The story context holds the last few scenes verbatim ("scenes") and a
+    running summary of everything before them ("story_summary", covering
+    scenes up to "summary_through"). Once more than `keep_scenes` scenes are
+    waiting, the oldest are folded into the summary in the background with
+    `summarize(summary, scene_texts)`, so no scene waits on it.
+
+    Scene writes and summary writes touch different fields, so a fold that
+    finishes while the next scene is being generated never loses either. A
+    fold that finishes after the story was rewound to another branch is
+    dropped (see `still_applies`).
+    """
+
+    def __init__(self, summarize, keep_scenes=3, token_budget=800, submit=None):
+        self.summarize = summarize
+        self.keep_scenes = keep_scenes
+        self.token_budget = token_budget
+        self.submit = submit or _start_thread
+        self._folding = {}
+        self._lock = threading.Lock()
+        self._scenes = 0
+        self._prompt_tokens = 0
+        self._max_prompt_tokens = 0
+        self._last_prompt_tokens = 0
+        self._folds = 0
+
+    @staticmethod
+    def pending(context):
+        """Scenes not yet covered by the summary, oldest first."""
+        through = context.get("summary_through", -1)
+        return [scene for scene in context.get("scenes", []) if scene["n"] > through]
+
+    @classmethod
+    def still_applies(cls, context, summary, scenes):
+        """
+        Whether folding `scenes` into `summary` is still right for `context`:
+        it has the same summary and those scenes are still waiting in it.
+        """
+        waiting = {scene["n"]: scene["text"] for scene in cls.pending(context)}
+        return (context.get("story_summary", "") == summary
+                and all(waiting.get(scene["n"]) == scene["text"] for scene in scenes))
+
+    def add_scene(self, context, text):
+        """Returns the context fields that record a newly finished scene."""
+        scenes = context.get("scenes", [])
+        n = scenes[-1]["n"] + 1 if scenes else 0
+        pending = self.pending(context) + [{"n": n, "text": text}]
+        # If summarizing keeps failing, old scenes are dropped rather than
+        # letting the context grow without bound.
+        return {"scenes": pending[-self.keep_scenes * 4:]}
+
+    def render(self, context):
+        """The storyline to put in the prompt, within the token budget."""
+        summary = context.get("story_summary", "")
+        recent = [scene["text"] for scene in self.pending(context)]
+
+        def text():
+            return "\n".join(part for part in [summary] + recent if part)
+
+        # Scenes still waiting to be folded go first, then the summary's head.
+        while len(recent) > 1 and estimate_tokens(text()) > self.token_budget:
+            recent.pop(0)
+        excess = estimate_tokens(text()) - self.token_budget
+        if excess > 0:
+            summary = summary[excess * 4:]
+        return text()
+
+    def maybe_fold(self, story_id, context, write):
+        """
+        Starts folding the scenes past the last `keep_scenes` into the summary,
+        unless there aren't any or a fold is already running for the story.
+        `write(story_id, applies, **fields)` stores the result, but only if
+        `applies(current_context)` is still true, and returns whether it did.
+        """
+        old = self.pending(context)[:-self.keep_scenes]
+        if not old:
+            return
+        fold = object()
+        with self._lock:
+            if story_id in self._folding:
+                return
+            self._folding[story_id] = fold
+        try:
+            self.submit(self._fold, story_id, fold, context.get("story_summary", ""), old, write)
+        except Exception as e:
+            self._done(story_id, fold)
+            print(f"[{story_id}] Could not start storyline summary: {e}")
+
+    def forget(self, story_id):
+        """
+        Called when the story is rewound to another scene: a fold still running
+        for its old branch no longer blocks folds on the new one.
+        """
+        with self._lock:
+            self._folding.pop(story_id, None)
+
+    def _done(self, story_id, fold):
+        with self._lock:
+            if self._folding.get(story_id) is fold:
+                del self._folding[story_id]
+
+    def _fold(self, story_id, fold, summary, scenes, write):
+        try:
+            new_summary = self.summarize(summary, [scene["text"] for scene in scenes])
+            written = write(
+                story_id,
+                lambda context: self.still_applies(context, summary, scenes),
+                story_summary=new_summary,
+                summary_through=scenes[-1]["n"],
+            )
+            if written:
+                with self._lock:
+                    self._folds += 1
+                print(f"[{story_id}] Folded {len(scenes)} scene(s) into the storyline summary")
+            else:
+                print(f"[{story_id}] Dropped storyline summary: the story moved to another branch")
+        except Exception as e:
+            # The scenes stay pending and are retried after the next scene.
+            print(f"[{story_id}] Storyline summary failed: {e}")
+        finally:
+            self._done(story_id, fold)
+
+    def record_prompt_tokens(self, tokens):
+        with self._lock:
+            self._scenes += 1
+            self._prompt_tokens += tokens
+            self._last_prompt_tokens = tokens
+            self._max_prompt_tokens = max(self._max_prompt_tokens, tokens)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "scenes": self._scenes,
+                "avg_prompt_tokens": round(self._prompt_tokens / self._scenes, 1) if self._scenes else 0,
+                "max_prompt_tokens": self._max_prompt_tokens,
+                "last_prompt_tokens": self._last_prompt_tokens,
+                "summaries": self._folds,
+                "summarizing": len(self._folding),
+                "token_budget": self.token_budget,
+            }
@@ -0,0 +1,209 @@
+import glob
+import os
+import threading
+import time
+
+
+class GrowingAsset:
+    """
+    A file that is read while it is still being written, so a client can start
+    playing narration as soon as its first chunk is on disk. Readers follow()
+    it from the start; the writer calls append() for each chunk and then
+    finish() or fail().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.done = False
+        self.error = None
+        self.started = time.monotonic()
+        # Seconds from creation to the first chunk.
+        self.first_byte = None
+        self._file = open(path, "wb")
+        self._ready_callbacks = []
+        self._done_callbacks = []
+        self._cond = threading.Condition()
+
+    def append(self, chunk):
+        if not chunk:
+            return
+        self._file.write(chunk)
+        self._file.flush()
+        with self._cond:
+            if self.first_byte is None:
+                self.first_byte = round(time.monotonic() - self.started, 3)
+            self.size += len(chunk)
+            self._cond.notify_all()
+        self._ready()
+
+    def finish(self, commit):
+        """
+        Marks the asset complete. `commit(path)` moves the file to where it is
+        kept and returns the new path; readers that open it later use that.
+        """
+        self._file.close()
+        with self._cond:
+            # Renamed under the lock so no reader opens the old path in between.
+            self.path = commit(self.path)
+            self.done = True
+            self._cond.notify_all()
+        self._ready()
+        self._done()
+
+    def fail(self, error):
+        self._file.close()
+        with self._cond:
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        self._ready()
+        self._done()
+
+    def when_ready(self, callback):
+        """Calls `callback()` once the first chunk is written or the asset ends, whichever is first."""
+        with self._cond:
+            if not (self.size or self.done):
+                self._ready_callbacks.append(callback)
+                return
+        callback()
+
+    def _ready(self):
+        with self._cond:
+            callbacks, self._ready_callbacks = self._ready_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def when_done(self, callback):
+        """Calls `callback()` once the asset is finished or has failed (see `error`)."""
+        with self._cond:
+            if not self.done:
+                self._done_callbacks.append(callback)
+                return
+        callback()
+
+    def _done(self):
+        with self._cond:
+            callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def wait_ready(self, timeout=None):
+        """Blocks until the first chunk is written. Returns False if the asset failed or stayed empty."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.size or self.done, timeout)
+            return self.size > 0 and self.error is None
+
+    def follow(self, chunk_size=16384, idle_timeout=60):
+        """
+        Yields the asset's bytes from the start, waiting for new ones until it
+        is finished. Stops early if it fails or nothing arrives for
+        `idle_timeout` seconds.
+        """
+        with self._cond:
+            if self.error is not None:
+                return
+            f = open(self.path, "rb")
+        with f:
+            offset = 0
+            while True:
+                with self._cond:
+                    if not self._cond.wait_for(lambda: self.size > offset or self.done, idle_timeout):
+                        return
+                    size, done, error = self.size, self.done, self.error
+                if error is not None:
+                    return
+                while offset < size:
+                    data = f.read(min(chunk_size, size - offset))
+                    if not data:
+                        break
+                    offset += len(data)
+                    yield data
+                if done and offset >= size:
+                    return
+
+
+def follow_file(path, chunk_size=16384, poll_interval=0.1, idle_timeout=60):
+    """
+    Yields a file another process is writing as a GrowingAsset, from the start.
+    Ends once the writer moves the file away (finished) or removes it (failed),
+    or nothing arrives for `idle_timeout` seconds.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        idle = 0
+        while True:
+            data = f.read(chunk_size)
+            if data:
+                idle = 0
+                yield data
+                continue
+            if not os.path.exists(path):
+                # Whatever was appended before the move is still in the open file.
+                while data := f.read(chunk_size):
+                    yield data
+                return
+            idle += poll_interval
+            if idle >= idle_timeout:
+                return
+            time.sleep(poll_interval)
+
+
+class StreamingAssets:
+    """
+    Assets still being written, by key. Each is written next to its final
+    place in `cache` and moved into the cache once it is complete, so the
+    cache only ever holds whole files.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.started = 0
+        self.failed = 0
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._assets.get(key)
+
+    def start(self, key):
+        """
+        Returns (asset, True) if the caller should write a new asset for `key`,
+        or (the asset already being written, False).
+        """
+        with self._lock:
+            if key in self._assets:
+                return self._assets[key], False
+            # Named per process, so workers sharing the cache never write the same file.
+            asset = GrowingAsset(f"{self.cache.path(key)}.{os.getpid()}.stream.tmp")
+            self._assets[key] = asset
+            self.started += 1
+            return asset, True
+
+    def partial_path(self, key):
+        """Returns the file another process sharing the cache is writing for `key`, or None."""
+        paths = glob.glob(glob.escape(self.cache.path(key)) + ".*.stream.tmp")
+        return paths[0] if paths else None
+
+    def finish(self, key, asset):
+        asset.finish(lambda path: self.cache.put_file(key, path))
+        with self._lock:
+            self._assets.pop(key, None)
+
+    def fail(self, key, asset, error):
+        asset.fail(error)
+        with self._lock:
+            self._assets.pop(key, None)
+            self.failed += 1
+
+    def stats(self):
+        with self._lock:
+            return {"streaming": len(self._assets), "streams_started": self.started, "streams_failed": self.failed}
@@ -4,11 +4,39 @@ import json
 
 BASE_URL = "https://infinite-sandbox.onrender.com/"
 
+def wait_for_events(story_id):
+    """
+    Follow the /story_events/<story_id> Server-Sent Events stream until the
+    scene is "completed" or "error". Returns the final status payload, or
+    raises if the stream can't be used (the caller falls back to polling).
+    """
+    events_url = f"{BASE_URL}/story_events/{story_id}"
+    with requests.get(events_url, stream=True, timeout=(10, 60)) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+                print(f"Event for story_id {story_id}: {event}")
+            elif line.startswith("data:") and event in ("completed", "error"):
+                return json.loads(line[len("data:"):])
+    raise Exception("Event stream closed before the scene finished")
+
 def poll_status(story_id, poll_interval=5):
     """
-    Poll the /story_status/<story_id> endpoint every poll_interval seconds
-    until the story status becomes "completed" or "error".
+    Wait for the story to become "completed" or "error", using the event
+    stream when available and otherwise polling /story_status/<story_id>
+    every poll_interval seconds.
     """
+    try:
+        data = wait_for_events(story_id)
+        if data.get("status", "error") == "completed":
+            return data.get("result")
+        print("Error occurred during processing.")
+        return None
+    except Exception as e:
+        print(f"Event stream unavailable, falling back to polling: {e}")
+
     status_url = f"{BASE_URL}/story_status/{story_id}"
     while True:
         try:
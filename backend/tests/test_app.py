@@ -0,0 +1,87 @@
+import importlib
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+import fake_providers
+import runway
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    """The app against fake_providers.py, with its caches, store and catalog in a temporary directory."""
+    directory = tmp_path_factory.mktemp("app")
+    fake_providers.configure(seed=1, time_scale=0.01, error_rate=0, image_size=(64, 32))
+    fake = make_server("127.0.0.1", 0, fake_providers.app, threaded=True)
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{fake.server_port}"
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(directory)
+        patch.setenv("OPENAI_API_KEY", "test")
+        patch.setenv("OPENAI_BASE_URL", f"{base_url}/v1")
+        patch.setenv("ELEVENLABS_API_KEY", "test")
+        patch.setenv("ELEVENLABS_BASE_URL", base_url)
+        patch.setenv("CATALOG_PATH", str(directory / "catalog.db"))
+        patch.setenv("RUNWAY_FRAME_FORMAT", "original")
+        patch.setenv("SPECULATIVE_SCENES", "0")
+        # Read by runway.py at import, which other tests may already have done.
+        patch.setattr(runway, "USEAPI_BASE_URL", f"{base_url}/v1/runwayml")
+        patch.setattr(runway, "USEAPI_API_KEY", "test")
+        patch.setattr(runway, "RUNWAY_ACCOUNTS", [{"email": "test@example.com", "password": "test"}])
+        yield importlib.import_module("app")
+    fake.shutdown()
+
+
+def add_catalog_scene(catalog, scene_id, parent_id=None, action=None, scenes=()):
+    scenes = [*scenes, {"n": len(scenes), "text": f"Scene {scene_id}."}]
+    context = {
+        "scene_id": scene_id,
+        "scenes": scenes,
+        "story_summary": "",
+        "summary_through": -1,
+        "core_details": "A cartographer with a brass compass,",
+        "last_image_prompt": f"{scene_id} image",
+        "last_image_url": f"/images/{scene_id}.png",
+    }
+    record = {
+        "status": "completed",
+        "result": {"scene_id": scene_id, "narration": f"Scene {scene_id}.", "actions": ["north", "south"]},
+    }
+    catalog.add("maps", parent_id, action, record, context, user_theme="maps")
+    return scenes
+
+
+def test_catalog_scenes_can_be_forked(app):
+    scenes = add_catalog_scene(app.catalog, "maps-root")
+    add_catalog_scene(app.catalog, "maps-north", "maps-root", "north", scenes)
+    client = app.app.test_client()
+
+    story_id = client.post("/initialize", json={"theme_id": "maps"}).get_json()["story_id"]
+    fork = client.post("/fork", json={"story_id": story_id})
+    assert fork.status_code == 200
+    assert fork.get_json()["scene_id"] == "maps-root"
+
+    assert client.post("/next_scene", json={"story_id": story_id, "user_action": "north"}).status_code == 200
+    fork = client.post("/fork", json={"scene_id": "maps-north"}).get_json()
+    context = app.stories.get_context(fork["story_id"])
+    assert [scene["text"] for scene in context["scenes"]] == ["Scene maps-root.", "Scene maps-north."]
+    assert client.get(f"/story_status/{fork['story_id']}").get_json()["result"]["scene_id"] == "maps-north"
+
+
+def test_initialize_leads_its_own_flight_when_the_cached_scene_was_evicted(app, monkeypatch):
+    started = []
+    monkeypatch.setattr(app, "INIT_COALESCING", True)
+    monkeypatch.setattr(app, "start_story_job", lambda story_id, user_theme: started.append(story_id))
+    flight = app.init_key("A lighthouse keeper")
+    app.init_flights.join(flight, "earlier")
+    app.init_flights.finish(flight, "evicted-scene")
+    client = app.app.test_client()
+
+    story_id = client.post("/initialize", json={"user_theme": "a lighthouse  keeper"}).get_json()["story_id"]
+    assert started == [story_id]
+    # Its job reports back to its own followers, not to whoever leads next.
+    assert app.init_flights.subscribers(flight) == [story_id]
+    follower = client.post("/initialize", json={"user_theme": "A lighthouse keeper"}).get_json()["story_id"]
+    assert started == [story_id]
+    assert app.init_flights.fail(flight) == [follower]
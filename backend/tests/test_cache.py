@@ -0,0 +1,55 @@
+import os
+
+from cache import DiskCache, SharedResults
+
+
+def test_entries_written_by_another_process_are_found(tmp_path):
+    writer = DiskCache(str(tmp_path), max_bytes=1 << 20, extension=".png")
+    reader = DiskCache(str(tmp_path), max_bytes=1 << 20, extension=".png")
+    writer.put("key", b"image")
+    assert reader.contains("key")
+    assert open(reader.lookup("key"), "rb").read() == b"image"
+    assert reader.stats()["bytes"] == 5
+
+
+def test_entries_evicted_by_another_process_are_forgotten(tmp_path):
+    first = DiskCache(str(tmp_path), max_bytes=1 << 20, extension=".png")
+    first.put("key", b"image")
+    second = DiskCache(str(tmp_path), max_bytes=1 << 20, extension=".png")
+    assert second.contains("key")
+    os.remove(first.path("key"))
+    assert not second.contains("key")
+    assert second.lookup("key") is None
+    assert second.stats()["bytes"] == 0
+
+
+
+def test_shared_results_coalesce_and_cache():
+    flights = SharedResults(ttl=30)
+    assert flights.join("theme", "a") == ("leader", None)
+    assert flights.join("theme", "b") == ("follower", None)
+    assert flights.subscribers("theme") == ["a", "b"]
+    assert flights.finish("theme", "scene-1") == ["b"]
+    assert flights.join("theme", "c") == ("cached", "scene-1")
+
+    assert flights.join("other", "d") == ("leader", None)
+    assert flights.join("other", "e") == ("follower", None)
+    assert flights.fail("other") == ["e"]
+    assert flights.join("other", "f") == ("leader", None)
+
+
+def test_dropped_result_makes_the_next_caller_lead_its_own_flight():
+    flights = SharedResults(ttl=30)
+    flights.join("theme", "a")
+    flights.finish("theme", "evicted")
+    assert flights.join("theme", "b") == ("cached", "evicted")
+    flights.drop("theme", "evicted")
+    assert flights.join("theme", "b") == ("leader", None)
+    assert flights.join("theme", "c") == ("follower", None)
+    # Finishing hands the new result to this flight's followers only.
+    assert flights.finish("theme", "scene-2") == ["c"]
+    assert flights.stats() == {"in_flight": 0, "coalesced": 1, "cache_hits": 0}
+
+    # Dropping a result that has since been replaced keeps the new one.
+    flights.drop("theme", "evicted")
+    assert flights.join("theme", "d") == ("cached", "scene-2")
@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import openai
+import pytest
+
+from hedging import HedgedCalls, transient_error
+
+
+def api_error(status):
+    request = httpx.Request("POST", "https://api.openai.test/v1/images/generations")
+    return openai.APIStatusError("failed", response=httpx.Response(status, request=request), body=None)
+
+
+def test_only_transient_errors_are_retried():
+    assert transient_error(api_error(429))
+    assert transient_error(api_error(503))
+    assert transient_error(openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.test")))
+    assert not transient_error(api_error(400))
+    assert not transient_error(ValueError())
+
+
+def test_rejected_call_is_not_retried():
+    calls = []
+
+    def reject():
+        calls.append(1)
+        raise api_error(400)
+
+    hedged = HedgedCalls("test", executor=ThreadPoolExecutor(4), percentile=0, retries=2, backoff=0)
+    with pytest.raises(openai.APIStatusError):
+        hedged.call(reject)
+    assert len(calls) == 1
+    assert hedged.stats()["retried"] == 0
+    assert hedged.stats()["failed"] == 1
+
+
+def test_rate_limited_call_is_retried():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 2:
+            raise api_error(429)
+        return "url"
+
+    hedged = HedgedCalls("test", executor=ThreadPoolExecutor(4), percentile=0, retries=2, backoff=0)
+    assert hedged.call(flaky) == "url"
+    assert hedged.stats()["retried"] == 1
+
+
+def test_latency_is_only_what_the_call_times():
+    slot = threading.Lock()
+    hedged = HedgedCalls("test", executor=ThreadPoolExecutor(4), percentile=0, min_samples=1)
+
+    def request():
+        with slot, hedged.timed():
+            return "url"
+
+    slot.acquire()
+    threading.Timer(0.2, slot.release).start()
+    assert hedged.call(request) == "url"
+    # The 0.2s spent waiting for the slot isn't the call's latency.
+    assert hedged.latencies.percentile(50) < 0.1
@@ -0,0 +1,23 @@
+import os
+
+from PIL import Image
+
+from cache import DiskCache
+from media_prep import MediaPrep
+
+
+def test_images_with_the_same_name_get_their_own_frames(tmp_path):
+    prep = MediaPrep(DiskCache(str(tmp_path / "frames"), 10 * 1024**2, extension=".jpg"), size=(64, 32), workers=1)
+    frames = []
+    for color in ("red", "blue"):
+        folder = tmp_path / color
+        folder.mkdir()
+        src = folder / "scene.png"
+        Image.new("RGB", (128, 64), color).save(src)
+        frames.append(prep.prepare(str(src)))
+    assert frames[0] != frames[1]
+    with Image.open(frames[1]) as frame:
+        assert frame.size == (64, 32)
+        assert frame.getpixel((32, 16))[2] > 200
+    assert prep.stats()["prepared"] == 2
+    assert all(os.path.exists(frame) for frame in frames)
@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+from poller import TaskPoller, TaskFailed, PollTimeout, PollCancelled
+
+
+def checks(*outcomes):
+    """A check that returns (or raises) each of `outcomes` in turn."""
+    outcomes = list(outcomes)
+
+    def check(task_id):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return check
+
+
+def watch(check, **kwargs):
+    return TaskPoller(jitter=0).watch("task", check, expected=0, min_interval=0.01, max_interval=0.01, **kwargs)
+
+
+def test_a_failed_poll_is_retried():
+    handle = watch(checks(ConnectionError("reset"), None, ValueError("not JSON"), "video.mp4"))
+    assert handle.result(2) == "video.mp4"
+    assert handle.polls == 4
+
+
+def test_consecutive_failed_polls_give_up():
+    handle = watch(checks(ConnectionError("1"), ConnectionError("2"), ConnectionError("3")), max_errors=3)
+    with pytest.raises(ConnectionError, match="3"):
+        handle.result(2)
+
+
+def test_a_failed_task_is_not_polled_again():
+    handle = watch(checks(TaskFailed("content policy"), "video.mp4"))
+    with pytest.raises(TaskFailed):
+        handle.result(2)
+    assert handle.polls == 1
+
+
+def test_failed_polls_stop_at_the_deadline():
+    handle = watch(lambda task_id: 1 / 0, deadline=0.05, max_errors=1000)
+    with pytest.raises(PollTimeout):
+        handle.result(2)
+
+
+def test_cancelled_task_is_let_go_before_its_next_poll():
+    cancel_event = threading.Event()
+    poller = TaskPoller(jitter=0, cancel_interval=0.01)
+    handle = poller.watch("task", lambda task_id: None, expected=600, min_interval=60, cancel_event=cancel_event)
+    cancel_event.set()
+    with pytest.raises(PollCancelled):
+        handle.result(2)
+    assert handle.polls == 0
+    assert poller.stats() == {"watching": 0}
@@ -0,0 +1,46 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from runway import PostSafeRetry, create_session
+
+
+@pytest.fixture
+def gateway():
+    """A server answering every request with 502, counting requests by method."""
+    hits = {"GET": 0, "POST": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def respond(self):
+            hits[self.command] += 1
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self.send_response(502)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        do_GET = do_POST = respond
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", hits
+    server.shutdown()
+
+
+def test_post_is_not_replayed_on_5xx(gateway, monkeypatch):
+    url, hits = gateway
+    monkeypatch.setattr(PostSafeRetry, "get_backoff_time", lambda self: 0)
+    session = create_session()
+    assert session.post(url, json={}).status_code == 502
+    assert hits["POST"] == 1
+
+
+def test_get_is_retried_on_5xx(gateway, monkeypatch):
+    url, hits = gateway
+    monkeypatch.setattr(PostSafeRetry, "get_backoff_time", lambda self: 0)
+    session = create_session()
+    assert session.get(url).status_code == 502
+    assert hits["GET"] == 4
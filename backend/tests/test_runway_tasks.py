@@ -0,0 +1,53 @@
+import asyncio
+import threading
+
+import pytest
+
+from async_pipeline import AsyncRunway
+from poller import PollCancelled
+
+
+class Response:
+    def __init__(self, status):
+        self.status_code = 200
+        self.status = status
+
+    def json(self):
+        return {"status": self.status, "artifacts": [{"url": "video.mp4"}] if self.status == "SUCCEEDED" else []}
+
+
+class Http:
+    """Reports the task as running until `done` is set."""
+
+    def __init__(self):
+        self.done = False
+
+    async def get(self, url, headers=None):
+        return Response("SUCCEEDED" if self.done else "RUNNING")
+
+
+class Accounts:
+    def __init__(self):
+        self.released = []
+
+    def release(self, account, ok=True):
+        self.released.append((account, ok))
+
+
+def test_cancelled_wait_keeps_the_slot_until_the_task_ends():
+    async def scenario():
+        http, accounts = Http(), Accounts()
+        runway = AsyncRunway(http, "https://runway.test", "key", accounts, expected_seconds=0)
+        runway._task_accounts["task"] = "account"
+        cancel = threading.Event()
+        asyncio.get_running_loop().call_later(0.1, cancel.set)
+        with pytest.raises(PollCancelled):
+            await runway.wait_for_task("task", min_interval=0.05, max_interval=0.05, cancel_event=cancel)
+        # Runway is still rendering it.
+        await asyncio.sleep(0.2)
+        assert accounts.released == []
+        http.done = True
+        await asyncio.sleep(0.2)
+        assert accounts.released == [("account", True)]
+
+    asyncio.run(scenario())
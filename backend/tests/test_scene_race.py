@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from json_stream import SceneStreamParser
+from prompts import streamed_scene_prompt
+from scene_race import SceneRace
+
+REPLY = json.dumps({
+    "narration": 'The door creaks "open".',
+    "image_prompts": ["a door", "a [dark] hall", "a lamp, lit"],
+    "actions": ["enter", "leave"],
+})
+
+
+def test_parser_reports_prompts_and_narration_as_they_complete():
+    seen = []
+    parser = SceneStreamParser(lambda i, prompt: seen.append((i, prompt)), lambda text: seen.append(text))
+    # Fed in small pieces, as a stream would be.
+    for start in range(0, len(REPLY), 7):
+        parser.feed(REPLY[start:start + 7])
+    assert seen == ['The door creaks "open".', (0, "a door"), (1, "a [dark] hall"), (2, "a lamp, lit")]
+
+
+def race(size, dispatched):
+    return SceneRace(size, "opening", "model", lambda i, prompt: dispatched.append((i, prompt)), dispatched.append)
+
+
+def test_invalid_reply_that_streamed_nothing_can_be_retried():
+    scene = race(1, [])
+    scene.finish(0, outcome="invalid")
+    assert scene.result() is None
+
+
+def test_invalid_reply_that_already_streamed_is_retried_keeping_what_streamed():
+    dispatched = []
+    scene = race(1, dispatched)
+    on_image_prompt, on_narration = scene.callbacks(0)
+    on_image_prompt(0, "a door")
+    on_narration("The door creaks.")
+    on_image_prompt(0, "another door")
+    scene.finish(0, outcome="invalid")
+    assert scene.result() is None
+    assert scene.streamed == {"image_prompts": {0: "a door"}, "narration": "The door creaks."}
+    retry = streamed_scene_prompt("Write a scene.", scene.streamed, 2)
+    assert retry.startswith("Write a scene.")
+    assert '- narration: "The door creaks."' in retry
+    assert '- image_prompts[0]: "a door"' in retry
+
+
+def test_racers_do_not_stream_into_the_scene():
+    dispatched = []
+    scene = race(2, dispatched)
+    first, second = scene.callbacks(0), scene.callbacks(1)
+    second[1]("narration B")
+    first[0](0, "prompt A")
+    assert dispatched == []
+
+
+def test_first_valid_reply_wins():
+    scene = race(3, [])
+    scene.finish(2, outcome="invalid")
+    scene.finish(1, {"narration": "B"})
+    assert scene.stopped.is_set()
+    assert scene.result() == {"narration": "B"}
+    scene.finish(0, {"narration": "A"})
+    assert scene.result() == {"narration": "B"}
+
+
+def test_race_of_invalid_replies_is_retried():
+    scene = race(2, [])
+    scene.finish(0, outcome="invalid")
+    scene.finish(1, outcome="error", error=TimeoutError("read timed out"))
+    assert scene.result() is None
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import JobScheduler, QueueFull, PRIORITY_SPECULATIVE
+
+
+def blocker():
+    """A job that runs until the returned event is set, and an event set once it has started."""
+    started, release = threading.Event(), threading.Event()
+
+    def job():
+        started.set()
+        release.wait(5)
+    return job, started, release
+
+
+def test_full_background_queue_never_rejects_interactive_jobs():
+    scheduler = JobScheduler(workers=2, max_queue=2, background_workers=1, max_background_queue=2)
+    job, started, release = blocker()
+    try:
+        scheduler.submit(job, priority=PRIORITY_SPECULATIVE)
+        assert started.wait(2)
+        for _ in range(2):
+            scheduler.submit(job, priority=PRIORITY_SPECULATIVE)
+        with pytest.raises(QueueFull):
+            scheduler.submit(job, priority=PRIORITY_SPECULATIVE)
+        # The background jobs hold one worker and fill their own queue only.
+        assert scheduler.submit(lambda: "scene").result(2) == "scene"
+    finally:
+        release.set()
+
+
+def test_interactive_queue_limit_still_applies():
+    scheduler = JobScheduler(workers=1, max_queue=1)
+    job, started, release = blocker()
+    try:
+        scheduler.submit(job)
+        assert started.wait(2)
+        scheduler.submit(job)
+        with pytest.raises(QueueFull) as e:
+            scheduler.submit(job)
+        assert e.value.retry_after >= 1
+        assert scheduler.stats()["rejected"] == 1
+    finally:
+        release.set()
+
+
+def test_background_jobs_stay_within_their_workers():
+    scheduler = JobScheduler(workers=4, max_queue=4, background_workers=2, max_background_queue=8)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def job():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    futures = [scheduler.submit(job, priority=PRIORITY_SPECULATIVE) for _ in range(8)]
+    for future in futures:
+        future.result(5)
+    assert max(peak) == 2
+    assert scheduler.stats()["background_running"] == 0
+
+
+def test_interactive_jobs_start_before_queued_background_jobs():
+    scheduler = JobScheduler(workers=1, max_queue=4)
+    job, started, release = blocker()
+    order = []
+    scheduler.submit(job)
+    assert started.wait(2)
+    background = scheduler.submit(order.append, "background", priority=PRIORITY_SPECULATIVE)
+    interactive = scheduler.submit(order.append, "interactive")
+    release.set()
+    background.result(2)
+    interactive.result(2)
+    assert order == ["interactive", "background"]
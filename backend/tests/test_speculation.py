@@ -0,0 +1,78 @@
+import pytest
+
+from speculation import SpeculativeScenes
+from stages import StageCancelled
+
+
+def speculation(max_per_story=2, max_global=3):
+    """SpeculativeScenes whose jobs stay queued until the test runs them."""
+    queued = []
+    scenes = SpeculativeScenes(
+        lambda story_id, context, action, cancel_event: {"action": action},
+        max_per_story=max_per_story,
+        max_global=max_global,
+        submit=lambda fn, *args: queued.append((fn, args)),
+    )
+    return scenes, queued
+
+
+def run(queued):
+    for fn, args in queued:
+        fn(*args)
+    queued.clear()
+
+
+def test_jobs_are_capped_per_story_and_server_wide():
+    scenes, queued = speculation(max_per_story=2, max_global=3)
+    scenes.start("a", {}, ["left", "right", "wait"])
+    scenes.start("b", {}, ["up", "down"])
+    assert len(queued) == 3
+    assert scenes.claim("a", "wait") is None
+
+    run(queued)
+    # Finished jobs give their slots back.
+    scenes.start("c", {}, ["in", "out"])
+    assert len(queued) == 2
+
+
+def test_claim_returns_the_chosen_job_and_cancels_the_rest():
+    scenes, queued = speculation()
+    scenes.start("a", {}, ["left", "right"])
+    job = scenes.claim("a", "left")
+    assert job.action == "left"
+    assert not job.done()
+
+    run(queued)
+    assert job.result() == {"action": "left"}
+    assert scenes.claim("a", "right") is None
+    assert scenes.stats() == {"stories": 0, "running": 0, "ready": 0}
+
+
+def test_cancelling_a_queued_job_frees_its_slot_at_once():
+    scenes, queued = speculation(max_per_story=2, max_global=2)
+    scenes.start("a", {}, ["left", "right"])
+    job = scenes.claim("a", "left")
+    assert not job.started
+    job.cancel()
+    with pytest.raises(StageCancelled):
+        job.result(timeout=0)
+
+    # Both slots are free before the scheduler gets to either job.
+    scenes.start("b", {}, ["up", "down"])
+    assert len(queued) == 4
+
+    # The cancelled jobs reaching a worker don't give their slots back twice.
+    run(queued[:2])
+    del queued[:2]
+    scenes.start("c", {}, ["in"])
+    assert len(queued) == 2
+    assert scenes.claim("c", "in") is None
+
+
+def test_discard_frees_the_slots_of_queued_jobs():
+    scenes, queued = speculation(max_per_story=2, max_global=2)
+    scenes.start("a", {}, ["left", "right"])
+    scenes.discard("a")
+    scenes.start("b", {}, ["up", "down"])
+    assert len(queued) == 4
+    assert scenes.claim("b", "up") is not None
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from stages import StageGraph, StageError, StageCancelled
+
+
+def test_stages_get_their_dependencies_results_in_order():
+    graph = StageGraph("story")
+    graph.add("a", lambda: 1)
+    graph.add("b", lambda: 2)
+    graph.add("sum", lambda b, a: (b, a), deps=["b", "a"])
+    assert graph.run()["sum"] == (2, 1)
+
+
+def test_independent_stages_overlap():
+    graph = StageGraph("story")
+    graph.add("a", lambda: time.sleep(0.2))
+    graph.add("b", lambda: time.sleep(0.2))
+    graph.run()
+    assert graph.timings["total"]["duration"] < 0.35
+
+
+def test_failed_stage_stops_its_dependents():
+    ran = []
+    graph = StageGraph("story")
+    graph.add("a", lambda: 1 / 0)
+    graph.add("b", lambda a: ran.append(a), deps=["a"])
+    with pytest.raises(StageError) as e:
+        graph.run()
+    assert e.value.stage == "a"
+    assert ran == []
+
+
+def test_cancel_stops_new_stages():
+    cancel = threading.Event()
+    ran = []
+    graph = StageGraph("story", cancel=cancel)
+    graph.add("a", cancel.set)
+    graph.add("b", lambda a: ran.append(a), deps=["a"])
+    with pytest.raises(StageCancelled):
+        graph.run()
+    assert ran == []
+
+
+def test_signal_provided_early_starts_dependents_before_its_provider_returns():
+    provided = threading.Event()
+    graph = StageGraph("story")
+    graph.add_signal("prompt")
+
+    def llm():
+        assert graph.provide("prompt", "p")
+        assert not graph.provide("prompt", "again")
+        # Only returns once the dependent stage has already run.
+        assert provided.wait(2)
+        return "reply"
+
+    graph.add("llm", llm)
+    graph.add("image", lambda prompt: provided.set() or prompt, deps=["prompt"])
+    results = graph.run()
+    assert results["image"] == "p"
+    assert results["llm"] == "reply"
+
+
+def test_signal_never_provided_fails_the_graph():
+    graph = StageGraph("story")
+    graph.add_signal("prompt")
+    graph.add("llm", lambda: "reply")
+    graph.add("image", lambda prompt: prompt, deps=["prompt"])
+    with pytest.raises(StageError, match="never provided"):
+        graph.run()
+
+
+def test_optional_stage_failure_degrades_instead_of_failing():
+    graph = StageGraph("story")
+    graph.add("llm", lambda: "reply")
+    graph.add("video", lambda llm: 1 / 0, deps=["llm"], optional=True)
+    results = graph.run()
+    assert results == {"llm": "reply", "video": None}
+    assert graph.degraded == {"video": "error"}
+    assert isinstance(graph.errors["video"], ZeroDivisionError)
+
+
+def test_running_stage_past_its_deadline_is_left_running():
+    release = threading.Event()
+    graph = StageGraph("story")
+    graph.add("llm", lambda: "reply")
+    graph.add("video", lambda llm: release.wait(2) and "video.mp4", deps=["llm"], deadline=0.1)
+    started = time.monotonic()
+    results = graph.run()
+    assert time.monotonic() - started < 1
+    assert results["video"] is None
+    assert graph.degraded == {"video": "timeout"}
+    release.set()
+    assert graph.late["video"].result(2) == "video.mp4"
+
+
+def test_stage_waiting_on_overdue_stages_is_left_to_run_late():
+    release = threading.Event()
+    graph = StageGraph("story")
+    graph.add("llm", lambda: "reply")
+    graph.add("upload", lambda llm: release.wait(2) and "asset", deps=["llm"], optional=True, deadline=0.1)
+    graph.add("video", lambda upload: upload + ".mp4", deps=["upload"], optional=True, deadline=0.1)
+    started = time.monotonic()
+    results = graph.run()
+    # The deadline counts from the start of run(), not from when the video could start.
+    assert time.monotonic() - started < 1
+    assert results["video"] is None
+    assert graph.degraded == {"upload": "timeout", "video": "timeout"}
+    release.set()
+    assert graph.late["video"].result(2) == "asset.mp4"
+
+
+def test_late_stage_whose_dependency_fails_never_runs():
+    fail = threading.Event()
+    graph = StageGraph("story")
+    graph.add("upload", lambda: fail.wait(2) and 1 / 0, optional=True, deadline=0.1)
+    graph.add("video", lambda upload: upload, deps=["upload"], optional=True, deadline=0.1)
+    graph.run()
+    fail.set()
+    with pytest.raises(StageError):
+        graph.late["video"].result(2)
+
+
+def test_optional_stage_after_a_degraded_one_is_skipped():
+    ran = []
+    graph = StageGraph("story")
+    graph.add("upload", lambda: 1 / 0, optional=True)
+    graph.add("video", lambda upload: ran.append(upload), deps=["upload"], optional=True)
+    assert graph.run() == {"upload": None, "video": None}
+    assert ran == []
+    assert graph.degraded == {"upload": "error", "video": "error"}
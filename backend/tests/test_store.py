@@ -0,0 +1,98 @@
+import types
+
+import pytest
+
+import store
+from store import MemoryStoryStore, SQLiteStoryStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the store's clock with one the test moves by hand."""
+    now = types.SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(store, "time", types.SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def stories(request, tmp_path, clock):
+    if request.param == "memory":
+        return MemoryStoryStore(ttl=100)
+    return SQLiteStoryStore(ttl=100, path=str(tmp_path / "stories.db"))
+
+
+def scene(scene_id):
+    return {"scene_id": scene_id, "parent_id": None, "n": 0, "storyline": "A.", "result": {"video": None}}
+
+
+def test_hot_record_and_context_are_kept_apart(stories):
+    stories.create("s", status="processing", scene_id="root", scenes=[{"n": 0, "text": "A."}])
+    assert stories.get("s") == {"status": "processing"}
+    assert stories.get_context("s") == {"scene_id": "root", "scenes": [{"n": 0, "text": "A."}]}
+
+    stories.update("s", status="completed", result={"video": "v.mp4"}, scene_id="next")
+    assert stories.get("s") == {"status": "completed", "result": {"video": "v.mp4"}}
+    assert stories.get_context("s") == {"scene_id": "next", "scenes": [{"n": 0, "text": "A."}]}
+
+    # Callers get copies.
+    stories.get("s")["status"] = "error"
+    assert stories.get("s")["status"] == "completed"
+
+
+def test_updating_a_missing_story_raises_key_error(stories):
+    with pytest.raises(KeyError):
+        stories.update("missing", status="completed")
+    assert "missing" not in stories
+    assert stories.get_context("missing") == {}
+
+    stories.create("s", status="processing")
+    stories.delete("s")
+    with pytest.raises(KeyError):
+        stories.update("s", status="completed")
+
+
+def test_update_scene_result_changes_only_the_result(stories):
+    stories.put_scene(scene("a"))
+    result = stories.update_scene_result("a", lambda result: dict(result, video="late.mp4"))
+    assert result == {"video": "late.mp4"}
+    assert stories.get_scene("a") == dict(scene("a"), result={"video": "late.mp4"})
+    assert stories.update_scene_result("missing", lambda result: result) is None
+
+
+def test_idle_stories_and_unread_scenes_are_evicted_after_the_ttl(stories, clock):
+    stories.create("idle", status="completed")
+    stories.create("active", status="completed")
+    stories.put_scene(scene("unread"))
+    stories.put_scene(scene("read"))
+
+    clock.value += 60
+    stories.update("active", status="processing")
+    assert stories.get_scene("read") is not None
+    assert stories.evict_idle() == []
+
+    clock.value += 60
+    assert stories.evict_idle() == ["idle"]
+    assert "idle" not in stories
+    assert stories.get_context("idle") == {}
+    assert "active" in stories
+    assert stories.get_scene("unread") is None
+    assert stories.get_scene("read") is not None
+
+
+def test_memory_store_evicts_least_recently_used_past_its_caps(clock):
+    stories = MemoryStoryStore(ttl=100, max_stories=2, max_scenes=2)
+    stories.create("a", status="completed", scene_id="a")
+    stories.create("b", status="completed")
+    stories.get("a")
+    stories.create("c", status="completed")
+    assert "a" in stories and "c" in stories
+    assert "b" not in stories
+    assert stories.get_context("b") == {}
+
+    stories.put_scene(scene("x"))
+    stories.put_scene(scene("y"))
+    stories.get_scene("x")
+    stories.put_scene(scene("z"))
+    assert stories.get_scene("y") is None
+    assert stories.get_scene("x") is not None
+    assert stories.get_scene("z") is not None
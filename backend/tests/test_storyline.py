@@ -0,0 +1,82 @@
+from storyline import StorylineContext
+
+
+class Story:
+    """One story's context, with the write_story_summary() contract."""
+
+    def __init__(self):
+        self.context = {}
+
+    def add(self, storylines, text):
+        self.context.update(storylines.add_scene(self.context, text))
+
+    def write(self, story_id, applies, **fields):
+        if not applies(self.context):
+            return False
+        self.context.update(fields)
+        return True
+
+
+def deferred():
+    """A submit() that runs nothing until the test says so."""
+    jobs = []
+    return jobs, lambda fn, *args: jobs.append((fn, args))
+
+
+def summarize(summary, scenes):
+    return " ".join([summary, *scenes]).strip()
+
+
+def test_fold_starts_once_more_than_keep_scenes_are_waiting():
+    jobs, submit = deferred()
+    storylines = StorylineContext(summarize, keep_scenes=2, submit=submit)
+    story = Story()
+    for text in ["A.", "B."]:
+        story.add(storylines, text)
+        storylines.maybe_fold("s", story.context, story.write)
+    assert jobs == []
+
+    story.add(storylines, "C.")
+    storylines.maybe_fold("s", story.context, story.write)
+    # Only one fold per story at a time.
+    storylines.maybe_fold("s", story.context, story.write)
+    assert len(jobs) == 1
+
+    fn, args = jobs.pop()
+    fn(*args)
+    assert story.context["story_summary"] == "A."
+    assert story.context["summary_through"] == 0
+    assert [scene["text"] for scene in storylines.pending(story.context)] == ["B.", "C."]
+    assert storylines.render(story.context) == "A.\nB.\nC."
+    assert storylines.stats()["summaries"] == 1
+    assert storylines.stats()["summarizing"] == 0
+
+
+def test_fold_for_a_branch_the_story_left_is_dropped():
+    jobs, submit = deferred()
+    storylines = StorylineContext(summarize, keep_scenes=1, submit=submit)
+    story = Story()
+    for text in ["A.", "B.", "C."]:
+        story.add(storylines, text)
+    after_a = {"scenes": story.context["scenes"][:1]}
+    storylines.maybe_fold("s", story.context, story.write)
+    stale, stale_args = jobs.pop()
+
+    # /next_scene?from_scene= rewinds to scene A and takes another action.
+    story.context = after_a
+    story.add(storylines, "B2.")
+    storylines.forget("s")
+    story.add(storylines, "C2.")
+    storylines.maybe_fold("s", story.context, story.write)
+    assert len(jobs) == 1
+
+    stale(*stale_args)
+    assert "story_summary" not in story.context
+    assert storylines.stats()["summaries"] == 0
+    # The old fold finishing doesn't end the one for the new branch.
+    assert storylines.stats()["summarizing"] == 1
+
+    fn, args = jobs.pop()
+    fn(*args)
+    assert story.context["story_summary"] == "A. B2."
+    assert story.context["summary_through"] == 1
@@ -0,0 +1,39 @@
+import threading
+
+from cache import DiskCache
+from streaming_assets import GrowingAsset, follow_file
+
+
+def test_when_done_runs_once_the_asset_fails(tmp_path):
+    asset = GrowingAsset(str(tmp_path / "key.stream.tmp"))
+    asset.append(b"first chunk")
+    errors = []
+    asset.when_done(lambda: errors.append(asset.error))
+    assert errors == []
+    asset.fail(ConnectionError("stream reset"))
+    assert [type(e) for e in errors] == [ConnectionError]
+
+
+def test_when_done_after_the_asset_finished_runs_straight_away(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1 << 20, extension=".mp3")
+    asset = GrowingAsset(f"{cache.path('key')}.1.stream.tmp")
+    asset.append(b"audio")
+    asset.finish(lambda path: cache.put_file("key", path))
+    done = []
+    asset.when_done(lambda: done.append(asset.error))
+    assert done == [None]
+    assert cache.get("key") == b"audio"
+
+
+def test_follow_file_reads_until_the_writer_moves_it(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1 << 20, extension=".mp3")
+    asset = GrowingAsset(f"{cache.path('key')}.1.stream.tmp")
+    asset.append(b"first ")
+    chunks = follow_file(asset.path, poll_interval=0.01)
+    assert next(chunks) == b"first "
+
+    def write_rest():
+        asset.append(b"second")
+        asset.finish(lambda path: cache.put_file("key", path))
+    threading.Timer(0.05, write_rest).start()
+    assert b"".join(chunks) == b"second"
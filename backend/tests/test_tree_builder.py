@@ -0,0 +1,66 @@
+import json
+
+from tree_builder import TreeBuilder
+
+
+def scenes():
+    """A generate() that records its calls and offers two actions per scene."""
+    calls = []
+
+    def generate(node_id, context, user_theme=None, user_action=None):
+        calls.append(user_action)
+        path = context.get("path", []) + ([user_action] if user_action else [])
+        return {"status": "completed", "result": {"actions": ["left", "right"]}}, {"path": path}
+    return calls, generate
+
+
+def node(node_id, parent, action, depth, path):
+    return {
+        "type": "node",
+        "node": {
+            "node_id": node_id,
+            "parent": parent,
+            "action": action,
+            "depth": depth,
+            "record": {"status": "completed", "result": {"actions": ["left", "right"]}},
+            "context": {"path": path},
+        },
+    }
+
+
+def test_resume_generates_only_what_the_checkpoint_is_missing(tmp_path):
+    # Interrupted after the root and its left child, partway through writing the right one.
+    lines = [
+        {"type": "tree", "user_theme": "maps", "max_depth": 2},
+        node("root", None, None, 0, []),
+        node("l", "root", "left", 1, ["left"]),
+    ]
+    with open(tmp_path / "t.jsonl", "w") as f:
+        f.writelines(json.dumps(line) + "\n" for line in lines)
+        f.write('{"type": "node", "node": {"node_id": "r"')
+
+    calls, generate = scenes()
+    builder = TreeBuilder(generate, directory=str(tmp_path), workers=2)
+    expand = builder._expand
+    again = []
+
+    def expand_and_resume(build, node):
+        # A second resume() arriving before the first has queued anything.
+        if not again:
+            again.append(builder.resume("t"))
+        expand(build, node)
+
+    builder._expand = expand_and_resume
+    build = builder.resume("t")
+    assert again == [build]
+
+    assert build.done.wait(2)
+    assert sorted(calls) == ["left", "left", "right", "right", "right"]
+    assert build.progress()["nodes"] == 7
+    assert build.progress()["pending"] == 0
+    tree = build.tree()
+    assert tree["node_id"] == "root"
+    assert set(tree["branches"]["right"]["branches"]) == {"left", "right"}
+
+    # The torn line was dropped, so the log reloads with every node.
+    assert len(TreeBuilder(generate, directory=str(tmp_path)).get("t").nodes) == 7
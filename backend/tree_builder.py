@@ -0,0 +1,221 @@
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TreeBuild:
+    """
+    One story tree being pre-generated. Every finished node is appended to a
+    JSONL checkpoint log as soon as it exists, so an interrupted build can be
+    reloaded and continued without regenerating any of them.
+
+    Each node carries its own copy of the story context, so sibling branches
+    never share (or overwrite) state.
+    """
+
+    def __init__(self, tree_id, path, user_theme, max_depth):
+        self.tree_id = tree_id
+        self.path = path
+        self.user_theme = user_theme
+        self.max_depth = max_depth
+        self.nodes = {}
+        self.children = {}
+        self.root_id = None
+        self.pending = 0
+        self.failed = 0
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, tree_id, path):
+        build = None
+        valid_bytes = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by the interruption; that node is redone.
+                    break
+                valid_bytes += len(line)
+                if entry["type"] == "tree":
+                    build = cls(tree_id, path, entry["user_theme"], entry["max_depth"])
+                elif entry["type"] == "node" and build is not None:
+                    build._add(entry["node"])
+        if build is None:
+            raise ValueError(f"{path} is not a tree checkpoint log")
+        # Drop the torn line so new entries don't get appended onto it.
+        if os.path.getsize(path) > valid_bytes:
+            with open(path, "r+b") as f:
+                f.truncate(valid_bytes)
+        return build
+
+    def _append(self, entry):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_header(self):
+        self._append({"type": "tree", "user_theme": self.user_theme, "max_depth": self.max_depth})
+
+    def _add(self, node):
+        self.nodes[node["node_id"]] = node
+        if node["parent"] is None:
+            self.root_id = node["node_id"]
+        else:
+            self.children[(node["parent"], node["action"])] = node["node_id"]
+
+    def add_node(self, parent, action, depth, record, context):
+        node = {
+            "node_id": str(uuid.uuid4()),
+            "parent": parent,
+            "action": action,
+            "depth": depth,
+            "record": record,
+            "context": context,
+        }
+        with self._lock:
+            self._append({"type": "node", "node": node})
+            self._add(node)
+        return node
+
+    def missing_children(self, node):
+        """Actions of `node` whose scene hasn't been generated yet."""
+        if node["depth"] >= self.max_depth:
+            return []
+        actions = node["record"].get("result", {}).get("actions", [])
+        with self._lock:
+            return [action for action in actions if (node["node_id"], action) not in self.children]
+
+    def tree(self, node_id=None):
+        """The tree as nested {node_id, data, branches} dicts."""
+        node_id = node_id or self.root_id
+        if node_id is None:
+            return None
+        node = self.nodes[node_id]
+        branches = {}
+        for action in node["record"].get("result", {}).get("actions", []):
+            child_id = self.children.get((node_id, action))
+            if child_id:
+                branches[action] = self.tree(child_id)
+        return {"node_id": node_id, "data": node["record"], "branches": branches}
+
+    def progress(self):
+        with self._lock:
+            return {
+                "tree_id": self.tree_id,
+                "status": "completed" if self.done.is_set() else "processing",
+                "max_depth": self.max_depth,
+                "nodes": len(self.nodes),
+                "pending": self.pending,
+                "failed": self.failed,
+            }
+
+
+class TreeBuilder:
+    """
+    Pre-generates story trees on the server. Frontier nodes of every build
+    are expanded concurrently, sharing one pool of `workers` threads.
+
+    `generate(node_id, context, user_theme=None, user_action=None)` must
+    return the (record, context) of the generated scene, where `context` is
+    the story context to build its children from.
+    """
+
+    def __init__(self, generate, directory="trees", workers=4):
+        self.generate = generate
+        self.directory = directory
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tree")
+        self._builds = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, tree_id):
+        return os.path.join(self.directory, f"{tree_id}.jsonl")
+
+    def start(self, user_theme, max_depth):
+        tree_id = str(uuid.uuid4())
+        build = TreeBuild(tree_id, self._path(tree_id), user_theme, max_depth)
+        build.write_header()
+        build.pending = 1
+        with self._lock:
+            self._builds[tree_id] = build
+        self._run(build)
+        return build
+
+    def get(self, tree_id):
+        """Returns the build, loading it from its checkpoint log if needed."""
+        with self._lock:
+            build = self._builds.get(tree_id)
+        if build is None and os.path.exists(self._path(tree_id)):
+            build = TreeBuild.load(tree_id, self._path(tree_id))
+            with self._lock:
+                build = self._builds.setdefault(tree_id, build)
+        return build
+
+    def resume(self, tree_id):
+        """Continues an interrupted build from its checkpoint log."""
+        build = self.get(tree_id)
+        if build is None:
+            return None
+        with build._lock:
+            if build.pending > 0:
+                return build
+            build.pending = 1
+            build.failed = 0
+            build.done.clear()
+        self._run(build)
+        return build
+
+    def _run(self, build):
+        """
+        Queues every missing node of the build. The caller has already counted
+        this as one pending job, so a concurrent resume() sees the build as
+        running and it can't be marked done before the gaps are queued.
+        """
+        try:
+            if build.root_id is None:
+                self._submit(build, None, None, 0)
+            else:
+                # Walk what has already been generated and fill in the gaps.
+                for node in list(build.nodes.values()):
+                    self._expand(build, node)
+        finally:
+            self._finish_one(build)
+
+    def _expand(self, build, node):
+        for action in build.missing_children(node):
+            self._submit(build, node, action, node["depth"] + 1)
+
+    def _submit(self, build, parent, action, depth):
+        with build._lock:
+            build.pending += 1
+        self._executor.submit(self._generate, build, parent, action, depth)
+
+    def _generate(self, build, parent, action, depth):
+        try:
+            if parent is None:
+                print(f"[tree {build.tree_id}] Generating root scene")
+                record, context = self.generate(build.tree_id, {}, user_theme=build.user_theme)
+            else:
+                print(f"[tree {build.tree_id}] Generating depth {depth}: {action}")
+                node_id = f"{build.tree_id}/{parent['node_id']}"
+                record, context = self.generate(node_id, parent["context"], user_action=action)
+            node = build.add_node(parent and parent["node_id"], action, depth, record, context)
+            self._expand(build, node)
+        except Exception as e:
+            print(f"[tree {build.tree_id}] Node for '{action}' failed: {e}")
+            with build._lock:
+                build.failed += 1
+        finally:
+            self._finish_one(build)
+
+    def _finish_one(self, build):
+        with build._lock:
+            build.pending -= 1
+            if build.pending == 0:
+                build.done.set()
+                print(f"[tree {build.tree_id}] Done: {len(build.nodes)} nodes, {build.failed} failed")
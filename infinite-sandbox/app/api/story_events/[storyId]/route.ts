@@ -0,0 +1,32 @@
+export async function GET(request: Request, { params }: { params: { storyId: string } }) {
+  const storyId = params.storyId
+
+  try {
+    const response = await fetch(`https://infinite-sandbox.onrender.com/story_events/${storyId}`, {
+      cache: 'no-store',
+      headers: {
+        'Accept': 'text/event-stream',
+      },
+      signal: request.signal,
+    })
+
+    if (!response.ok || !response.body) {
+      throw new Error(`HTTP error! status: ${response.status}`)
+    }
+
+    // Pass the event stream straight through to the browser.
+    return new Response(response.body, {
+      headers: {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache, no-transform',
+        'Connection': 'keep-alive',
+      }
+    })
+  } catch (error) {
+    console.error("Error in story events:", error)
+    return new Response(JSON.stringify({ error: "Failed to open story events" }), {
+      status: 500,
+      headers: { 'Content-Type': 'application/json' },
+    })
+  }
+}
@@ -0,0 +1,49 @@
+"use client"
+
+import { useEffect, useRef, useState } from "react"
+
+interface SlideshowProps {
+  images: string[]
+  playing: boolean
+  // Seconds for one pass over the images, as long as the video it stands in for.
+  duration?: number
+  onEnded: () => void
+}
+
+// Plays a scene's images in place of a video that isn't there (yet), then
+// stays on the last one.
+export default function Slideshow({ images, playing, duration = 10, onEnded }: SlideshowProps) {
+  const [index, setIndex] = useState(0)
+  // Held in a ref so a re-render of the parent doesn't restart the current slide.
+  const onEndedRef = useRef(onEnded)
+  onEndedRef.current = onEnded
+
+  useEffect(() => {
+    if (!playing || images.length === 0) return
+    const timeout = setTimeout(() => {
+      if (index + 1 < images.length) {
+        setIndex(index + 1)
+      } else {
+        onEndedRef.current()
+      }
+    }, (duration * 1000) / images.length)
+    return () => clearTimeout(timeout)
+  }, [index, playing, images.length, duration])
+
+  return (
+    <div className="absolute inset-0 bg-black">
+      {images.map((src, i) => (
+        // Scene images come from the backend or DALLE, not a fixed set of hosts for next/image.
+        // eslint-disable-next-line @next/next/no-img-element
+        <img
+          key={src}
+          src={src}
+          alt=""
+          className={`absolute inset-0 w-full h-full object-cover transition-opacity duration-1000 ${
+            i === index ? "opacity-100" : "opacity-0"
+          }`}
+        />
+      ))}
+    </div>
+  )
+}
@@ -6,6 +6,7 @@ import { VolumeIcon, VolumeXIcon, XIcon } from "lucide-react"
 import ReactPlayer from "react-player"
 import { useStory } from "@/hooks/useStory"
 import LoadingScreen from "./LoadingScreen"
+import Slideshow from "./Slideshow"
 
 interface StoryScreenProps {
   onQuit: () => void
@@ -34,7 +35,7 @@ export default function StoryScreen({ onQuit, isQuitConfirmationOpen, theme }: S
     if (status?.result?.narration_audio) {
       const audioElement = audioRef.current
       if (audioElement) {
-        audioElement.src = `data:audio/mp3;base64,${status.result.narration_audio}`
+        audioElement.src = status.result.narration_audio
         if (isPlaying) {
           audioElement.play().catch(console.error)
         }
@@ -68,6 +69,12 @@ export default function StoryScreen({ onQuit, isQuitConfirmationOpen, theme }: S
     return <div>Error: {error}</div>
   }
 
+  // Degraded scenes may come without a video (their images play as a
+  // slideshow instead) or without narration audio (the text is still shown).
+  const video = status.result?.video
+  const slideshow = status.result?.slideshow ?? []
+  const showChoices = videoEnded || (!video && slideshow.length === 0)
+
   return (
     <div className="fixed inset-0 w-full h-full flex flex-col bg-gradient-to-b from-[#1A2A3A] via-[#223344] to-[#1A2A3A]">
       {/* Quit Button */}
@@ -79,29 +86,36 @@ export default function StoryScreen({ onQuit, isQuitConfirmationOpen, theme }: S
       </Button>
 
       <div className="relative w-full flex-grow overflow-hidden border-t-4 border-b-4 border-[#B8D1E5] dark:border-[#5A7A99]">
-        <ReactPlayer
-          ref={playerRef}
-          url={status.result?.video}
-          playing={isPlaying}
-          muted={true}
-          width="100%"
-          height="100%"
-          style={{ position: "absolute", top: "50%", left: "50%", transform: "translate(-50%, -50%)" }}
-          onEnded={handleVideoEnd}
-        />
+        {video ? (
+          <ReactPlayer
+            ref={playerRef}
+            url={video}
+            playing={isPlaying}
+            muted={true}
+            width="100%"
+            height="100%"
+            style={{ position: "absolute", top: "50%", left: "50%", transform: "translate(-50%, -50%)" }}
+            onEnded={handleVideoEnd}
+          />
+        ) : slideshow.length > 0 ? (
+          <Slideshow key={slideshow.join(" ")} images={slideshow} playing={isPlaying} onEnded={handleVideoEnd} />
+        ) : null}
         <audio ref={audioRef} muted={isMuted} />
         
-        <button
-          onClick={toggleMute}
-          className="absolute bottom-4 right-4 z-10 p-2 rounded-full bg-white/20 hover:bg-white/30"
-        >
-          {isMuted ? <VolumeXIcon className="text-white" /> : <VolumeIcon className="text-white" />}
-        </button>
+        {status.result?.narration_audio && (
+          <button
+            onClick={toggleMute}
+            className="absolute bottom-4 right-4 z-10 p-2 rounded-full bg-white/20 hover:bg-white/30"
+          >
+            {isMuted ? <VolumeXIcon className="text-white" /> : <VolumeIcon className="text-white" />}
+          </button>
+        )}
       </div>
 
       <div className="p-4 text-white">
+        {/* Also the captions when the narration audio is missing. */}
         <p className="text-lg mb-4">{status.result?.narration_text}</p>
-        {videoEnded && (
+        {showChoices && (
           <div className="flex flex-wrap gap-4">
             {status.result?.actions.map((action, index) => (
               <Button
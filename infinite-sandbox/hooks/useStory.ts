@@ -1,10 +1,15 @@
 import { useState, useEffect, useRef } from "react"
 
 interface StoryResult {
-  video: string
-  narration_audio: string
+  // Null when the scene is degraded: it may still arrive late, or never.
+  video: string | null
+  narration_audio: string | null
   narration_text: string
   actions: string[]
+  // The scene's images, to play instead of a missing video.
+  slideshow?: string[]
+  // Why each missing stage is missing: "timeout" (may still arrive) or "error".
+  degraded?: Record<string, "timeout" | "error">
 }
 
 interface StoryStatus {
@@ -12,6 +17,14 @@ interface StoryStatus {
   result?: StoryResult
 }
 
+// Whether a finished scene still has a late video or narration to wait for.
+const awaitingMedia = (status: StoryStatus | null) =>
+  Object.values(status?.result?.degraded ?? {}).includes("timeout")
+
+// Whether there is nothing more to hear about the current scene.
+const isSettled = (status: StoryStatus) =>
+  status.status === "error" || (status.status === "completed" && !awaitingMedia(status))
+
 export function useStory(theme?: string) {
   const [storyId, setStoryId] = useState<string | null>(null)
   const [status, setStatus] = useState<StoryStatus | null>(null)
@@ -40,12 +53,12 @@ export function useStory(theme?: string) {
     try {
       const response = await fetch(`/api/story_status/${id}`)
       if (!response.ok) throw new Error("Failed to fetch story status")
-      const data = await response.json()
+      const data: StoryStatus = await response.json()
       setStatus(data)
-      return data.status
+      return data
     } catch (err) {
       setError("Failed to fetch story status")
-      return "error"
+      return null
     }
   }
 
@@ -75,22 +88,54 @@ export function useStory(theme?: string) {
     }
   }, [theme])
 
+  // Listen while a scene is being generated, and after it completes for as
+  // long as its video or narration may still arrive late.
+  const listening = status?.status === "processing" || awaitingMedia(status)
+
   useEffect(() => {
     let intervalId: NodeJS.Timeout | null = null;
-    
-    if (storyId && status?.status === "processing") {
+    let source: EventSource | null = null;
+
+    const startPolling = (id: string) => {
       intervalId = setInterval(async () => {
-        const currentStatus = await pollStatus(storyId)
-        if (currentStatus === "completed" || currentStatus === "error") {
+        const currentStatus = await pollStatus(id)
+        if (!currentStatus || isSettled(currentStatus)) {
           if (intervalId) clearInterval(intervalId)
         }
       }, 5000)
     }
 
+    if (storyId && listening) {
+      if (typeof EventSource === "undefined") {
+        startPolling(storyId)
+      } else {
+        // Get pushed the scene's progress; fall back to polling if the stream breaks.
+        source = new EventSource(`/api/story_events/${storyId}`)
+        const onStatus = (event: Event) => {
+          const data = JSON.parse((event as MessageEvent).data)
+          // Progress events before the scene completes carry no status.
+          if (!data.status) return
+          if (isSettled(data)) source?.close()
+          setStatus(data)
+        }
+        source.addEventListener("completed", onStatus)
+        // Sent again with the full status when a late video / narration arrives (or fails).
+        source.addEventListener("video_done", onStatus)
+        source.addEventListener("audio_done", onStatus)
+        source.onerror = () => {
+          source?.close()
+          pollStatus(storyId).then((currentStatus) => {
+            if (currentStatus && !isSettled(currentStatus)) startPolling(storyId)
+          })
+        }
+      }
+    }
+
     return () => {
       if (intervalId) clearInterval(intervalId)
+      if (source) source.close()
     }
-  }, [storyId, status?.status])
+  }, [storyId, listening])
 
   return { storyId, status, error, nextScene }
 } 
\ No newline at end of file